@@ -1,144 +1,17 @@
+import numpy as np
+from graph_tools import ConstructGraph
+from algorithms import pairwise_exchange
+from algorithms.budget import get_budget
 #Solve the TSP problem with the ant_colony algorithm
+#The colony works on dense matrices: times, eta (heuristic) and tau (pheromone), and every ant moves at the same time.
 
 class ant_colony:
 
-    class ant():
-
-        def __init__(self, graph, start_node, alpha, beta, first_pass=False, heuristic=None):
-            """Create an ant
-            
-            Args:
-                graph: The graph to visit
-                start: The node where the ant starts
-                alpha: The alpha parameter of the algorithm, usually smaller than 1
-                beta: The beta parameter of the algorithm, usually bigger than 1"""
-
-            self.graph = graph
-            self.start_node = start_node
-            self.path = [start_node]
-            self.current = start_node
-            self.distance = float(0)
-            self.alpha = alpha
-            self.beta = beta
-            
-            self.finished = False
-            self.first_pass = first_pass
-
-            if heuristic is None:
-                self.heuristic = self._heuristic
-
-        def run(self):
-            """Run the ant until it has visited all the nodes"""
-            while len(self.path) < len(self.graph):
-                self._move()
-
-            self.path.append(self.start_node)
-            self.finished = True
-
-        def _move(self):
-            """Move the ant to the next node and update the path and the distance"""
-
-            #Get the neighbors of the current node
-            neighbors = list(self.graph[self.current].keys())
-
-            #Remove the nodes already visited
-            for node in self.path:
-                if node in neighbors:
-                    neighbors.remove(node)
-
-            #If there is no neighbor, the ant is stuck
-            if len(neighbors) == 0:
-                self.distance += self.graph[self.current][self.start_node]["time"]
-                self.current = self.start_node
-                self.path.append(self.start_node)
-
-                self.finished = True
-                return
-
-            #Compute the probability of each neighbor
-            probabilities = self._probability(neighbors)
-
-            #Choose the next node
-            next_node = self._choose(probabilities)
-
-            #Add the distance to the total distance
-            self.distance += self.graph[self.current][next_node]["time"]
-
-            #Update the current node and the path
-            self.current = next_node
-            self.path.append(next_node)
-        
-        def _probability(self, visitable_nodes):
-            """Compute the probability of going to the node
-            Use the function on the wikipedia page
-            
-            Args:
-                node: The node to go to
-            
-            Returns:
-                The probability of going to the node"""
-
-            sum_of_probabilities = 0
-            probabilities = {}
-
-            #If it's the first pass, the probability is 1 for each node
-            if self.first_pass:
-                for node in visitable_nodes:
-                    probabilities[node] = 1
-                    sum_of_probabilities += probabilities[node]
-            else:
-                for node in visitable_nodes:
-                    probabilities[node] = self.heuristic(node) ** self.beta * self.graph[self.current][node]["pheromone"] ** self.alpha
-                    sum_of_probabilities += probabilities[node]
-
-            #Normalize the probabilities
-            if sum_of_probabilities == 0:
-                for node in visitable_nodes:
-                    probabilities[node] = 1 / len(visitable_nodes)
-            else:
-                for node in visitable_nodes:
-                    probabilities[node] /= sum_of_probabilities
-
-            #Compute the probability
-            return probabilities
-
-        def _choose(self, probabilities):
-            """Choose the next node to go to
-            
-            Args:
-                probabilities: The probabilities of each node
-            
-            Returns:
-                The node to go to"""
-            
-            from random import random
-
-            #Choose a random number between 0 and 1
-            r = random()
-
-            #Choose the node
-            for node in probabilities.keys():
-                r -= probabilities[node]
-                if r <= 0:
-                    return node
-
-        
-        def _heuristic(self, node):
-            """Compute the heuristic of the node
-            Use the function on the wikipedia page
-            
-            Args:
-                node: The node to compute the heuristic
-            
-            Returns:
-                The heuristic of the node"""
-            return 1 / self.graph[self.current][node]["time"]
-        
-    def __init__(self, graph, start_node, alpha=0.5, beta=2, rho=0.5, n_ants=10, omega=100, first_pass=True, heuristic=None):
+    def __init__(self, graph, start_node, alpha=0.5, beta=2, rho=0.5, n_ants=10, omega=100, first_pass=True, heuristic=None, matrix=None, seed=None):
         """Create an ant_colony object
-        
+
         Args:
-            graph: The graph to visit
+            graph: The graph to visit, it is not modified
             start: The node where the ants start
             alpha: The alpha parameter of the algorithm, usually smaller than 1
             beta: The beta parameter of the algorithm, usually bigger than 1
@@ -146,10 +19,10 @@ class ant_colony:
             n_ants: The number of ants
             omega: The omega parameter of the algorithm, stop the algorithm if the best ant has not improved for omega iterations
             first_pass: If True, the ants will visit all the nodes randomly on the first pass
-            heuristic: The heuristic function to use"""
+            heuristic: The function giving the eta matrix from the times matrix, 1 / time if None
+            matrix: The (nodes, times) of the graph given by ConstructGraph.to_matrix, computed if None
+            seed: The seed of the random generator"""
 
-        self.graph = graph
-        self.start_node = start_node
         if alpha < 0 :
             raise ValueError("alpha must be positive")
         self.alpha = alpha
@@ -162,70 +35,243 @@ class ant_colony:
         self.n_ants = n_ants
         self.omega = omega
         self.first_pass = first_pass
-        self.heuristic = heuristic
+        self.random = np.random.default_rng(seed)
+
+        if matrix is None:
+            matrix = ConstructGraph.to_matrix(graph)
+        self.nodes, self.times = matrix
+        self.start = self.nodes.index(start_node)
+
+        if heuristic is None:
+            #Two places snapped to the same node are 0 seconds apart
+            with np.errstate(divide="ignore"):
+                self.eta = 1 / np.maximum(self.times, 1e-6)
+        else:
+            self.eta = heuristic(self.times)
+        self.eta_beta = self.eta ** self.beta
+        self.tau = np.ones_like(self.times)
 
-        self.ants = []
+    def run(self, budget=None):
+        """Run the algorithm
 
-    def run(self):
-        """Run the algorithm"""
-        #Create the ants
-        best_ant = self.ant(self.graph, self.start_node, self.alpha, self.beta, self.first_pass, self.heuristic)
-        best_ant.path = []
-        best_ant.distance = float("inf")
+        Args:
+            budget: The Budget of the colony, an iteration being an iteration of the colony, no limit if None.
+                The algorithm stops at omega iterations without improvement or when the budget is spent
+
+        Returns:
+            The best tour found, starting and ending at the start node"""
+
+        budget = get_budget(budget)
+        best_path = None
+        best_distance = float("inf")
         #Run the iterations
         no_improvement = 0
         iteration = 0
         while no_improvement < self.omega:
-            self._iteration()
+            paths, distances = self._iteration()
             iteration += 1
-            old_best_ant_distance = best_ant.distance
-            for ant in self.ants:
-                if ant.distance < best_ant.distance:
-                    best_ant = ant
-            
+
+            best = int(np.argmin(distances))
             #If the best ant has not improved, increment no_improvement
-            if old_best_ant_distance == best_ant.distance:
-                no_improvement += 1
-            else:
+            if distances[best] < best_distance:
+                best_distance = float(distances[best])
+                best_path = paths[best]
                 no_improvement = 0
-        
+            else:
+                no_improvement += 1
+            if not budget.step(best_distance):
+                break
+
         print("Number of iterations: " + str(iteration))
-        #Find the best ant
 
-        return best_ant.path
+        return [self.nodes[i] for i in best_path] + [self.nodes[self.start]]
 
     def _iteration(self):
-        """Run one iteration of the algorithm"""
-        #Create the ants
-        self.ants = []
-        for i in range(self.n_ants):
-            self.ants.append(self.ant(self.graph, self.start_node, self.alpha, self.beta, self.first_pass, self.heuristic))
+        """Run one iteration of the algorithm
 
-        #Run the ants
-        for ant in self.ants:
-            ant.run()
+        Returns:
+            The paths of the ants, one row per ant without the return to the start, and the time of their tours"""
 
-        #Update the pheromone
-        self._update_pheromone()
+        #Attractiveness of the edges, the same for every ant
+        if self.first_pass:
+            weights = np.ones_like(self.times)
+        else:
+            weights = self.tau ** self.alpha * self.eta_beta
 
+        paths = self._construct(weights)
+        distances = self.times[paths, np.roll(paths, -1, axis=1)].sum(axis=1)
+        self._update_pheromone(paths, distances)
         self.first_pass = False
-    
-    def _update_pheromone(self):
+        return paths, distances
+
+    def _construct(self, weights, allowed=None):
+        """Build the paths of all the ants at the same time
+
+        Args:
+            weights: The attractiveness of each edge
+            allowed: The edges an ant chooses from while one of them leads to a node not visited yet, every edge if None
+
+        Returns:
+            The paths of the ants, one row per ant without the return to the start"""
+
+        n = len(self.nodes)
+        ants = np.arange(self.n_ants)
+        paths = np.empty((self.n_ants, n), dtype=np.int64)
+        paths[:, 0] = self.start
+        visited = np.zeros((self.n_ants, n), dtype=bool)
+        visited[:, self.start] = True
+
+        for step in range(1, n):
+            current = paths[:, step - 1]
+            probabilities = np.where(visited, 0.0, weights[current])
+            if allowed is not None:
+                #The ants with no allowed node left go to the most attractive node left
+                restricted = np.where(allowed[current], probabilities, 0.0)
+                outside = ~(restricted.sum(axis=1) > 0)
+                restricted[outside] = 0.0
+                restricted[outside, np.argmax(np.where(visited[outside], -1.0, probabilities[outside]), axis=1)] = 1.0
+                probabilities = restricted
+            #The ants whose every weight vanished choose uniformly among the nodes left
+            stuck = ~(probabilities.sum(axis=1) > 0)
+            probabilities[stuck] = ~visited[stuck]
+
+            #Roulette on the cumulative sum of each row
+            cumulative = np.cumsum(probabilities, axis=1)
+            r = self.random.random(self.n_ants) * cumulative[:, -1]
+            next_nodes = np.minimum((cumulative <= r[:, None]).sum(axis=1), n - 1)
+            paths[:, step] = next_nodes
+            visited[ants, next_nodes] = True
+
+        return paths
+
+    def _update_pheromone(self, paths, distances):
         """Update the pheromone of each edge with the formula on the wikipedia page"""
-        for edge in self.graph:
-            for edge2 in self.graph[edge]:
-                #Remove the pheromone
-                if not self.first_pass:
-                    self.graph[edge][edge2]["pheromone"] *= (1 - self.rho)
-                else:
-                    max = 0
-                    #If it's the first pass, the pheromone is equal to 1 devided by the maximum distance
-                    for ant in self.ants:
-                        if ant.distance > max:
-                            max = ant.distance
-                    self.graph[edge][edge2]["pheromone"] = 1 / max
-
-            #Add the pheromone
-        for ant in self.ants:
-            for i in range(len(ant.path) - 1):
-                self.graph[ant.path[i]][ant.path[i + 1]]["pheromone"] += 1 / ant.distance
\ No newline at end of file
+        if self.first_pass:
+            #If it's the first pass, the pheromone is equal to 1 devided by the maximum distance
+            self.tau.fill(1 / distances.max())
+        else:
+            #Remove the pheromone
+            self.tau *= (1 - self.rho)
+
+        #Add the pheromone
+        deposits = np.repeat(1 / distances, paths.shape[1])
+        np.add.at(self.tau, (paths.ravel(), np.roll(paths, -1, axis=1).ravel()), deposits)
+
+
+class max_min_ant_system(ant_colony):
+
+    def __init__(self, graph, start_node, alpha=1, beta=3, rho=0.02, n_ants=None, omega=30, candidates=10, p_best=0.05, global_best_frequency=5, local_search=True, heuristic=None, matrix=None, seed=None):
+        """Create a MAX-MIN Ant System, an ant colony converging in much fewer iterations
+        Only the best ant adds pheromone, the pheromone is kept between tau_min and tau_max so the colony does not stagnate,
+        the ants choose among the nearest neighbours of their node and the best tour of each iteration is improved by local search.
+
+        Args:
+            graph: The graph to visit, it is not modified
+            start_node: The node where the ants start
+            alpha: The alpha parameter of the algorithm
+            beta: The beta parameter of the algorithm
+            rho: The evaporation of the pheromone, between 0 and 1
+            n_ants: The number of ants, the number of nodes up to 25 if None
+            omega: Stop the algorithm if the best ant has not improved for omega iterations
+            candidates: The number of nearest neighbours an ant chooses from
+            p_best: The probability for an ant to build the best tour once converged, gives tau_min
+            global_best_frequency: The best tour so far adds pheromone every global_best_frequency iterations,
+                the best tour of the iteration the other times
+            local_search: If True, the best tour of each iteration is improved with the 2-opt and Or-opt moves of pairwise_exchange
+            heuristic: The function giving the eta matrix from the times matrix, 1 / time if None
+            matrix: The (nodes, times) of the graph given by ConstructGraph.to_matrix, computed if None
+            seed: The seed of the random generator"""
+
+        n = len(matrix[0]) if matrix is not None else len(graph)
+        if n_ants is None:
+            n_ants = min(n, 25)
+        super().__init__(graph, start_node, alpha, beta, rho, n_ants, omega, False, heuristic, matrix, seed)
+        self.p_best = p_best
+        self.global_best_frequency = global_best_frequency
+        self.local_search = local_search
+
+        #Candidate lists: the nearest neighbours of each node
+        k = min(candidates, n - 1)
+        neighbours = np.argsort(self.times + np.diag(np.full(n, np.inf)), axis=1)[:, :k]
+        self.allowed = np.zeros((n, n), dtype=bool)
+        self.allowed[np.arange(n)[:, None], neighbours] = True
+
+        #The pheromone starts at tau_max of the nearest neighbour tour
+        self.best_path = np.array(pairwise_exchange.nearest_neighbour_tour(self.times, self.start), dtype=np.int64)
+        if self.local_search:
+            self.best_path = pairwise_exchange.local_search(self.times, self.best_path)
+        self.best_distance = pairwise_exchange.tour_time(self.times, self.best_path)
+        self._update_bounds()
+        self.tau.fill(self.tau_max)
+        self.iteration = 0
+
+    def run(self, budget=None):
+        """Run the algorithm
+
+        Args:
+            budget: The Budget of the colony, an iteration being an iteration of the colony, no limit if None.
+                The algorithm stops at omega iterations without improvement or when the budget is spent
+
+        Returns:
+            The best tour found, starting and ending at the start node"""
+
+        budget = get_budget(budget)
+        budget.improve(self.best_distance)
+        no_improvement = 0
+        iteration = 0
+        while no_improvement < self.omega and not budget.exhausted():
+            best_distance = self.best_distance
+            self._iteration(budget.remaining())
+            iteration += 1
+
+            #The best tour so far includes the starting tour and the tours improved by local search
+            if self.best_distance < best_distance:
+                no_improvement = 0
+            else:
+                no_improvement += 1
+            budget.step(self.best_distance)
+
+        print("Number of iterations: " + str(iteration))
+
+        return [self.nodes[i] for i in self.best_path] + [self.nodes[self.start]]
+
+    def _iteration(self, time_budget=None):
+        """Run one iteration of the algorithm
+
+        Args:
+            time_budget: The maximum number of seconds of the local search, no limit if None
+
+        Returns:
+            The paths of the ants, one row per ant without the return to the start, and the time of their tours"""
+
+        paths = self._construct(self.tau ** self.alpha * self.eta_beta, self.allowed)
+        distances = self.times[paths, np.roll(paths, -1, axis=1)].sum(axis=1)
+
+        best = int(np.argmin(distances))
+        if self.local_search:
+            paths[best] = pairwise_exchange.local_search(self.times, paths[best], time_budget=time_budget)
+            distances[best] = pairwise_exchange.tour_time(self.times, paths[best])
+        if distances[best] < self.best_distance:
+            self.best_path = paths[best].copy()
+            self.best_distance = float(distances[best])
+            self._update_bounds()
+
+        self.iteration += 1
+        if self.iteration % self.global_best_frequency == 0:
+            self._update_pheromone(self.best_path[None, :], np.array([self.best_distance]))
+        else:
+            self._update_pheromone(paths[best][None, :], distances[best:best + 1])
+        return paths, distances
+
+    def _update_pheromone(self, paths, distances):
+        """Evaporate the pheromone, add the pheromone of the best ant and keep it between tau_min and tau_max"""
+        self.tau *= (1 - self.rho)
+        np.add.at(self.tau, (paths.ravel(), np.roll(paths, -1, axis=1).ravel()), np.repeat(1 / distances, paths.shape[1]))
+        np.clip(self.tau, self.tau_min, self.tau_max, out=self.tau)
+
+    def _update_bounds(self):
+        """Compute tau_max and tau_min from the best tour so far"""
+        n = len(self.nodes)
+        self.tau_max = 1 / (self.rho * self.best_distance)
+        root = self.p_best ** (1 / n)
+        self.tau_min = min(self.tau_max, self.tau_max * (1 - root) / (max(n / 2 - 1, 1) * root))
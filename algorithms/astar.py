@@ -1,123 +1,271 @@
 from heapq import heappop, heappush
-import networkx as nx
-import math
- 
+import numpy as np
+import os
+from graph_tools.CompiledGraph import as_compiled
+from algorithms.dijkstra import join_predecessors, path_from_predecessor
+
+#Folder where the landmark tables are saved, named by the fingerprint of the graph and the number of landmarks
+landmarks_cache_folder = os.path.join("cache", "landmarks")
+
+#Number of landmarks of the ALT heuristic
+number_of_landmarks = 8
+
+#Landmark tables already loaded in this session, keyed by the fingerprint of the graph and the number of landmarks
+_landmark_tables = {}
 
 def astar(Graph, source, target):
-    """Find shortest weighted paths in G from source to target using  A* algorithm.
+    """Find shortest weighted paths in G from source to target using the two way A* algorithm.
+    The heuristic is the great circle distance divided by the maximum speed of the graph, so it never
+    overestimates the travel time. It is precomputed for every node in one NumPy pass, and the two searches
+    use the average of the distance to the target and from the source so they can stop like the two way Dijkstra.
     Parameters:
     -----------
-    G : NetworkX oriented graph
+    G : NetworkX oriented graph or CompiledGraph
     source : node
        Starting node for path
     target : node
          Ending node for path
-    weight : string, optional (default='weight')
-         Edge data key corresponding to the edge weight
     Returns:
     --------
-    distance : dictionary
-         Dictionary of shortest weighted paths keyed by target.
+    time : float
+        Shortest time from source to target.
+    path : list
+        List of nodes in a shortest path.
     """
 
-    
-    def heuristic(u, v):
-        # Get the latitude and longitude coordinates of the nodes
-        lat1 = Graph.nodes[u]["y"]
-        lon1 = Graph.nodes[u]["x"]
-        lat2 = Graph.nodes[v]["y"]
-        lon2 = Graph.nodes[v]["x"]
-        
-        # Convert the coordinates to radians
-        lat1 = lat1 * math.pi / 180
-        lon1 = lon1 * math.pi / 180
-        lat2 = lat2 * math.pi / 180
-        lon2 = lon2 * math.pi / 180
-        
-        # Calculate the great circle distance between the two points
-        a = math.sin((lat2-lat1)/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2-lon1)/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        d = 6371000 * c 
-        d = d / 1000 #Convert to kilometers
-        d = d / 30 #Convert to minutes
-        
-        return d
-    
     if source == target:
         return (0, [source])
 
-    push = heappush
-    pop = heappop
+    Graph = as_compiled(Graph)
+    s = Graph.node_index(source)
+    t = Graph.node_index(target)
 
-    #Create an heuristic target variable to let it switch between the source and the target
-    heuristic_target = [target, source]
+    #Potential of the forward search, the backward search uses its opposite
+    potential = (heuristic_times(Graph, t) - heuristic_times(Graph, s)) / 2
+    potentials = [potential, -potential]
 
+    push = heappush
+    pop = heappop
 
-    neighbor_list=[Graph._succ,Graph._pred]
+    indptr = [Graph.forward_indptr, Graph.backward_indptr]
+    indices = [Graph.forward_indices, Graph.backward_indices]
+    times = [Graph.forward_times, Graph.backward_times]
 
-    #We are using the two way A* algorithm, so we need to keep track of the distances from both the source and the target
-    out = [{}, {}] #List of dictionaries, each dictionary contains the distance from the source/target to each node
-    path = [{},{}]  # dictionary of paths
-    seen = [{source : 0},{target : 0}]  # dictionary of nodes that have been visited
-    to_explore = [[],[]] # heap of (distance, heuristic, label) tuples for all non-seen nodes
+    out = [{}, {}] #Distance from the source/target to each settled node
+    seen = [{s : 0},{t : 0}] #Best distance found so far for each node
+    predecessor = [{s : None},{t : None}] #Previous node on the path from the source/to the target
+    to_explore = [[(float(potential[s]), 0, s)],[(float(-potential[t]), 0, t)]] #Heaps of (distance + potential, distance, label) tuples
 
-    #Initialize the heap with the source and target
-    push(to_explore[0], (heuristic(source, target), 0,  source))
-    push(to_explore[1], (heuristic(target, source), 0,  target))
-    
-    #Initialize the path with the source and target
-    path[0][source] = [source]
-    path[1][target] = [target]
+    best = float('inf') #Length of the best path found so far
+    meeting = None #Node where the two halves of the best path meet
 
     direction = 1 #Direction of the search, 0 is forward, 1 is backward
 
     while to_explore[0] and to_explore[1]:
 
+        #With opposite potentials, the stopping rule of the two way Dijkstra still holds
+        if to_explore[0][0][0] + to_explore[1][0][0] >= best:
+            break
+
         direction = 1 - direction #Switch direction
 
-        #Pop the smallest distance node from the heap
         ( _ , dist, v) = pop(to_explore[direction])
 
         if v in out[direction]:
             continue
-        
+
         out[direction][v] = dist
 
-        #Check if the node has been visited by the other search
-        if v in out[1-direction]:
-            #If it has, we have found a shortest path
-            return (out[0][v] + out[1][v], path[0][v] + list(reversed(path[1][v]))[1:])
-        
-        for neighbor in neighbor_list[direction][v]:
-            if neighbor not in out[direction]:
-                weight = weight_node(v, neighbor, out[direction], Graph, direction)
-                #If the neighbor has not been visited, add it to the heap
-                if neighbor not in seen[direction]:
-                    seen[direction][neighbor] = weight
-                    push(to_explore[direction], (weight + heuristic(neighbor, heuristic_target[direction]), weight, neighbor))
-                    path[direction][neighbor] = path[direction][v] + [neighbor]
-                #If the neighbor has been visited, but the new path is shorter, update the heap
-                elif weight < seen[direction][neighbor]:
-                    seen[direction][neighbor] = weight
-                    push(to_explore[direction],  (weight + heuristic(neighbor, heuristic_target[direction]), weight, neighbor))
-                    path[direction][neighbor] = path[direction][v] + [neighbor]
-            
+        start, end = indptr[direction][v:v+2].tolist()
+        neighbors = indices[direction][start:end]
+        for neighbor, time, bound in zip(neighbors.tolist(), times[direction][start:end].tolist(), potentials[direction][neighbors].tolist()):
+            if neighbor in out[direction]:
+                continue
+            weight = dist + time
+            #If the neighbor has not been visited or the new path is shorter, update the heap
+            if neighbor not in seen[direction] or weight < seen[direction][neighbor]:
+                seen[direction][neighbor] = weight
+                predecessor[direction][neighbor] = v
+                push(to_explore[direction], (weight + bound, weight, neighbor))
+                #Check if the node links the two searches with a shorter path
+                if neighbor in seen[1-direction] and weight + seen[1-direction][neighbor] < best:
+                    best = weight + seen[1-direction][neighbor]
+                    meeting = neighbor
+
+    if meeting is None:
+        return (float('inf'), [])
+
+    return (best, Graph.osm_path(join_predecessors(predecessor, meeting)))
+
+
+def heuristic_times(Graph, node):
+    """Lower bound of the travel time between every node of the graph and node
+    :param Graph: CompiledGraph
+    :param node: the integer id of the node
+    :return: the great circle distance divided by the maximum speed of the graph, in seconds
+    """
+    lat = np.radians(Graph.y)
+    lon = np.radians(Graph.x)
+    a = np.sin((lat - lat[node]) / 2)**2 + np.cos(lat[node]) * np.cos(lat) * np.sin((lon - lon[node]) / 2)**2
+    distance = 2 * 6371000 * np.arcsin(np.sqrt(np.minimum(a, 1)))
+    #The margin keeps the bound below the float32 travel times
+    return distance / Graph.max_speed * 0.9999
+
+
+def astar_alt(Graph, source, target):
+    """Find the shortest path in G from source to target using A* with the landmark (ALT) heuristic.
+    The distance from a node to the target is bounded with the triangle inequality on the precomputed
+    travel times from and to each landmark, which is admissible and much tighter than the straight line.
+    Parameters:
+    -----------
+    G : NetworkX oriented graph or CompiledGraph
+    source : node
+       Starting node for path
+    target : node
+         Ending node for path
+    Returns:
+    --------
+    time : float
+        Shortest time from source to target.
+    path : list
+        List of nodes in a shortest path.
+    """
+    if source == target:
+        return (0, [source])
+
+    Graph, (_, from_landmarks, to_landmarks) = get_landmarks(Graph)
+    s = Graph.node_index(source)
+    t = Graph.node_index(target)
+
+    #Travel times between the target and the landmarks, shape (1, k)
+    from_landmarks_to_target = from_landmarks[t:t+1]
+    to_landmarks_from_target = to_landmarks[t:t+1]
+
+    def heuristic(nodes):
+        #max over the landmarks of d(l, t) - d(l, v) and d(v, l) - d(t, l), fmax ignores the nan of unreachable landmarks
+        bounds = np.fmax(from_landmarks_to_target - from_landmarks[nodes], to_landmarks[nodes] - to_landmarks_from_target)
+        return np.fmax(np.fmax.reduce(bounds, axis=1), 0).tolist()
+
+    push = heappush
+    pop = heappop
+
+    indptr = Graph.forward_indptr
+    indices = Graph.forward_indices
+    times = Graph.forward_times
+
+    out = {} #Distance from the source to each settled node
+    seen = {s : 0} #Best distance found so far for each node
+    predecessor = {s : None} #Previous node on the shortest path
+    to_explore = [(heuristic([s])[0], 0, s)] #Heap of (distance + heuristic, distance, label) tuples
+
+    while to_explore:
+
+        ( _ , dist, v) = pop(to_explore)
+
+        if v in out:
+            continue
+
+        out[v] = dist
+
+        if v == t:
+            return (dist, Graph.osm_path(path_from_predecessor(predecessor, t)))
+
+        start, end = indptr[v:v+2].tolist()
+        if start == end:
+            continue
+        neighbors = indices[start:end]
+        for neighbor, time, bound in zip(neighbors.tolist(), times[start:end].tolist(), heuristic(neighbors)):
+            if neighbor in out:
+                continue
+            weight = dist + time
+            #If the neighbor has not been visited or the new path is shorter, update the heap
+            if neighbor not in seen or weight < seen[neighbor]:
+                seen[neighbor] = weight
+                predecessor[neighbor] = v
+                push(to_explore, (weight + bound, weight, neighbor))
+
     return (float('inf'), [])
 
 
-    
+def get_landmarks(Graph, k=None):
+    """Return the compiled graph and its landmark tables, loaded from the cache folder or computed and saved the first time
+    :param Graph: networkx graph or CompiledGraph
+    :param k: the number of landmarks, number_of_landmarks by default
+    :return: the compiled graph and the (landmarks, from_landmarks, to_landmarks) tuple, the tables have a row per node
+    """
+    if k is None:
+        k = number_of_landmarks
+    Graph = as_compiled(Graph)
 
-def travel_time_route(u, v, graph):
-    """Return the travel time of a route."""
-    return graph[u][v][0]['travel_time'] if 'travel_time' in graph[u][v][0] else graph[u][v][0]["length"]/8.33 # 30 km/h
+    key = (Graph.fingerprint(), k)
+    if key not in _landmark_tables:
+        filename = os.path.join(landmarks_cache_folder, "%s_%d.npz" % key)
+        if os.path.exists(filename):
+            with np.load(filename) as data:
+                _landmark_tables[key] = (data["landmarks"], data["from_landmarks"], data["to_landmarks"])
+        else:
+            landmarks, from_landmarks, to_landmarks = select_landmarks(Graph, k)
+            os.makedirs(landmarks_cache_folder, exist_ok=True)
+            #Written under a temporary name then renamed, another process never loads a partly written file
+            temporary_filename = "%s.%d.tmp" % (filename, os.getpid())
+            with open(temporary_filename, "wb") as file:
+                np.savez(file, landmarks=landmarks, from_landmarks=from_landmarks, to_landmarks=to_landmarks)
+            os.replace(temporary_filename, filename)
+            _landmark_tables[key] = (landmarks, from_landmarks, to_landmarks)
 
-def weight_node(u, v, data, graph, direction):
-    """Return the weight of an edge."""
-    weight = data[u]
-    if direction == 0:
-        weight += travel_time_route(u, v, graph)
-    else:
-        weight += travel_time_route(v, u, graph)
-    return weight
+    return Graph, _landmark_tables[key]
 
 
+def set_landmarks(Graph, tables, k=None):
+    """Keep landmark tables computed by another process, so get_landmarks does not compute them again
+    :param Graph: CompiledGraph
+    :param tables: the (landmarks, from_landmarks, to_landmarks) tuple returned by get_landmarks
+    :param k: the number of landmarks asked for the tables, number_of_landmarks by default
+    """
+    if k is None:
+        k = number_of_landmarks
+    _landmark_tables[(Graph.fingerprint(), k)] = tables
+
+
+def select_landmarks(Graph, k):
+    """Pick k landmarks far from each other and compute the travel times from and to each of them
+    Each new landmark is the node the furthest from the landmarks already chosen.
+    :param Graph: CompiledGraph
+    :param k: the number of landmarks
+    :return: the landmarks, the travel times from and to each landmark with shape (n, k)
+    """
+    k = min(k, len(Graph))
+    landmarks = np.empty(k, dtype=np.int32)
+    from_landmarks = np.empty((len(Graph), k), dtype=np.float64)
+    to_landmarks = np.empty((len(Graph), k), dtype=np.float64)
+
+    #Start from the node the furthest from an arbitrary node
+    closest = _all_times(Graph.forward_indptr, Graph.forward_indices, Graph.forward_times, 0)
+    for i in range(k):
+        landmarks[i] = int(np.argmax(np.where(np.isfinite(closest), closest, -1)))
+        from_landmarks[:, i] = _all_times(Graph.forward_indptr, Graph.forward_indices, Graph.forward_times, landmarks[i])
+        to_landmarks[:, i] = _all_times(Graph.backward_indptr, Graph.backward_indices, Graph.backward_times, landmarks[i])
+        closest = from_landmarks[:, i] if i == 0 else np.minimum(closest, from_landmarks[:, i])
+
+    return landmarks, from_landmarks, to_landmarks
+
+
+def _all_times(indptr, indices, times, start):
+    """Dijkstra from start over the whole CSR graph
+    :return: the travel time to every node, inf if the node is not reachable
+    """
+    out = np.full(len(indptr) - 1, np.inf)
+    seen = {start: 0}
+    to_explore = [(0, start)]
+    while to_explore:
+        dist, v = heappop(to_explore)
+        if out[v] != np.inf:
+            continue
+        out[v] = dist
+        start_edge, end_edge = indptr[v:v+2].tolist()
+        for neighbor, time in zip(indices[start_edge:end_edge].tolist(), times[start_edge:end_edge].tolist()):
+            weight = dist + time
+            if neighbor not in seen or weight < seen[neighbor]:
+                seen[neighbor] = weight
+                heappush(to_explore, (weight, neighbor))
+    return out
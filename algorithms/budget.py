@@ -0,0 +1,60 @@
+import math
+import time as timestamp
+#Budget shared by the TSP solvers: a time limit, a number of iterations and a progress callback.
+#What an iteration is depends on the solver: an iteration of a colony, an improving move of a local search, a kick...
+
+
+class Budget:
+
+    def __init__(self, time_budget=None, max_iterations=None, progress=None):
+        """Create a budget, it starts counting the time at once
+
+        Args:
+            time_budget: The number of seconds the solver may run, no limit if None
+            max_iterations: The number of iterations the solver may run, no limit if None
+            progress: The function called as progress(iteration, best_time) each time the solver finds a better tour"""
+
+        self.start = timestamp.time()
+        self.deadline = None if time_budget is None else self.start + time_budget
+        self.max_iterations = max_iterations
+        self.progress = progress
+        self.iterations = 0
+        self.best_time = math.inf
+
+    def is_limited(self):
+        """Return True if the budget has a time limit or a maximum number of iterations"""
+        return self.deadline is not None or self.max_iterations is not None
+
+    def exhausted(self):
+        """Return True once the time or the iterations of the budget are spent"""
+        if self.max_iterations is not None and self.iterations >= self.max_iterations:
+            return True
+        return self.deadline is not None and timestamp.time() >= self.deadline
+
+    def remaining(self):
+        """Return the number of seconds left, None if there is no time limit"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - timestamp.time())
+
+    def step(self, best_time):
+        """Count an iteration and report the time of the best tour so far
+
+        Returns:
+            False once the budget is spent, the solver must then return its best tour"""
+
+        self.iterations += 1
+        self.improve(best_time)
+        return not self.exhausted()
+
+    def improve(self, best_time):
+        """Report the time of the best tour so far, the progress callback is only called when it improved"""
+        if best_time < self.best_time:
+            self.best_time = best_time
+            if self.progress is not None:
+                self.progress(self.iterations, best_time)
+
+
+def get_budget(budget):
+    """Return the budget, or an unlimited budget if None"""
+    return Budget() if budget is None else budget
@@ -1,220 +1,244 @@
-from heapq import heappop, heappush
+import numpy as np
 from networkx import Graph, max_weight_matching
-from itertools import count
-from copy import deepcopy
-from collections import deque
-    
+from graph_tools import ConstructGraph
+from algorithms import pairwise_exchange
 
-def christofides(dictionary, weight="time"):
+#Above this number of odd vertices, the "auto" matching uses the greedy matching instead of the cubic exact one
+exact_matching_max_vertices = 60
+
+
+def christofides(dictionary, weight="time", matching="auto", budget=None):
     """Compute an approximation of the shortest path between all the nodes of the dictionary
     Uses Christofides Algorithm to solve the traveling's salesman problem (TSP).
-    
+    Every step works on the dense matrix of the times, the dictionary is not copied nor modified.
+
     Parameters:
     ---------------
     dictionary: python dictionary, complete graph
     weight: weight used in the dictionary
-    
+    matching: "exact" for the minimum weight perfect matching of networkx, "greedy" for the greedy matching
+        improved by pair exchanges, much faster on large sets of odd vertices, "auto" to choose from their number
+    budget: Budget of the solver, the algorithm builds a single tour, one iteration, and only reports it to the progress callback
+
     Returns:
     an approximation of the shortest path between the dictionary's nodes
     """
-    non_oriented_graph = oriented_to_non_oriented_graph(dictionary=dictionary, weight="time")
-    tree = prim_dictionnary(dict=non_oriented_graph, weight="time")
-    odd_graph = get_odd_graph(dictionary, tree)
-    min_weight_matchings = dic_min_weight_matching(odd_graph)
-    eulerian_graph = create_eulerian_graph(tree, min_weight_matchings)
-    eulerian_path = hierholzer_eulerian_circuit(eulerian_graph)
+    nodes, times = ConstructGraph.to_matrix(dictionary, weight=weight)
+    path = christofides_matrix(times, matching)
+    if budget is not None:
+        budget.step(pairwise_exchange.tour_time(times, path))
+    return [nodes[node] for node in path] + nodes[:1]
+
+
+def christofides_matrix(times, matching="auto"):
+    """Compute the tour of Christofides Algorithm on a matrix of times
+
+    Parameters:
+    ---------------
+    times: numpy array of the times, asymmetric or not
+    matching: "exact", "greedy" or "auto", see christofides
+
+    Returns:
+    the tour starting from the node 0, without the return to it
+    """
+    n = len(times)
+    if n < 3:
+        return list(range(n))
+    #The tour is built on the non oriented graph, each edge weighing the mean of its two directions
+    symmetric = (times + times.T) / 2
+
+    parent = prim_matrix(symmetric)
+    tree_edges = [(int(parent[node]), node) for node in range(1, n)]
+    odd = odd_vertices(tree_edges, n)
+    matchings = min_weight_matching(symmetric, odd, matching)
+    eulerian_path = hierholzer_eulerian_circuit(tree_edges + matchings, n)
     hamiltonian_path = shortcutting(eulerian_path)
-    new_path = reorder(hamiltonian_path, list(dictionary.keys())[0])
-    return new_path
+    return reorder(hamiltonian_path, 0)[:-1]
 
 
-def oriented_to_non_oriented_graph(dictionary, weight="time"):
-    """Compute the non oriented version of the dictionary, cleans the dictionary
+def prim_matrix(matrix):
+    """Compute a minimum spanning tree of a complete graph with the dense version of Prim's algorithm, in O(n²)
 
     Parameters:
-    --------------
-    dictionary: oriented graph like [start_node][end_node][weight] = weight
+    ---------------
+    matrix: symmetric numpy array of the weights
+
+    Returns:
+    parent: numpy array, parent[node] is the node linked to node in the tree, -1 for the root 0
     """
-    dictionary_copy = deepcopy(dictionary)
-    new_dictionary = {node: {} for node in dictionary_copy.keys()}
-    for start_node in dictionary_copy:
-        for end_node in dictionary_copy[start_node]:
-            if start_node == end_node:
-                continue
-            w = (dictionary_copy[start_node][end_node][weight] + dictionary_copy[start_node][end_node][weight]) / 2
-            new_dictionary[start_node][end_node] = {weight : w}
-            new_dictionary[end_node][start_node] = {weight : w}
-            del dictionary_copy[end_node][start_node]
-    return new_dictionary
-
-
-def prim_dictionnary(dict, weight="time"):
-    """Compute a the edges of a minimim spanning tree (mst) for a graph
-    Uses Prim's algorithm
+    n = len(matrix)
+    parent = np.full(n, -1, dtype=np.int64)
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    #Weight of the lightest edge linking each node to the tree
+    distance = matrix[0].astype(np.float64)
+    parent[1:] = 0
+    for _ in range(n - 1):
+        node = int(np.argmin(np.where(in_tree, np.inf, distance)))
+        in_tree[node] = True
+        closer = ~in_tree & (matrix[node] < distance)
+        distance[closer] = matrix[node][closer]
+        parent[closer] = node
+    return parent
+
+
+def odd_vertices(edges, n):
+    """Get the vertices with odd degree of a graph
 
     Parameters:
     ---------------
-    G: nx.Graph 
-    weight: weight used in the graph
-    
+        edges: list of (u, v) edges
+        n: number of vertices
+
     Returns:
-    An iterator containing the edges of the mst
+        numpy array of the vertices of odd degree
     """
-    push = heappush
-    pop = heappop
-    nodes = set(dict)
-    tree = {node : {} for node in nodes}
-    while nodes:
-        u = nodes.pop() #arbitrary node
-        heap = []   
-        visited = {u}
-        for v, d in dict[u].items():
-            wt = d.get(weight, 1)
-            push(heap, (wt, u, v, d))
-        while nodes and heap:
-            _, u, v, d = pop(heap)
-            if v in visited or v not in nodes:
-                continue
-            tree[u][v] = d
-            tree[v][u] = d
-            visited.add(v)
-            nodes.discard(v)
-            for w, d2 in dict[v].items():
-                if w in visited:
-                    continue
-                new_weight = d2.get(weight, 1)
-                push(heap, (new_weight, v, w, d2))
-    return tree
-
-
-def get_odd_graph(dictionary, tree):
-    """Get the vertices with odd degree of the tree from the main graph to get a new graph
-     Parameters:
+    degree = np.bincount(np.asarray(edges, dtype=np.int64).ravel(), minlength=n)
+    return np.flatnonzero(degree % 2)
+
+
+def min_weight_matching(matrix, vertices, mode="auto"):
+    """Calculate a perfect matching of small weight between an even number of vertices
+
+    Parameters:
     ---------------
-        dictionary: graph under dictionary form
-        tree: minimum spanning tree
-    
+        matrix: symmetric numpy array of the weights
+        vertices: the vertices to match
+        mode: "exact", "greedy" or "auto"
+
     Returns:
-        I: dictionary containing the vertices of odd degree
+        edges: list of the (u, v) matched pairs
     """
-    I = deepcopy(dictionary)
-    for node in tree:
-        if not (len(tree[node]) % 2):
-            for second_node in I[node]:
-                I[second_node].pop(node)
-            I.pop(node)
-    return I
+    if mode == "auto":
+        mode = "exact" if len(vertices) <= exact_matching_max_vertices else "greedy"
+    if mode == "greedy":
+        return improve_matching(matrix, greedy_matching(matrix, vertices))
+    if mode != "exact":
+        raise ValueError("Unknown matching mode")
 
+    sub_matrix = matrix[np.ix_(vertices, vertices)]
+    max_weight = 1 + sub_matrix.max()
+    i, j = np.triu_indices(len(vertices), k=1)
+    InvG = Graph()
+    InvG.add_weighted_edges_from(zip(vertices[i].tolist(), vertices[j].tolist(), (max_weight - sub_matrix[i, j]).tolist()))
+    return [tuple(matching) for matching in max_weight_matching(InvG, maxcardinality=True)]
 
-def dic_min_weight_matching(dictionary, weight="time"):
-    """Calculate a minimum weight matching from a graph
 
-     Parameters:
+def greedy_matching(matrix, vertices):
+    """Match the vertices by taking the lightest edges between unmatched vertices first
+
+    Parameters:
     ---------------
-        dictionary: graph under dictionary form
-        weight: weight used in the graph
-    
+        matrix: symmetric numpy array of the weights
+        vertices: the vertices to match
+
     Returns:
-        edges: dictionary containing the matchings
-    
+        edges: list of the (u, v) matched pairs
     """
-    max_weight = 1 + max(dictionary[first_node][second_node][weight] for first_node in dictionary for second_node in dictionary[first_node])
-    new_dic = deepcopy(dictionary)
-    for first_node in dictionary:
-        for second_node in dictionary[first_node]:
-            new_dic[first_node][second_node][weight] = max_weight - dictionary[first_node][second_node][weight]
-            
-    InvG = Graph(new_dic)
-    edges = {}
-    matchings = max_weight_matching(InvG, maxcardinality=True, weight=weight)
-    for matching in matchings:
-        matching = list(matching)
-        u = matching[0]
-        v = matching[1]
-        for node in matching: 
-            edges[node] = {}
-        w = dictionary[u][v][weight]
-        edges[v][u] = {weight : w}
-        edges[u][v] = {weight : w}
+    vertices = np.asarray(vertices)
+    i, j = np.triu_indices(len(vertices), k=1)
+    order = np.argsort(matrix[vertices[i], vertices[j]], kind="stable")
+    matched = np.zeros(len(vertices), dtype=bool)
+    edges = []
+    for first, second in zip(i[order].tolist(), j[order].tolist()):
+        if matched[first] or matched[second]:
+            continue
+        matched[first] = matched[second] = True
+        edges.append((int(vertices[first]), int(vertices[second])))
+        if len(edges) * 2 == len(vertices):
+            break
     return edges
 
 
-def create_eulerian_graph(tree, min_weight_matchings):
-    """ Adds the tree and minimum weight matchings results to get the eulerian graph
+def improve_matching(matrix, edges):
+    """Improve a matching by exchanging the ends of two pairs while it lowers the weight, every exchange is evaluated at once
 
     Parameters:
     ---------------
-        tree: minimum spanning tree
-        min_weight_matchings: dictionary containing the matchings
+        matrix: symmetric numpy array of the weights
+        edges: list of the (u, v) matched pairs
 
     Returns:
-        graph: dictionary containing the eulerian graph
+        edges: list of the (u, v) matched pairs
     """
-    graph = deepcopy(tree)
-    for node, value in min_weight_matchings.items():
-        graph[node].update(value)
-    return graph
+    if len(edges) < 2:
+        return edges
+    u = np.array([edge[0] for edge in edges])
+    v = np.array([edge[1] for edge in edges])
+    a, b = np.triu_indices(len(edges), k=1)
+    while True:
+        current = matrix[u[a], v[a]] + matrix[u[b], v[b]]
+        #(u_a, u_b), (v_a, v_b) or (u_a, v_b), (v_a, u_b)
+        first = matrix[u[a], u[b]] + matrix[v[a], v[b]]
+        second = matrix[u[a], v[b]] + matrix[v[a], u[b]]
+        gains = current - np.minimum(first, second)
+        best = int(np.argmax(gains))
+        if not gains[best] > 1e-9:
+            return list(zip(u.tolist(), v.tolist()))
+        pair_a, pair_b = a[best], b[best]
+        if first[best] <= second[best]:
+            u[pair_b], v[pair_a] = v[pair_a], u[pair_b]
+        else:
+            v[pair_a], v[pair_b] = v[pair_b], v[pair_a]
+
 
+def hierholzer_eulerian_circuit(edges, n, first_vertex=0):
+    """Calculate an eulerian circuit in an eulerian multigraph
 
-def hierholzer_eulerian_circuit(eulerian_graph):
-    """Calculate an eulerian circuit in an eulerian graph
-    
     Parameters:
     ---------------
-        eulerian_graph: eulerian graph under dictionary form
-    
+        edges: list of the (u, v) edges, an edge can appear twice
+        n: number of vertices
+        first_vertex: the vertex the circuit starts from
+
     Returns:
         path: list containing the circuit
     """
-    dic = deepcopy(eulerian_graph)
-    first_vertex = list(dic.keys())[0]
+    adjacency = [[] for _ in range(n)]
+    for edge, (u, v) in enumerate(edges):
+        adjacency[u].append((v, edge))
+        adjacency[v].append((u, edge))
+    used = np.zeros(len(edges), dtype=bool)
+
     vertex_stack = [first_vertex]
     path = []
-    last_vertex = None
     while vertex_stack:
         current_vertex = vertex_stack[-1]
-        if dic[current_vertex]:
-            next_vertex, _ = list(dic[current_vertex].items())[0]
+        neighbours = adjacency[current_vertex]
+        #Drop the edges already used from the other end
+        while neighbours and used[neighbours[-1][1]]:
+            neighbours.pop()
+        if neighbours:
+            next_vertex, edge = neighbours.pop()
+            used[edge] = True
             vertex_stack.append(next_vertex)
-            dic[current_vertex].pop(next_vertex)
-            dic[next_vertex].pop(current_vertex)
         else:
-            if last_vertex is not None:
-                path.append(last_vertex)
-            last_vertex = current_vertex
-            vertex_stack.pop()
-    path.append(current_vertex)
-    return  path
+            path.append(vertex_stack.pop())
+    path.reverse()
+    return path
 
 
 def shortcutting(path):
     """Removes the nodes through which the path comes through twice
     Parameters:
     ---------------
-        path: list 
-    
+        path: list
+
     Returns:
         nodes: list
     """
-    nodes = [path[0]]
-    for node in path:
-        if node in nodes:
-            continue
-        nodes.append(node)
-    return nodes
+    return list(dict.fromkeys(path))
 
 
 def reorder(list, first):
     """Rotate the list until the parameters "first" is in first position, then appends it to the list
     Parameters:
     ---------------
-        list: list 
+        list: list
         first: int
-    
+
     Returns:
         list: list
     """
-    while(list[0] != first):
-        list.append(list.pop(0))
-    list.append(first)
-    return list
\ No newline at end of file
+    index = list.index(first)
+    return list[index:] + list[:index] + [first]
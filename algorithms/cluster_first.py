@@ -0,0 +1,193 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.cluster import KMeans
+from algorithms import held_karp, lin_kernighan, pairwise_exchange
+from algorithms.budget import Budget, get_budget
+#Cluster first, route second: the places are grouped by KMeans, the clusters are visited in the order of a small TSP over
+#their centroids and each cluster is crossed by an open path solved on its own matrix, in parallel.
+#Only the matrices of the clusters and of windows around the junctions of the clusters are computed, never the n x n matrix.
+
+#Number of places of a cluster, the matrices computed hold about n * cluster_size paths
+cluster_size = 60
+#Number of places on each side of a junction between two clusters solved again with the paths across the junction
+window = 5
+#Number of seconds of the local search of a cluster when the budget has no time limit
+default_cluster_time_budget = 0.3
+#Under this number of clusters the paths are solved serially, starting the processes costs more than it saves
+parallel_min_clusters = 4
+
+
+def cluster_first(nodes, coordinates, matrix, cluster_size=cluster_size, window=window, workers=None, budget=None, seed=None):
+    """Find a tour through many places without the matrix of every pair of places
+
+    Args:
+        nodes: The nodes to visit, the tour starts from the first one
+        coordinates: The (latitude, longitude) of each node, used to group the nodes
+        matrix: The function called as matrix(nodes) returning the numpy array of the times between the nodes given
+        cluster_size: The number of nodes of a cluster
+        window: The number of nodes on each side of a junction between two clusters optimized once the tour is stitched
+        workers: The number of processes solving the clusters, None to use every core
+        budget: The Budget of the solver, only its time limit is used to share the time of the local search between
+            the clusters, default_cluster_time_budget seconds per cluster if it has none
+        seed: The seed of KMeans and of the local search
+
+    Returns:
+        The tour, starting and ending at the first node"""
+
+    budget = get_budget(budget)
+    #A node can be given twice when two places are snapped to the same node
+    points = dict(zip(nodes, coordinates))
+    nodes = list(points)
+    times_of = {}
+
+    def times_between(part):
+        times = np.asarray(matrix(part), dtype=np.float64)
+        for i, start_node in enumerate(part):
+            times_of.update(((start_node, end_node), times[i, j]) for j, end_node in enumerate(part))
+        return times
+
+    if len(nodes) <= cluster_size:
+        path = solve_path(times_between(nodes), 0, 0, None if budget.deadline is None else budget.remaining(), seed)
+        tour = [nodes[i] for i in path] + nodes[:1]
+        budget.step(sum(times_of[pair] for pair in zip(tour, tour[1:])))
+        return tour
+
+    clusters = order_clusters(nodes, points, cluster_size, seed)
+
+    #The junction between two consecutive clusters links their closest nodes, the tour enters the first cluster at the first node
+    entries = [nodes[0]]
+    exits = []
+    for i, cluster in enumerate(clusters):
+        following = clusters[i + 1] if i + 1 < len(clusters) else [nodes[0]]
+        candidates = [node for node in cluster if node != entries[i]] or cluster
+        exit_node, entry_node = _closest_pair(candidates, following, points)
+        exits.append(exit_node)
+        if i + 1 < len(clusters):
+            entries.append(entry_node)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if budget.deadline is None:
+        time_budget = default_cluster_time_budget
+    else:
+        #Half of the time left goes to the clusters, the other half to the matrices and to the junctions
+        time_budget = budget.remaining() / 2 / math.ceil(len(clusters) / max(1, workers))
+    tasks = []
+    for cluster, entry_node, exit_node in zip(clusters, entries, exits):
+        tasks.append((times_between(cluster), cluster.index(entry_node), cluster.index(exit_node), time_budget, seed))
+    if workers <= 1 or len(tasks) < parallel_min_clusters:
+        paths = [solve_path(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            paths = list(executor.map(_solve_task, tasks))
+
+    tour = [cluster[i] for cluster, path in zip(clusters, paths) for i in path] + nodes[:1]
+
+    #Solve again each junction with the nodes around it, the ends of the window stay in place
+    junction = 0
+    for cluster in clusters:
+        junction += len(cluster)
+        first = max(0, junction - window)
+        last = min(len(tour) - 1, junction + window - 1)
+        part = tour[first:last + 1]
+        if len(set(part)) < len(part):
+            continue
+        times = times_between(part)
+        path = solve_path(times, 0, len(part) - 1, None, seed)
+        current = list(range(len(part)))
+        if times[path[:-1], path[1:]].sum() < times[current[:-1], current[1:]].sum():
+            tour[first:last + 1] = [part[i] for i in path]
+
+    budget.step(sum(times_of[pair] for pair in zip(tour, tour[1:])))
+    return tour
+
+
+def order_clusters(nodes, points, cluster_size=cluster_size, seed=None):
+    """Group the nodes with KMeans and order the groups with a TSP over their centroids
+
+    Args:
+        nodes: The nodes, the first cluster is the one of the first node
+        points: The (latitude, longitude) of each node
+        cluster_size: The number of nodes of a cluster
+        seed: The seed of KMeans
+
+    Returns:
+        The list of clusters, each one a list of nodes"""
+
+    coordinates = np.array([points[node] for node in nodes], dtype=np.float64)
+    #Distances on the plane tangent to the places, a degree of longitude is shorter than a degree of latitude
+    coordinates[:, 1] *= math.cos(math.radians(coordinates[:, 0].mean()))
+    n_clusters = math.ceil(len(nodes) / cluster_size)
+    kmeans = KMeans(n_clusters=n_clusters, n_init=3, random_state=seed).fit(coordinates)
+
+    labels = kmeans.labels_
+    #The cluster of the first node comes first
+    order = [int(labels[0])] + [label for label in range(n_clusters) if label != labels[0]]
+    centroids = kmeans.cluster_centers_[order]
+    distances = np.hypot(*(centroids[:, None, :] - centroids[None, :, :]).transpose(2, 0, 1))
+    if n_clusters <= held_karp.automatic_max_nodes:
+        path = held_karp.held_karp_matrix(distances)
+    else:
+        path = pairwise_exchange.local_search(distances, pairwise_exchange.nearest_neighbour_tour(distances)).tolist()
+
+    members = {label: [] for label in order}
+    for node, label in zip(nodes, labels.tolist()):
+        members[label].append(node)
+    return [members[order[i]] for i in path if members[order[i]]]
+
+
+def solve_path(times, entry, end, time_budget=None, seed=None):
+    """Find a short path through every node, from entry to end, or a tour if entry is end
+
+    Args:
+        times: The matrix of the times
+        entry: The index of the first node
+        end: The index of the last node
+        time_budget: The number of seconds of the local search, default_cluster_time_budget seconds if None
+        seed: The seed of the local search
+
+    Returns:
+        The indices of the nodes in the order of the path, the tour without the return to entry if entry is end"""
+
+    n = len(times)
+    if n == 1:
+        return [0]
+    if n == 2 and entry != end:
+        return [entry, end]
+
+    #entry becomes the node 0, the first node of the tours
+    order = [entry] + [node for node in range(n) if node != entry]
+    times = np.array(times, dtype=np.float64)[np.ix_(order, order)]
+    if entry != end:
+        #A tour using the edge from end to entry costs less than any other, removing that edge leaves the path
+        last = order.index(end)
+        finite = times[np.isfinite(times)]
+        penalty = finite.sum() + 1
+        times[:, 0] += penalty
+        times[last, :] += penalty
+        times[last, 0] = 0
+        np.fill_diagonal(times, 0)
+
+    if n <= held_karp.automatic_max_nodes:
+        path = held_karp.held_karp_matrix(times)
+    else:
+        budget = Budget(default_cluster_time_budget if time_budget is None else time_budget)
+        path = lin_kernighan.iterated_local_search(times, pairwise_exchange.nearest_neighbour_tour(times), budget, seed=seed).tolist()
+    return [order[i] for i in path]
+
+
+def _solve_task(task):
+    """Solve the path of a cluster in a worker process"""
+    return solve_path(*task)
+
+
+def _closest_pair(first_nodes, second_nodes, points):
+    """Return the node of first_nodes and the node of second_nodes closest to each other"""
+    first = np.array([points[node] for node in first_nodes], dtype=np.float64)
+    second = np.array([points[node] for node in second_nodes], dtype=np.float64)
+    scale = math.cos(math.radians(first[:, 0].mean()))
+    distances = np.hypot(first[:, None, 0] - second[None, :, 0], (first[:, None, 1] - second[None, :, 1]) * scale)
+    i, j = np.unravel_index(int(np.argmin(distances)), distances.shape)
+    return first_nodes[i], second_nodes[j]
@@ -0,0 +1,418 @@
+from heapq import heappop, heappush, heapify
+import os
+import numpy as np
+from graph_tools.CompiledGraph import as_compiled
+from algorithms.dijkstra import tree_from_paths
+#Contraction hierarchies: the graph is preprocessed once, then every query only explores the few nodes of higher rank.
+
+#Folder where the preprocessed hierarchies are saved, named by the fingerprint of the graph
+cache_folder = os.path.join("cache", "contraction_hierarchies")
+
+#Maximum number of nodes settled by a witness search, a bigger limit gives less shortcuts but a slower preprocessing
+witness_settled_limit = 60
+
+#Hierarchies already loaded in this session, keyed by the fingerprint of the graph
+_hierarchies = {}
+
+
+class Hierarchy:
+
+    def __init__(self, rank, forward_indptr, forward_indices, forward_times, forward_middles, backward_indptr, backward_indices, backward_times, backward_middles):
+        """Create a hierarchy from its arrays.
+        The forward arrays hold, in CSR form, the edges u -> v with rank[u] < rank[v] and the backward arrays the
+        edges u -> v with rank[u] > rank[v], stored on v. The middle of an edge is the contracted node the shortcut
+        goes through, or -1 for an edge of the road graph.
+
+        Args:
+            rank: The contraction order of each node
+            forward_indptr, forward_indices, forward_times, forward_middles: upward edges leaving each node
+            backward_indptr, backward_indices, backward_times, backward_middles: upward edges entering each node"""
+
+        self.rank = rank
+        self.forward_indptr = forward_indptr
+        self.forward_indices = forward_indices
+        self.forward_times = forward_times
+        self.forward_middles = forward_middles
+        self.backward_indptr = backward_indptr
+        self.backward_indices = backward_indices
+        self.backward_times = backward_times
+        self.backward_middles = backward_middles
+
+    def number_of_shortcuts(self):
+        """Return the number of shortcuts added by the contraction"""
+        return int(np.count_nonzero(self.forward_middles >= 0) + np.count_nonzero(self.backward_middles >= 0))
+
+    def save(self, filename):
+        """Save the hierarchy in a npz file, written under a temporary name then renamed so it is never read partly written"""
+        temporary_filename = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temporary_filename, "wb") as file:
+            np.savez(file, rank=self.rank,
+                     forward_indptr=self.forward_indptr, forward_indices=self.forward_indices,
+                     forward_times=self.forward_times, forward_middles=self.forward_middles,
+                     backward_indptr=self.backward_indptr, backward_indices=self.backward_indices,
+                     backward_times=self.backward_times, backward_middles=self.backward_middles)
+        os.replace(temporary_filename, filename)
+
+
+def load_hierarchy(filename):
+    """Load a hierarchy saved with Hierarchy.save"""
+    with np.load(filename) as data:
+        return Hierarchy(data["rank"],
+                         data["forward_indptr"], data["forward_indices"], data["forward_times"], data["forward_middles"],
+                         data["backward_indptr"], data["backward_indices"], data["backward_times"], data["backward_middles"])
+
+
+def get_hierarchy(Graph):
+    """Return the compiled graph and its hierarchy, loaded from the cache folder or built and saved the first time
+    :param Graph: networkx graph or CompiledGraph
+    :return: the compiled graph and the hierarchy
+    """
+    Graph = as_compiled(Graph)
+
+    fingerprint = Graph.fingerprint()
+    if fingerprint not in _hierarchies:
+        filename = os.path.join(cache_folder, fingerprint + ".npz")
+        if os.path.exists(filename):
+            _hierarchies[fingerprint] = load_hierarchy(filename)
+        else:
+            hierarchy = build_hierarchy(Graph)
+            os.makedirs(cache_folder, exist_ok=True)
+            hierarchy.save(filename)
+            _hierarchies[fingerprint] = hierarchy
+
+    return Graph, _hierarchies[fingerprint]
+
+
+def build_hierarchy(Graph):
+    """Contract every node of the graph, from the least important to the most important one
+    The importance of a node is its edge difference, the shortcuts its contraction adds minus the edges it removes, where
+    every edge also counts the road edges it stands for, plus its number of neighbors already contracted. The priority
+    of the neighbors of a contracted node is computed again at once, so the shortcuts stay close to the number of edges.
+    :param Graph: CompiledGraph
+    :return: the hierarchy
+    """
+    n = len(Graph)
+
+    #Remaining graph, out_edges[u][v] = (time, middle, number of road edges)
+    out_edges = [{} for _ in range(n)]
+    in_edges = [{} for _ in range(n)]
+    for u in range(n):
+        start, end = Graph.forward_indptr[u:u+2].tolist()
+        for v, time in zip(Graph.forward_indices[start:end].tolist(), Graph.forward_times[start:end].tolist()):
+            if u != v:
+                out_edges[u][v] = (time, -1, 1)
+                in_edges[v][u] = (time, -1, 1)
+
+    #Number of neighbors already contracted, spreads the contraction over the whole graph
+    deleted_neighbors = [0] * n
+
+    def priority(v):
+        shortcuts = _shortcuts(v, out_edges, in_edges)
+        removed = len(in_edges[v]) + len(out_edges[v])
+        removed_road_edges = sum(edge[2] for edge in in_edges[v].values()) + sum(edge[2] for edge in out_edges[v].values())
+        value = 2 * (len(shortcuts) - removed) + sum(road_edges for _, _, _, road_edges in shortcuts) - removed_road_edges
+        return value + deleted_neighbors[v], shortcuts
+
+    #Priority and shortcuts of each node, valid until one of its neighbors is contracted
+    priorities = [priority(v) for v in range(n)]
+    heap = [(value, v) for v, (value, _) in enumerate(priorities)]
+    heapify(heap)
+
+    rank = np.full(n, -1, dtype=np.int32)
+    upward_out = [None] * n
+    upward_in = [None] * n
+    order = 0
+
+    while heap:
+        value, v = heappop(heap)
+        #The node was contracted or its priority changed since it was pushed
+        if rank[v] >= 0 or value != priorities[v][0]:
+            continue
+
+        rank[v] = order
+        order += 1
+
+        #The remaining neighbors are all contracted later, so the edges of v are upward edges
+        upward_out[v] = out_edges[v]
+        upward_in[v] = in_edges[v]
+
+        for u, w, time, road_edges in priorities[v][1]:
+            if w not in out_edges[u] or time < out_edges[u][w][0]:
+                out_edges[u][w] = (time, v, road_edges)
+                in_edges[w][u] = (time, v, road_edges)
+
+        for w in out_edges[v]:
+            del in_edges[w][v]
+            deleted_neighbors[w] += 1
+        for u in in_edges[v]:
+            del out_edges[u][v]
+            deleted_neighbors[u] += 1
+
+        for neighbor in set(out_edges[v]).union(in_edges[v]):
+            priorities[neighbor] = priority(neighbor)
+            heappush(heap, (priorities[neighbor][0], neighbor))
+
+    forward = _upward_csr(upward_out)
+    backward = _upward_csr(upward_in)
+    return Hierarchy(rank, *forward, *backward)
+
+
+def _shortcuts(v, out_edges, in_edges):
+    """Return the shortcuts (u, w, time, number of road edges) needed to keep the shortest paths if v is contracted"""
+    shortcuts = []
+    for u, (time_in, _, road_edges_in) in in_edges[v].items():
+        targets = {w: (time_in + time_out, road_edges_in + road_edges_out)
+                   for w, (time_out, _, road_edges_out) in out_edges[v].items() if w != u}
+        if not targets:
+            continue
+        witness = _witness_search(u, v, targets, max(time for time, _ in targets.values()), out_edges)
+        for w, (time, road_edges) in targets.items():
+            if witness.get(w, float("inf")) > time:
+                shortcuts.append((u, w, time, road_edges))
+    return shortcuts
+
+
+def _witness_search(source, avoided, targets, limit, out_edges):
+    """Bounded Dijkstra from source that does not go through the avoided node
+    :return: the best known distance to the reached nodes
+    """
+    seen = {source: 0}
+    out = set()
+    remaining = set(targets)
+    to_explore = [(0, source)]
+    while to_explore and remaining and len(out) < witness_settled_limit:
+        dist, v = heappop(to_explore)
+        if v in out:
+            continue
+        if dist > limit:
+            break
+        out.add(v)
+        remaining.discard(v)
+        for w, (time, _, _) in out_edges[v].items():
+            if w == avoided or w in out:
+                continue
+            weight = dist + time
+            if w not in seen or weight < seen[w]:
+                seen[w] = weight
+                heappush(to_explore, (weight, w))
+    return seen
+
+
+def _upward_csr(upward_edges):
+    """Convert the list of upward edge dictionaries to CSR arrays"""
+    n = len(upward_edges)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(edges) for edges in upward_edges], out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    times = np.empty(indptr[-1], dtype=np.float64)
+    middles = np.empty(indptr[-1], dtype=np.int32)
+    for v, edges in enumerate(upward_edges):
+        start = indptr[v]
+        for i, (w, (time, middle, _)) in enumerate(edges.items()):
+            indices[start + i] = w
+            times[start + i] = time
+            middles[start + i] = middle
+    return indptr, indices, times, middles
+
+
+def contraction_hierarchies(Graph, source, target):
+    """Find the shortest path from source to target with the contraction hierarchy of the graph.
+    Parameters:
+    -----------
+    G : NetworkX oriented graph or CompiledGraph
+    source : node
+       Starting node for path
+    target : node
+         Ending node for path
+    Returns:
+    --------
+    time : float
+        Shortest time from source to target.
+    path : list
+        List of nodes in a shortest path.
+    """
+    if source == target:
+        return (0, [source])
+
+    Graph, hierarchy = get_hierarchy(Graph)
+    s = Graph.node_index(source)
+    t = Graph.node_index(target)
+
+    push = heappush
+    pop = heappop
+
+    indptr = [hierarchy.forward_indptr, hierarchy.backward_indptr]
+    indices = [hierarchy.forward_indices, hierarchy.backward_indices]
+    times = [hierarchy.forward_times, hierarchy.backward_times]
+
+    out = [{}, {}] #Distance from the source/target to each settled node
+    seen = [{s : 0},{t : 0}] #Best distance found so far for each node
+    predecessor = [{s : None},{t : None}] #Previous node in the upward search
+    to_explore = [[(0, s)],[(0, t)]] #Heaps of (distance,label) tuples
+
+    best = float('inf')
+    meeting = None
+
+    direction = 1 #Direction of the search, 0 is forward, 1 is backward
+
+    #Both searches only go up, each one stops when it can no longer improve the best path
+    while (to_explore[0] and to_explore[0][0][0] < best) or (to_explore[1] and to_explore[1][0][0] < best):
+
+        direction = 1 - direction #Switch direction
+
+        if not to_explore[direction] or to_explore[direction][0][0] >= best:
+            continue
+
+        (dist, v) = pop(to_explore[direction])
+
+        if v in out[direction]:
+            continue
+
+        out[direction][v] = dist
+
+        if v in seen[1-direction] and dist + seen[1-direction][v] < best:
+            best = dist + seen[1-direction][v]
+            meeting = v
+
+        start, end = indptr[direction][v:v+2].tolist()
+        for neighbor, time in zip(indices[direction][start:end].tolist(), times[direction][start:end].tolist()):
+            if neighbor in out[direction]:
+                continue
+            weight = dist + time
+            if neighbor not in seen[direction] or weight < seen[direction][neighbor]:
+                seen[direction][neighbor] = weight
+                predecessor[direction][neighbor] = v
+                push(to_explore[direction], (weight, neighbor))
+
+    if meeting is None:
+        return (float('inf'), [])
+
+    return (best, Graph.osm_path(_unpack_path(hierarchy, _chain(predecessor[0], meeting)[::-1] + _chain(predecessor[1], meeting)[1:])))
+
+
+def contraction_hierarchies_many_to_many(Graph, sources, targets):
+    """Find the shortest paths from every source to every target with the contraction hierarchy of the graph.
+    A backward upward search from each target fills the buckets of the nodes it settles, then a forward upward
+    search from each source scans the buckets of the nodes it settles.
+    Parameters:
+    -----------
+    G : NetworkX oriented graph or CompiledGraph
+    sources : list
+       Starting nodes for the paths
+    targets : list
+         Ending nodes for the paths
+    Returns:
+    --------
+    result : dictionary
+        result[source][target] is the (time, tree) tuple, (inf, None) if the target is not reachable. The tree merges
+        the unpacked paths of the row, path_from_predecessor rebuilds the path to a target from it.
+    """
+    Graph, hierarchy = get_hierarchy(Graph)
+
+    #Buckets of (target, distance to the target) tuples for each settled node
+    buckets = {}
+    backward_predecessors = {}
+    for target in set(targets):
+        t = Graph.node_index(target)
+        distances, backward_predecessors[target] = _upward_search(hierarchy, t, 1)
+        for v, dist in distances.items():
+            buckets.setdefault(v, []).append((target, dist))
+
+    result = {}
+    for source in sources:
+        s = Graph.node_index(source)
+        distances, forward_predecessor = _upward_search(hierarchy, s, 0)
+
+        best = {}
+        for v, dist in distances.items():
+            for target, target_dist in buckets.get(v, ()):
+                if target not in best or dist + target_dist < best[target][0]:
+                    best[target] = (dist + target_dist, v)
+
+        #The paths are only unpacked to be merged in the tree of the row
+        paths = [[source]]
+        for target in targets:
+            if target != source and target in best:
+                meeting = best[target][1]
+                upward = _chain(forward_predecessor, meeting)[::-1] + _chain(backward_predecessors[target], meeting)[1:]
+                paths.append(Graph.osm_path(_unpack_path(hierarchy, upward)))
+        tree = tree_from_paths(paths)
+
+        result[source] = {}
+        for target in targets:
+            if target == source:
+                result[source][target] = (0, tree)
+            elif target in best:
+                result[source][target] = (best[target][0], tree)
+            else:
+                result[source][target] = (float('inf'), None)
+
+    return result
+
+
+def _upward_search(hierarchy, start, direction):
+    """Settle every node reachable from start with upward edges
+    :param direction: 0 for the forward search, 1 for the backward search
+    :return: the distances and the predecessors of the settled nodes
+    """
+    if direction == 0:
+        indptr, indices, times = hierarchy.forward_indptr, hierarchy.forward_indices, hierarchy.forward_times
+    else:
+        indptr, indices, times = hierarchy.backward_indptr, hierarchy.backward_indices, hierarchy.backward_times
+
+    out = {}
+    seen = {start: 0}
+    predecessor = {start: None}
+    to_explore = [(0, start)]
+    while to_explore:
+        dist, v = heappop(to_explore)
+        if v in out:
+            continue
+        out[v] = dist
+        start_edge, end_edge = indptr[v:v+2].tolist()
+        for neighbor, time in zip(indices[start_edge:end_edge].tolist(), times[start_edge:end_edge].tolist()):
+            if neighbor in out:
+                continue
+            weight = dist + time
+            if neighbor not in seen or weight < seen[neighbor]:
+                seen[neighbor] = weight
+                predecessor[neighbor] = v
+                heappush(to_explore, (weight, neighbor))
+    return out, predecessor
+
+
+def _chain(predecessor, node):
+    """Return the nodes from node back to the start of the search"""
+    chain = []
+    while node is not None:
+        chain.append(node)
+        node = predecessor[node]
+    return chain
+
+
+def _unpack_path(hierarchy, path):
+    """Replace every shortcut of the path by the edges of the road graph it stands for"""
+    unpacked = [path[0]]
+    for u, v in zip(path, path[1:]):
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            middle = _middle(hierarchy, a, b)
+            if middle < 0:
+                unpacked.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+    return unpacked
+
+
+def _middle(hierarchy, u, v):
+    """Return the middle node of the edge u -> v, -1 if it is an edge of the road graph"""
+    if hierarchy.rank[u] < hierarchy.rank[v]:
+        start, end = hierarchy.forward_indptr[u:u+2].tolist()
+        neighbors, middles, other = hierarchy.forward_indices, hierarchy.forward_middles, v
+    else:
+        start, end = hierarchy.backward_indptr[v:v+2].tolist()
+        neighbors, middles, other = hierarchy.backward_indices, hierarchy.backward_middles, u
+    position = start + neighbors[start:end].tolist().index(other)
+    return int(middles[position])
@@ -1,6 +1,7 @@
 from heapq import heappop, heappush
 
 import networkx as nx
+from graph_tools.CompiledGraph import CompiledGraph
 
 
 
@@ -8,7 +9,7 @@ def dijkstra(Graph, source, target):
     """Find shortest weighted paths in G from source to target using Dijkstra's algorithm.
     Parameters:
     -----------
-    G : NetworkX oriented graph
+    G : NetworkX oriented graph or CompiledGraph
     source : node
        Starting node for path
     target : node
@@ -25,6 +26,9 @@ def dijkstra(Graph, source, target):
     
     if source == target:
         return (0, [source])
+
+    if isinstance(Graph, CompiledGraph):
+        return dijkstra_compiled(Graph, source, target)
     
     push = heappush
     pop = heappop
@@ -33,22 +37,25 @@ def dijkstra(Graph, source, target):
 
     #We are using the two way Dijkstra algorithm, so we need to keep track of the distances from both the source and the target
     out = [{}, {}] #List of dictionaries, each dictionary contains the distance from the source/target to each node
-    path = [{},{}]  # dictionary of paths
+    predecessor = [{source : None},{target : None}] #Previous node on the path from the source/to the target
     seen = [{source : 0},{target : 0}]  # dictionary of nodes that have been visited
     to_explore = [[],[]] # heap of (distance,label) tuples for all non-seen nodes
 
     #Initialize the heap with the source and target
     push(to_explore[0], (0, source))
     push(to_explore[1], (0, target))
-    
-    #Initialize the path with the source and target
-    path[0][source] = [source]
-    path[1][target] = [target]
+
+    best = float('inf') #Length of the best path found so far
+    meeting = None #Node where the two halves of the best path meet
 
     direction = 1 #Direction of the search, 0 is forward, 1 is backward
 
     while to_explore[0] and to_explore[1]:
 
+        #No path through a node still in the heaps can be shorter than the best one
+        if to_explore[0][0][0] + to_explore[1][0][0] >= best:
+            break
+
         direction = 1 - direction #Switch direction
 
         #Pop the smallest distance node from the heap
@@ -59,27 +66,272 @@ def dijkstra(Graph, source, target):
         
         out[direction][v] = dist
 
-        #Check if the node has been visited by the other search
-        if v in out[1-direction]:
-            #If it has, we have found a shortest path
-            return (out[0][v] + out[1][v], path[0][v] + list(reversed(path[1][v]))[1:])
-        
         for neighbor in neighbor_list[direction][v]:
             if neighbor not in out[direction]:
                 weight = weight_node(v, neighbor, out[direction], Graph, direction)
-                #If the neighbor has not been visited, add it to the heap
-                if neighbor not in seen[direction]:
-                    seen[direction][neighbor] = weight
-                    push(to_explore[direction], (weight, neighbor))
-                    path[direction][neighbor] = path[direction][v] + [neighbor]
-                #If the neighbor has been visited, but the new path is shorter, update the heap
-                elif weight < seen[direction][neighbor]:
+                #If the neighbor has not been visited or the new path is shorter, update the heap
+                if neighbor not in seen[direction] or weight < seen[direction][neighbor]:
                     seen[direction][neighbor] = weight
+                    predecessor[direction][neighbor] = v
                     push(to_explore[direction], (weight, neighbor))
-                    path[direction][neighbor] = path[direction][v] + [neighbor]
-            
-    return (float('inf'), [])
-    
+                    #Check if the node links the two searches with a shorter path
+                    if neighbor in seen[1-direction] and weight + seen[1-direction][neighbor] < best:
+                        best = weight + seen[1-direction][neighbor]
+                        meeting = neighbor
+
+    if meeting is None:
+        return (float('inf'), [])
+
+    return (best, join_predecessors(predecessor, meeting))
+
+
+def dijkstra_one_to_many(Graph, source, targets):
+    """Find the shortest weighted paths in G from source to every target with a single Dijkstra search.
+    The search only goes forward and stops as soon as all the targets have been settled, so one call
+    fills a whole row of the distance matrix instead of running one search per pair.
+    Parameters:
+    -----------
+    G : NetworkX oriented graph or CompiledGraph
+    source : node
+       Starting node for the paths
+    targets : list
+         Ending nodes for the paths
+    Returns:
+    --------
+    result : dictionary
+        Dictionary keyed by target of (time, tree) tuples, (inf, None) if the target is not reachable. The tree is the
+        predecessor map of the search cut to the paths of the targets, shared by the whole row, path_from_predecessor
+        rebuilds the path to a target from it.
+    """
+
+    if isinstance(Graph, CompiledGraph):
+        return dijkstra_one_to_many_compiled(Graph, source, targets)
+
+    push = heappush
+    pop = heappop
+
+    remaining = set(targets)
+    remaining.discard(source)
+
+    out = {} #Distance from the source to each settled node
+    seen = {source : 0} #Best distance found so far for each node
+    predecessor = {source : None} #Previous node on the shortest path
+    to_explore = [(0, source)] #Heap of (distance, label) tuples
+
+    while to_explore and remaining:
+
+        #Pop the smallest distance node from the heap
+        (dist, v) = pop(to_explore)
+
+        if v in out:
+            continue
+
+        out[v] = dist
+        remaining.discard(v)
+
+        for neighbor in Graph._succ[v]:
+            if neighbor not in out:
+                weight = weight_node(v, neighbor, out, Graph, 0)
+                #If the neighbor has not been visited or the new path is shorter, update the heap
+                if neighbor not in seen or weight < seen[neighbor]:
+                    seen[neighbor] = weight
+                    predecessor[neighbor] = v
+                    push(to_explore, (weight, neighbor))
+
+    tree = predecessor_tree(predecessor, [target for target in targets if target in out or target == source])
+    result = {}
+    for target in targets:
+        if target == source:
+            result[target] = (0, tree)
+        elif target in out:
+            result[target] = (out[target], tree)
+        else:
+            result[target] = (float('inf'), None)
+    return result
+
+
+def dijkstra_compiled(Graph, source, target):
+    """Two way Dijkstra algorithm running on the arrays of a CompiledGraph.
+    The search stops when the two frontiers can no longer improve the best path found through an edge
+    between the two searches, so the returned path is always a shortest one.
+    Parameters:
+    -----------
+    G : CompiledGraph
+    source : OSM id of the starting node
+    target : OSM id of the ending node
+    Returns:
+    --------
+    time : float
+        Shortest time from source to target.
+    path : list
+        List of OSM ids in a shortest path.
+    """
+    s = Graph.node_index(source)
+    t = Graph.node_index(target)
+
+    push = heappush
+    pop = heappop
+
+    indptr = [Graph.forward_indptr, Graph.backward_indptr]
+    indices = [Graph.forward_indices, Graph.backward_indices]
+    times = [Graph.forward_times, Graph.backward_times]
+
+    out = [{}, {}] #Distance from the source/target to each settled node
+    seen = [{s : 0},{t : 0}] #Best distance found so far for each node
+    predecessor = [{s : None},{t : None}] #Previous node on the path from the source/to the target
+    to_explore = [[(0, s)],[(0, t)]] #Heaps of (distance,label) tuples
+
+    best = float('inf') #Length of the best path found so far
+    meeting = None #Node where the two halves of the best path meet
+
+    direction = 1 #Direction of the search, 0 is forward, 1 is backward
+
+    while to_explore[0] and to_explore[1]:
+
+        #No path through a node still in the heaps can be shorter than the best one
+        if to_explore[0][0][0] + to_explore[1][0][0] >= best:
+            break
+
+        direction = 1 - direction #Switch direction
+
+        (dist, v) = pop(to_explore[direction])
+
+        if v in out[direction]:
+            continue
+
+        out[direction][v] = dist
+
+        start, end = indptr[direction][v:v+2].tolist()
+        for neighbor, time in zip(indices[direction][start:end].tolist(), times[direction][start:end].tolist()):
+            if neighbor in out[direction]:
+                continue
+            weight = dist + time
+            if neighbor not in seen[direction] or weight < seen[direction][neighbor]:
+                seen[direction][neighbor] = weight
+                predecessor[direction][neighbor] = v
+                push(to_explore[direction], (weight, neighbor))
+                #Check if the node links the two searches with a shorter path
+                if neighbor in seen[1-direction] and weight + seen[1-direction][neighbor] < best:
+                    best = weight + seen[1-direction][neighbor]
+                    meeting = neighbor
+
+    if meeting is None:
+        return (float('inf'), [])
+
+    return (best, Graph.osm_path(join_predecessors(predecessor, meeting)))
+
+
+def dijkstra_one_to_many_compiled(Graph, source, targets):
+    """One to many Dijkstra algorithm running on the arrays of a CompiledGraph.
+    Parameters:
+    -----------
+    G : CompiledGraph
+    source : OSM id of the starting node
+    targets : list of OSM ids of the ending nodes
+    Returns:
+    --------
+    result : dictionary
+        Dictionary keyed by target of (time, tree) tuples, (inf, None) if the target is not reachable. The tree is
+        keyed by OSM ids, like the tree of dijkstra_one_to_many.
+    """
+    s = Graph.node_index(source)
+    target_index = {target: Graph.node_index(target) for target in targets}
+
+    push = heappush
+    pop = heappop
+
+    indptr = Graph.forward_indptr
+    indices = Graph.forward_indices
+    times = Graph.forward_times
+
+    remaining = set(target_index.values())
+    remaining.discard(s)
+
+    out = {} #Distance from the source to each settled node
+    seen = {s : 0} #Best distance found so far for each node
+    predecessor = {s : None} #Previous node on the shortest path
+    to_explore = [(0, s)] #Heap of (distance, label) tuples
+
+    while to_explore and remaining:
+
+        (dist, v) = pop(to_explore)
+
+        if v in out:
+            continue
+
+        out[v] = dist
+        remaining.discard(v)
+
+        start, end = indptr[v:v+2].tolist()
+        for neighbor, time in zip(indices[start:end].tolist(), times[start:end].tolist()):
+            if neighbor in out:
+                continue
+            weight = dist + time
+            if neighbor not in seen or weight < seen[neighbor]:
+                seen[neighbor] = weight
+                predecessor[neighbor] = v
+                push(to_explore, (weight, neighbor))
+
+    tree = predecessor_tree(predecessor, [t for t in target_index.values() if t in out or t == s])
+    #The tree is converted once to OSM ids, instead of every path
+    osm_ids = Graph.osm_ids
+    tree = {int(osm_ids[v]): (None if previous_node is None else int(osm_ids[previous_node])) for v, previous_node in tree.items()}
+
+    result = {}
+    for target, t in target_index.items():
+        if t == s:
+            result[target] = (0, tree)
+        elif t in out:
+            result[target] = (out[t], tree)
+        else:
+            result[target] = (float('inf'), None)
+    return result
+
+
+def path_from_predecessor(predecessor, target):
+    """Rebuild the path ending at target by walking back a predecessor map."""
+    path = []
+    node = target
+    while node is not None:
+        path.append(node)
+        node = predecessor[node]
+    path.reverse()
+    return path
+
+
+def predecessor_tree(predecessor, targets):
+    """Cut a predecessor map to the nodes on the paths to the targets, the root keeps None as predecessor.
+    Each node is visited once, the walk back from a target stops at the first node already in the tree."""
+    tree = {}
+    for target in targets:
+        node = target
+        while node is not None and node not in tree:
+            tree[node] = predecessor[node]
+            node = predecessor[node]
+    return tree
+
+
+def tree_from_paths(paths):
+    """Merge paths starting at the same node in a single predecessor tree, the nodes already in it keep their predecessor"""
+    tree = {}
+    for path in paths:
+        if path and path[0] not in tree:
+            tree[path[0]] = None
+        for previous_node, node in zip(path, path[1:]):
+            if node not in tree:
+                tree[node] = previous_node
+    return tree
+
+
+def join_predecessors(predecessor, meeting):
+    """Rebuild the path of a two way search from the forward and backward predecessor maps and the meeting node."""
+    path = path_from_predecessor(predecessor[0], meeting)
+    node = predecessor[1][meeting]
+    while node is not None:
+        path.append(node)
+        node = predecessor[1][node]
+    return path
+
 
 def travel_time_route(u, v, graph):
     """Return the travel time of a route."""
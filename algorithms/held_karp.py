@@ -0,0 +1,225 @@
+import numpy as np
+from graph_tools import ConstructGraph
+from algorithms import lin_kernighan, pairwise_exchange
+from algorithms.budget import Budget
+from algorithms.christofides import prim_matrix
+#Exact solvers of the TSP for the small rounds: Held-Karp dynamic programming over the subsets of nodes, vectorized with numpy,
+#and a branch and bound for the rounds whose dynamic programming table would not fit in memory.
+
+#Rounds with up to this number of nodes are solved exactly by tsp_solver whatever the algorithm chosen
+automatic_max_nodes = 12
+#Above this number of nodes the branch and bound is refused, its time grows exponentially. With 22 nodes it proves random
+#euclidean rounds optimal in less than a second and asymmetric rounds with noisy times in a few seconds
+branch_and_bound_max_nodes = 22
+#Default maximum size of the Held-Karp tables, 64 MiB hold the tables of 19 nodes
+max_table_bytes = 2 ** 26
+#Number of steps of the subgradient ascent of the lower bound of the branch and bound
+subgradient_iterations = 200
+#Number of seconds of the local search giving the first tour of the branch and bound
+local_search_time_budget = 0.2
+
+
+def held_karp(dictionnary, multinodes, max_bytes=max_table_bytes, budget=None):
+    """Compute the shortest tour through the nodes, with Held-Karp if its table fits in max_bytes, else with the branch and bound
+
+    Args:
+        dictionnary: The graph representation, it is not modified
+        multinodes: The nodes to visit, the tour starts from the first one
+        max_bytes: The maximum size of the dynamic programming table
+        budget: The Budget of the solver, no limit if None. When it is spent, the tour returned is the best one found by
+            the branch and bound, or the local search tour if Held-Karp did not finish, and it is not proved optimal
+
+    Returns:
+        The tour, starting and ending at the first node, and True if it is proved optimal"""
+
+    nodes, times = ConstructGraph.to_matrix(dictionnary, list(dict.fromkeys(multinodes)))
+    if table_bytes(len(nodes)) <= max_bytes:
+        path = held_karp_matrix(times, budget)
+        optimal = path is not None
+        if path is None:
+            path = pairwise_exchange.local_search(times, pairwise_exchange.nearest_neighbour_tour(times)).tolist()
+    elif len(nodes) <= branch_and_bound_max_nodes:
+        path, optimal = branch_and_bound(times, budget)
+    else:
+        raise ValueError("Too many nodes for an exact solver: " + str(len(nodes)))
+    if budget is not None:
+        budget.improve(pairwise_exchange.tour_time(times, path))
+    return [nodes[i] for i in path] + [nodes[0]], optimal
+
+
+def table_bytes(n):
+    """Size in bytes of the tables of held_karp_matrix for n nodes"""
+    if n < 2:
+        return 0
+    #The costs in float64, the parents in int8, the subsets and their sizes in int64
+    return (2 ** (n - 1)) * ((n - 1) * (8 + 1) + 2 * 8)
+
+
+def held_karp_matrix(times, budget=None):
+    """Solve the TSP exactly by dynamic programming over the subsets of the nodes other than the first one
+    cost[subset, last] is the time of the shortest path from the first node through the subset, ending at last.
+    The subsets are processed by number of nodes and, for each last node, all the subsets are computed with one numpy operation.
+
+    Args:
+        times: The matrix of the times, asymmetric or not
+        budget: The Budget of the solver, only its time limit is checked, between two sizes of subsets
+
+    Returns:
+        The optimal tour without the return to the first node, None if the budget was spent first"""
+
+    n = len(times)
+    if n < 3:
+        return list(range(n))
+    times = np.asarray(times, dtype=np.float64)
+    m = n - 1
+    #The node i + 1 is the bit i of a subset
+    inner = times[1:, 1:]
+    subsets = np.arange(2 ** m)
+    sizes = np.zeros(2 ** m, dtype=np.int64)
+    for bit in range(m):
+        sizes += (subsets >> bit) & 1
+    cost = np.full((2 ** m, m), np.inf)
+    parent = np.zeros((2 ** m, m), dtype=np.int8)
+    cost[1 << np.arange(m), np.arange(m)] = times[0, 1:]
+
+    for size in range(2, m + 1):
+        if budget is not None and budget.remaining() == 0:
+            return None
+        of_size = subsets[sizes == size]
+        for last in range(m):
+            with_last = of_size[(of_size >> last) & 1 == 1]
+            #Every path through the subset without last, extended to last
+            candidates = cost[with_last ^ (1 << last)] + inner[:, last]
+            best = np.argmin(candidates, axis=1)
+            cost[with_last, last] = candidates[np.arange(len(with_last)), best]
+            parent[with_last, last] = best
+
+    full = 2 ** m - 1
+    last = int(np.argmin(cost[full] + times[1:, 0]))
+    path = []
+    subset = full
+    for _ in range(m):
+        path.append(last + 1)
+        last, subset = int(parent[subset, last]), subset ^ (1 << last)
+    return [0] + path[::-1]
+
+
+def branch_and_bound(times, budget=None):
+    """Solve the TSP exactly by a depth first search of the paths from the first node, pruned by a lower bound
+    The lower bound is the 1-tree bound of Held and Karp: the node penalties found by subgradient ascent at the root are
+    added to the times min(time(i, j), time(j, i)), and the end of a path costs at least the cheapest penalized edge leaving
+    its last node, plus the minimum spanning tree of the nodes left, plus the cheapest penalized edge back to the first node.
+    The first upper bound is the tour of the iterated local search of lin_kernighan.
+
+    Args:
+        times: The matrix of the times, asymmetric or not
+        budget: The Budget of the solver, an iteration being a path extended, no limit if None
+
+    Returns:
+        The best tour found without the return to the first node, and True if it is proved optimal, False if the budget
+        was spent first"""
+
+    n = len(times)
+    if n < 3:
+        return list(range(n)), True
+    times = np.asarray(times, dtype=np.float64)
+    symmetric = np.minimum(times, times.T)
+    d = times.tolist()
+
+    local_search_budget = Budget(local_search_time_budget if budget is None or budget.remaining() is None
+                                 else min(local_search_time_budget, budget.remaining() / 4))
+    best_path = lin_kernighan.iterated_local_search(times, pairwise_exchange.nearest_neighbour_tour(times), local_search_budget).tolist()
+    best_time = pairwise_exchange.tour_time(times, best_path)
+    if budget is not None:
+        budget.improve(best_time)
+
+    penalties, root_bound = one_tree_penalties(symmetric, best_time)
+    if root_bound >= best_time - 1e-9:
+        return best_path, True
+    penalized = symmetric + penalties[:, None] + penalties[None, :]
+
+    def lower_bound(last, left):
+        left = np.array(left)
+        tree = penalized[np.ix_(left, left)]
+        parent = prim_matrix(tree)
+        return ((times[last, left] + penalties[left]).min() + tree[np.arange(1, len(left)), parent[1:]].sum()
+                + (times[left, 0] + penalties[left]).min() - 2 * penalties[left].sum())
+
+    path = [0]
+    left = list(range(1, n))
+    #Each entry of the stack is the list of the nodes still to try at a depth of the path
+    stack = [sorted(left, key=lambda node: d[0][node])]
+    elapsed = [0.0]
+    while stack:
+        if not stack[-1]:
+            stack.pop()
+            if len(path) > 1:
+                left.append(path.pop())
+                elapsed.pop()
+            continue
+        node = stack[-1].pop(0)
+        time = elapsed[-1] + d[path[-1]][node]
+        left.remove(node)
+        if not left:
+            if time + d[node][0] < best_time - 1e-9:
+                best_time = time + d[node][0]
+                best_path = path + [node]
+                if budget is not None:
+                    budget.improve(best_time)
+            left.append(node)
+            continue
+        if time + lower_bound(node, left) >= best_time - 1e-9:
+            left.append(node)
+            continue
+        if budget is not None and not budget.step(best_time):
+            return best_path, False
+        path.append(node)
+        elapsed.append(time)
+        stack.append(sorted(left, key=lambda other: d[node][other]))
+
+    return best_path, True
+
+
+def one_tree_penalties(symmetric, upper_bound, iterations=subgradient_iterations):
+    """Find the node penalties maximizing the 1-tree bound of Held and Karp by subgradient ascent
+    A 1-tree is a minimum spanning tree of the nodes other than the first one plus the two cheapest edges of the first one,
+    the penalties of the nodes of degree more than 2 are raised and the ones of the leaves lowered until it is a tour.
+
+    Args:
+        symmetric: The symmetric matrix of the times
+        upper_bound: The time of a tour, it sets the size of the steps
+        iterations: The number of steps
+
+    Returns:
+        The penalties of the nodes and the lower bound of the time of a tour they give"""
+
+    n = len(symmetric)
+    penalties = np.zeros(n)
+    best_penalties, best_bound = penalties, -np.inf
+    scale = 2.0
+    since_improvement = 0
+    for _ in range(iterations):
+        penalized = symmetric + penalties[:, None] + penalties[None, :]
+        parent = prim_matrix(penalized[1:, 1:])
+        degrees = np.zeros(n, dtype=np.int64)
+        np.add.at(degrees, parent[1:] + 1, 1)
+        degrees[2:] += 1
+        first_edges = np.argsort(penalized[0, 1:])[:2] + 1
+        degrees[first_edges] += 1
+        degrees[0] = 2
+        bound = (penalized[1:, 1:][np.arange(1, n - 1), parent[1:]].sum() + penalized[0, first_edges].sum()
+                 - 2 * penalties.sum())
+        if bound > best_bound + 1e-9:
+            best_penalties, best_bound = penalties, bound
+            since_improvement = 0
+        else:
+            since_improvement += 1
+            if since_improvement == 10:
+                scale /= 2
+                since_improvement = 0
+        subgradient = degrees - 2
+        norm = (subgradient ** 2).sum()
+        if norm == 0 or bound >= upper_bound - 1e-9 or scale < 1e-4:
+            break
+        penalties = penalties + scale * (upper_bound - bound) / norm * subgradient
+    return best_penalties, best_bound
@@ -0,0 +1,149 @@
+import numpy as np
+from graph_tools import ConstructGraph
+from algorithms import pairwise_exchange
+from algorithms.budget import Budget
+from algorithms.pairwise_exchange import _LocalSearch
+#Iterated Lin-Kernighan style local search: the 2-opt and Or-opt moves of pairwise_exchange plus the sequential 3-opt
+#move exchanging two consecutive segments, then random double bridge kicks repaired by the local search until the budget is spent.
+#Neither the 3-opt move nor the double bridge reverses a part of the tour, they keep their gain on asymmetric times.
+
+#Number of seconds of the search when no budget is given
+default_time_budget = 2.0
+
+
+def lin_kernighan(dictionnary, multinodes, budget=None, neighbours=8, max_kick_segment=30, seed=None, tour=None):
+    """Improve a tour with an iterated Lin-Kernighan style local search until the budget is spent
+
+    Args:
+        dictionnary: The graph representation, it is not modified
+        multinodes: The nodes to visit, the tour starts from the first one
+        budget: The Budget of the search, an iteration being a kick, default_time_budget seconds if it has no limit
+        neighbours: The number of nearest successors and predecessors of a node tried as its new neighbour
+        max_kick_segment: The maximum number of nodes of each of the three segments moved by a double bridge kick
+        seed: The seed of the random generator of the kicks
+        tour: The tour to improve, without the return to the start, the nearest neighbour tour if None
+
+    Returns:
+        The tour, starting and ending at the first node"""
+
+    nodes, times = ConstructGraph.to_matrix(dictionnary, list(dict.fromkeys(multinodes)))
+    if tour is None:
+        path = pairwise_exchange.nearest_neighbour_tour(times)
+    else:
+        index = {node: i for i, node in enumerate(nodes)}
+        path = [index[node] for node in tour]
+        start = path.index(0)
+        path = path[start:] + path[:start]
+
+    path = iterated_local_search(times, path, budget, neighbours, max_kick_segment, seed)
+    return [nodes[i] for i in path] + [nodes[0]]
+
+
+def iterated_local_search(times, path, budget=None, neighbours=8, max_kick_segment=30, seed=None):
+    """Improve a tour by local search, then kick the best tour with a double bridge and search again until the budget is spent
+
+    Args:
+        times: The matrix of the times, asymmetric or not
+        path: The tour without the return to its first node, the first node stays first
+        budget: The Budget of the search, an iteration being a kick, default_time_budget seconds if it has no limit
+        neighbours: The number of nearest successors and predecessors of a node tried as its new neighbour
+        max_kick_segment: The maximum number of nodes of each of the three segments moved by a kick
+        seed: The seed of the random generator of the kicks
+
+    Returns:
+        The improved tour, as a numpy array"""
+
+    if budget is None or not budget.is_limited():
+        #The kicks never stop by themselves
+        budget = Budget(default_time_budget, progress=None if budget is None else budget.progress)
+    search = _KOptSearch(times, path, neighbours)
+    search.run(budget.deadline)
+    best_tour = list(search.tour)
+    best_time = search.tour_time()
+    budget.improve(best_time)
+    if search.n < 8:
+        return np.array(best_tour, dtype=np.int64)
+
+    random = np.random.default_rng(seed)
+    kicks = 0
+    while not budget.exhausted():
+        changed = search.double_bridge(random, max_kick_segment)
+        kicks += 1
+        if not search.run(budget.deadline, changed):
+            break
+        if search.tour_time() < best_time - 1e-9:
+            best_tour = list(search.tour)
+            best_time = search.tour_time()
+        else:
+            search.tour = list(best_tour)
+            search._update()
+        budget.step(best_time)
+
+    print("Number of kicks: " + str(kicks))
+    return np.array(best_tour, dtype=np.int64)
+
+
+class _KOptSearch(_LocalSearch):
+
+    def __init__(self, times, path, neighbours):
+        super().__init__(times, path, neighbours, 3)
+
+    def _improve(self, node):
+        return self._two_opt(node) or self._or_opt(node) or self._segment_exchange(node)
+
+    def _segment_exchange(self, node):
+        """Try the sequential 3-opt moves turning node b..c d..e into node d..e b..c
+        The edge from node to its successor b is replaced by an edge to one of its nearest successors d, the edge
+        to b comes from one of its nearest predecessors e, and each step must keep the partial gain positive."""
+
+        d, tour, n = self.d, self.tour, self.n
+        i = self.position[node]
+        b = tour[(i + 1) % n]
+        removed_ab = d[node][b]
+        for second in self.successors[node]:
+            first_gain = removed_ab - d[node][second]
+            if first_gain <= 1e-9:
+                break
+            #Positions relative to node: b is at 1, the segment b..c ends just before d
+            j = (self.position[second] - i) % n
+            if j < 2:
+                continue
+            c = tour[(i + j - 1) % n]
+            second_gain = first_gain + d[c][second]
+            for end in self.predecessors[b]:
+                if d[end][b] >= second_gain - 1e-9:
+                    break
+                k = (self.position[end] - i) % n
+                if k < j:
+                    continue
+                f = tour[(i + k + 1) % n]
+                if second_gain - d[end][b] + d[end][f] - d[c][f] > 1e-9:
+                    rotated = tour[i:] + tour[:i]
+                    rotated = rotated[:1] + rotated[j:k + 1] + rotated[1:j] + rotated[k + 1:]
+                    first = rotated.index(tour[0])
+                    self.tour = rotated[first:] + rotated[:first]
+                    self._update()
+                    return (node, b, c, second, end, f)
+        return None
+
+    def double_bridge(self, random, max_segment):
+        """Exchange the order of three consecutive segments at a random place of the tour: A B C D becomes A D C B
+
+        Args:
+            random: The numpy random generator
+            max_segment: The maximum number of nodes of each segment
+
+        Returns:
+            The nodes at the ends of the changed edges"""
+
+        tour, n = self.tour, self.n
+        lengths = random.integers(1, min(max_segment, (n - 1) // 3) + 1, size=3)
+        start = int(random.integers(1, n - int(lengths.sum()) + 1))
+        second = start + int(lengths[0])
+        third = second + int(lengths[1])
+        end = third + int(lengths[2])
+        changed = (tour[start - 1], tour[start], tour[second - 1], tour[second], tour[third - 1], tour[third],
+                   tour[end - 1], tour[end % n])
+        self.tour = tour[:start] + tour[third:end] + tour[second:third] + tour[start:second] + tour[end:]
+        self._update()
+        return list(dict.fromkeys(changed))
@@ -1,142 +1,216 @@
-import networkx as nx
-import osmnx as ox
-from itertools import permutations, combinations
-from random import choice
-
-from algorithms import dijkstra
-
-
-def multiNodes_to_starGraph(graph: nx.MultiDiGraph, multi_nodes: list[nx.nodes], algo=dijkstra.dijkstra) -> nx.DiGraph:
-    
-    star_graph = nx.DiGraph()
-    
-    # get tuple of every possible combination, permutations allowed NOT duplicates
-    paths_to_find = permutations(multi_nodes, 2)
-    
-    # add to graph every weighted edge and store path with it
-    for edge in paths_to_find:
-        
-        weight, path_found = algo(graph, *edge)
-        star_graph.add_weighted_edges_from([(*edge, weight)], path=path_found)      
-    
-    return star_graph
-
-def starGraph_to_ringGraph(star_graph: nx.DiGraph) -> nx.DiGraph:
-    ring_graph = nx.DiGraph()
-    
-    # randomly pick a node
-    start_node = list(star_graph.nodes)[0]
-    
-    # get nearest node
-    nearest_node, properties = min(star_graph[start_node].items(), key=lambda edge: edge[1]["time"])
-    
-    # add weight and node
-    ring_graph.add_edge(start_node, nearest_node, weight = properties["time"])
-    
-    search_node = nearest_node
-    
-    while not all(node in ring_graph for node in star_graph.nodes):
-        # get a sorted list of the nearest node
-        sorted_nearest_nodes = sorted(star_graph[search_node].items(), key=lambda edge: edge[1]["time"])
-        for nearest_node, properties in sorted_nearest_nodes:
-            if nearest_node not in ring_graph:
-                ring_graph.add_edge(search_node, nearest_node, weight = properties["time"])
-                search_node = nearest_node
-                break
-    
-    ring_graph.add_edge(search_node, start_node, weight=star_graph[start_node][nearest_node]["time"])
-
-    return ring_graph
-
-def get_path_graphs(ring_graph: nx.DiGraph)-> list[nx.DiGraph]:
-    path_graph_list = [component for component in nx.weakly_connected_components(ring_graph)]
-    
-    return path_graph_list
-
-def exchange_nodes(star_graph: nx.DiGraph, ring_graph: nx.DiGraph, recursion: int):
-    edges = list(ring_graph.edges)
-    
-    #get a random edge and convert to list
-    switch_edge1 = list(edges.pop(edges.index(choice(edges))))
-    switch_edge1.append(star_graph.get_edge_data(*switch_edge1, "time"))
-    
-    # remove neighbor edges of the nodes in switch_edge1
-    edges = [edge for edge in edges if not(switch_edge1[0] in edge or switch_edge1[1] in edge)]
-
-    #get a random edge and convert to list
-    switch_edge2 = list(edges.pop(edges.index(choice(edges))))
-    switch_edge2.append(star_graph.get_edge_data(*switch_edge2, "time"))
-    ring_graph.remove_edges_from([switch_edge1, switch_edge2])
-    
-    # swap edges
-    switch_edge1[1], switch_edge2[0] = switch_edge2[0], switch_edge1[1]
-       
-    # ring graph is currently composed of 2 path graphs
-    list_path_graph_nodes = get_path_graphs(ring_graph)
-    
-    # create the 2 path graphs
-    path_graph_A = ring_graph.copy()
-    path_graph_A.remove_nodes_from(list_path_graph_nodes[0])
-    path_graph_B = ring_graph.copy()
-    path_graph_B.remove_nodes_from(list_path_graph_nodes[1])
-    
-    # find the path graph to reverse
-    graph_reversed = None
-    if switch_edge1[1] in path_graph_A:
-        if path_graph_A.predecessors(switch_edge1[1]):
-            path_graph_A = path_graph_A.reverse()
-            graph_reversed = path_graph_A
-        else:
-            path_graph_B = path_graph_B.reverse()
-            graph_reversed = path_graph_B
+import numpy as np
+import time as timestamp
+from collections import deque
+from graph_tools import ConstructGraph
+from algorithms.budget import get_budget
+#Local search on an array tour: 2-opt and Or-opt moves evaluated in O(1), driven by neighbour lists and don't-look bits.
+#The times can be asymmetric: the time of a reversed part of the tour is read from the prefix sums of the tour in both directions.
+
+
+def pairwise_exchange(dictionnary, multinodes, budget=None, tour=None):
+    """Improve a tour with 2-opt and Or-opt moves until no move improves it or the budget is spent
+
+    Args:
+        dictionnary: The graph representation, it is not modified
+        multinodes: The nodes to visit, the tour starts from the first one
+        budget: The Budget of the search, an iteration being an improving move, no limit if None
+        tour: The tour to improve, without the return to the start, the nearest neighbour tour if None
+
+    Returns:
+        The tour, starting and ending at the first node"""
+
+    nodes, times = ConstructGraph.to_matrix(dictionnary, list(dict.fromkeys(multinodes)))
+    if tour is None:
+        path = nearest_neighbour_tour(times)
     else:
-        if path_graph_B.predecessors(switch_edge1[1]):
-            path_graph_B = path_graph_B.reverse()
-            graph_reversed = path_graph_B
-        else:
-            path_graph_A = path_graph_A.reverse()
-            graph_reversed = path_graph_A
-    
-    # update weights of reversed path
-    weighted_edges = [(*edge, star_graph[edge[0]][edge[1]]["time"]) for edge in graph_reversed.edges]
-    graph_reversed.add_weighted_edges_from(weighted_edges)
-    
-    # reconstruct graph
-    ring_graph = nx.union(path_graph_A, path_graph_B)
-    ring_graph.add_edges_from([switch_edge1, switch_edge2])
-    
-    print(f"recursion: {recursion} size: ", ring_graph.size(weight="time"))
-    
-    # return swapped graph
-    if recursion == 1:
-        return ring_graph
-    
-    new_ring_graph = exchange_nodes(star_graph, ring_graph.copy(), recursion - 1)
-
-    # return the smallest weighted paths
-    if new_ring_graph.size(weight="time") < ring_graph.size(weight="time"):
-        return new_ring_graph
-    
-    return ring_graph
-
-
-def ring_graph_to_multinodes(ring_graph: nx.DiGraph, start_node):
-    multinodes = [start_node]
-    search_node = start_node
-    for i in range(len(ring_graph.nodes)):
-        for adj in ring_graph.adj[search_node]:
-            multinodes.append(adj)
-        search_node = adj
-    return multinodes
-    
-    
-
-def pairwise_exchange(dictionnary, multinodes: list[nx.nodes], recursion):
-    star_graph = nx.DiGraph(dictionnary)
-    ring_graph = starGraph_to_ringGraph(star_graph)
-    
-    ring_graph = exchange_nodes(star_graph, ring_graph, recursion)
-
-    multinodes = ring_graph_to_multinodes(ring_graph, start_node=multinodes[0])
-    print(multinodes)
-    return multinodes
+        index = {node: i for i, node in enumerate(nodes)}
+        path = [index[node] for node in tour]
+        start = path.index(0)
+        path = path[start:] + path[:start]
+
+    path = local_search(times, path, budget=get_budget(budget))
+    return [nodes[i] for i in path] + [nodes[0]]
+
+
+def nearest_neighbour_tour(times, start=0):
+    """Build the tour going to the nearest node not visited yet
+
+    Args:
+        times: The matrix of the times
+        start: The first node
+
+    Returns:
+        The tour without the return to the start"""
+
+    n = len(times)
+    visited = np.zeros(n, dtype=bool)
+    path = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        next_node = int(np.argmin(np.where(visited, np.inf, times[path[-1]])))
+        path.append(next_node)
+        visited[next_node] = True
+    return path
+
+
+def tour_time(times, path):
+    """Return the time of the tour going through the path and back to its first node"""
+    path = np.asarray(path)
+    return float(times[path, np.roll(path, -1)].sum())
+
+
+def local_search(times, path, neighbours=8, max_segment=3, time_budget=None, budget=None):
+    """Apply improving 2-opt and Or-opt moves to a tour until it is a local optimum
+
+    Args:
+        times: The matrix of the times, asymmetric or not
+        path: The tour without the return to its first node, the first node stays first
+        neighbours: The number of nearest successors and predecessors of a node tried as its new neighbour
+        max_segment: The maximum number of consecutive nodes moved by an Or-opt move
+        time_budget: The maximum number of seconds of the search, no limit if None
+        budget: The Budget counting each improving move as an iteration, no limit if None
+
+    Returns:
+        The improved tour, as a numpy array"""
+
+    search = _LocalSearch(times, path, neighbours, max_segment)
+    search.run(None if time_budget is None else timestamp.time() + time_budget, budget=budget)
+    return np.array(search.tour, dtype=np.int64)
+
+
+class _LocalSearch:
+
+    def __init__(self, times, path, neighbours, max_segment):
+        self.n = len(path)
+        self.d = np.asarray(times, dtype=np.float64).tolist()
+        self.tour = [int(node) for node in path]
+        self.max_segment = max_segment
+
+        #Neighbour lists: the nearest successors and predecessors of each node
+        k = min(neighbours, self.n - 1)
+        masked = np.asarray(times, dtype=np.float64) + np.diag(np.full(len(times), np.inf))
+        self.successors = np.argsort(masked, axis=1)[:, :k].tolist()
+        self.predecessors = np.argsort(masked.T, axis=1)[:, :k].tolist()
+        self.candidates = [list(dict.fromkeys(after + before)) for after, before in zip(self.successors, self.predecessors)]
+        self._update()
+
+    def run(self, deadline=None, nodes=None, budget=None):
+        """Process the nodes whose don't-look bit is off until none is left
+
+        Args:
+            deadline: The time.time() at which the search stops, no limit if None
+            nodes: The nodes whose don't-look bit is off at the start, every node if None
+            budget: The Budget counting each improving move as an iteration, no limit if None
+
+        Returns:
+            False if the search was stopped by the deadline or the budget"""
+
+        if budget is not None:
+            budget.improve(self.tour_time())
+        if self.n < 4:
+            return True
+        active = deque(self.tour if nodes is None else nodes)
+        is_active = [False] * len(self.d)
+        for node in active:
+            is_active[node] = True
+        processed = 0
+        while active:
+            processed += 1
+            if processed % 64 == 0 and ((deadline is not None and timestamp.time() > deadline)
+                                        or (budget is not None and budget.exhausted())):
+                return False
+            node = active.popleft()
+            is_active[node] = False
+            changed = self._improve(node)
+            if changed:
+                if budget is not None and not budget.step(self.tour_time()):
+                    return False
+                #The ends of the new edges are searched again
+                active.appendleft(node)
+                is_active[node] = True
+                for other in changed:
+                    if not is_active[other]:
+                        is_active[other] = True
+                        active.append(other)
+        return True
+
+    def _improve(self, node):
+        """Apply the first improving move found around node
+
+        Returns:
+            The nodes at the ends of the changed edges, or None"""
+        return self._two_opt(node) or self._or_opt(node)
+
+    def tour_time(self):
+        """Time of the current tour, back to its first node"""
+        if not self.tour:
+            return 0.0
+        return self.forward[-1] + self.d[self.tour[-1]][self.tour[0]]
+
+    def _update(self):
+        """Recompute the positions and the prefix sums of the tour in both directions"""
+        d, tour = self.d, self.tour
+        self.position = [0] * len(d)
+        for i, node in enumerate(tour):
+            self.position[node] = i
+        self.forward = [0.0] * self.n
+        self.backward = [0.0] * self.n
+        for i in range(self.n - 1):
+            self.forward[i + 1] = self.forward[i] + d[tour[i]][tour[i + 1]]
+            self.backward[i + 1] = self.backward[i] + d[tour[i + 1]][tour[i]]
+
+    def _reversal_delta(self, low, high):
+        """Change of the time of the tour when tour[low+1:high+1] is reversed"""
+        d, tour = self.d, self.tour
+        a, b, c, e = tour[low], tour[low + 1], tour[high], tour[(high + 1) % self.n]
+        return (d[a][c] + (self.backward[high] - self.backward[low + 1]) + d[b][e]
+                - d[a][b] - (self.forward[high] - self.forward[low + 1]) - d[c][e])
+
+    def _two_opt(self, node):
+        """Try the 2-opt moves linking node, or the node before it, to one of its neighbours"""
+        i = self.position[node]
+        for other in self.candidates[node]:
+            j = self.position[other]
+            for low, high in (sorted((i, j)), sorted((i - 1, j - 1))):
+                if low < 0 or high - low < 2:
+                    continue
+                if self._reversal_delta(low, high) < -1e-9:
+                    tour = self.tour
+                    changed = (tour[low], tour[low + 1], tour[high], tour[(high + 1) % self.n])
+                    tour[low + 1:high + 1] = tour[low + 1:high + 1][::-1]
+                    self._update()
+                    return changed
+        return None
+
+    def _or_opt(self, node):
+        """Try to move the segment starting at node, of 1 to max_segment nodes, after one of the neighbours of node"""
+        d, tour, n = self.d, self.tour, self.n
+        i = self.position[node]
+        if i == 0:
+            return None
+        for length in range(1, self.max_segment + 1):
+            end = i + length - 1
+            if end > n - 1 or length > n - 3:
+                break
+            first, last = tour[i], tour[end]
+            previous, following = tour[i - 1], tour[(end + 1) % n]
+            removal = d[previous][first] + d[last][following] - d[previous][following]
+            reversed_change = (self.backward[end] - self.backward[i]) - (self.forward[end] - self.forward[i])
+            for other in self.candidates[node]:
+                position = self.position[other]
+                if i - 1 <= position <= end:
+                    continue
+                after = tour[(position + 1) % n]
+                #Insert the segment between other and after, in its direction or reversed
+                forward = d[other][first] + d[last][after] - d[other][after]
+                backward = d[other][last] + reversed_change + d[first][after] - d[other][after]
+                if min(forward, backward) - removal < -1e-9:
+                    segment = tour[i:end + 1]
+                    if backward < forward:
+                        segment.reverse()
+                    rest = tour[:i] + tour[end + 1:]
+                    insert = rest.index(other) + 1
+                    self.tour = rest[:insert] + segment + rest[insert:]
+                    self._update()
+                    return (previous, following, other, after, first, last)
+        return None
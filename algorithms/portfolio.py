@@ -0,0 +1,128 @@
+import multiprocessing
+import queue
+import time as timestamp
+from multiprocessing import shared_memory
+import numpy as np
+from graph_tools import ConstructGraph
+from algorithms import ant_colony, christofides, held_karp, lin_kernighan, pairwise_exchange
+from algorithms.budget import Budget, get_budget
+#Portfolio of TSP solvers: each solver runs in its own process on the times matrix shared once in shared memory,
+#the best tour received is kept and returned at the deadline, when every solver is done or when a solver proved its tour optimal.
+
+#Solvers of the portfolio, called as solver(times, budget, seed) and returning (tour without the return to the node 0, proved optimal)
+def _christofides(times, budget, seed):
+    return christofides.christofides_matrix(times), False
+
+def _ant_colony(times, budget, seed):
+    colony = ant_colony.max_min_ant_system(None, 0, matrix=(list(range(len(times))), times), seed=seed)
+    return colony.run(budget)[:-1], False
+
+def _local_search(times, budget, seed):
+    return lin_kernighan.iterated_local_search(times, pairwise_exchange.nearest_neighbour_tour(times), budget, seed=seed).tolist(), False
+
+def _held_karp(times, budget, seed):
+    return held_karp.held_karp_matrix(times), True
+
+solvers = {
+    "Christofides": _christofides,
+    "MAX-MIN Ant System": _ant_colony,
+    "Lin-Kernighan": _local_search,
+    "Held-Karp": _held_karp,
+}
+
+#Part of the deadline given to the solvers with a time budget, the rest is left to start the processes and send back the tour
+budget_ratio = 0.8
+#Number of seconds of the portfolio when the budget has no time limit
+default_time_budget = 5.0
+
+
+def portfolio(dictionnary, multinodes, budget=None, seed=None, names=None):
+    """Run several TSP solvers at the same time and return the best tour found before the deadline
+    The nearest neighbour tour is the answer if no solver finishes in time. The solvers still running at the deadline are
+    terminated, so the call never lasts much longer than the deadline.
+
+    Args:
+        dictionnary: The graph representation, it is not modified
+        multinodes: The nodes to visit, the tour starts from the first one
+        budget: The Budget of the portfolio, an iteration being a tour received from a solver. Its time limit is the
+            maximum duration of the call, default_time_budget seconds if it has none
+        seed: The seed of the random generators of the solvers
+        names: The names of the solvers to run, from solvers, every solver if None. Held-Karp only runs when its table
+            fits in memory
+
+    Returns:
+        The best tour found, starting and ending at the first node"""
+
+    budget = get_budget(budget)
+    deadline = budget.remaining()
+    if deadline is None:
+        deadline = default_time_budget
+    start = timestamp.time()
+    nodes, times = ConstructGraph.to_matrix(dictionnary, list(dict.fromkeys(multinodes)))
+    best_path = pairwise_exchange.nearest_neighbour_tour(times)
+    best_time = pairwise_exchange.tour_time(times, best_path)
+    budget.improve(best_time)
+    if len(nodes) < 4:
+        return [nodes[i] for i in best_path] + nodes[:1]
+
+    if names is None:
+        names = list(solvers)
+    if "Held-Karp" in names and held_karp.table_bytes(len(nodes)) > held_karp.max_table_bytes:
+        names = [name for name in names if name != "Held-Karp"]
+
+    #The workers map the matrix read-only instead of receiving a copy each
+    memory = shared_memory.SharedMemory(create=True, size=times.nbytes)
+    np.ndarray(times.shape, dtype=times.dtype, buffer=memory.buf)[:] = times
+    results = multiprocessing.Queue()
+    #The time budget ends at the same time for every solver, however long its process took to start
+    stop = start + deadline * budget_ratio
+    processes = [multiprocessing.Process(target=_worker, args=(name, memory.name, times.shape, stop, seed, results), daemon=True)
+                 for name in names]
+    try:
+        for process in processes:
+            process.start()
+        received = 0
+        while received < len(processes):
+            remaining = start + deadline - timestamp.time()
+            if remaining <= 0:
+                break
+            try:
+                name, path, optimal = results.get(timeout=remaining)
+            except queue.Empty:
+                break
+            received += 1
+            if path is None:
+                continue
+            path_time = pairwise_exchange.tour_time(times, path)
+            print("Tour of " + name + ": " + str(path_time))
+            if path_time < best_time:
+                best_path, best_time = path, path_time
+            if not budget.step(best_time) or optimal:
+                break
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        results.close()
+        memory.close()
+        memory.unlink()
+
+    return [nodes[i] for i in best_path] + nodes[:1]
+
+
+def _worker(name, memory_name, shape, stop, seed, results):
+    """Run a solver of the portfolio on the shared matrix and send (name, tour, proved optimal) back, the tour being None on error"""
+    memory = shared_memory.SharedMemory(name=memory_name)
+    times = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    times.flags.writeable = False
+    try:
+        path, optimal = solvers[name](times, Budget(max(0.0, stop - timestamp.time())), seed)
+        results.put((name, [int(node) for node in path], optimal))
+    except Exception as error:
+        print("Error of " + name + ": " + str(error))
+        results.put((name, None, False))
+    finally:
+        del times
+        memory.close()
@@ -0,0 +1,143 @@
+import os
+import pickle
+import re
+import unicodedata
+import pandas as pd
+from graph_tools import Geocoder
+#Offline geocoder of the French communes, built from the communes dataset, asking Nominatim only for the other places.
+
+communes_filename = os.path.join("testtools", "dataset", "communes-departement-region.csv")
+
+#Index of the communes of each dataset, loaded once per process
+_indexes = {}
+
+
+class CommunesGeocoder:
+
+    def __init__(self, filename=communes_filename, index_filename=os.path.join("cache", "communes_index.pickle"), fallback=None, rate_limit=1.0):
+        """Create a geocoder answering the names of communes from the dataset
+
+        Args:
+            filename: The communes dataset, with the columns nom_commune, nom_departement, nom_region, latitude, longitude
+                and optionally code_commune_INSEE and code_postal. Without it every query is sent to the fallback
+            index_filename: The file caching the index built from the dataset, rebuilt when the dataset changes
+            fallback: The geocoder of the queries that are not a commune, a default Geocoder if None
+            rate_limit: The maximum number of requests per second of the default Geocoder, see Geocoder"""
+
+        self.index = _load_index(filename, index_filename)
+        self.fallback = fallback
+        self.rate_limit = rate_limit
+        self._own_fallback = False
+
+    def close(self):
+        if self._own_fallback:
+            self.fallback.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def geocode(self, addresses):
+        """Get the coordinates of the addresses, from the index for the communes and from the fallback for the others
+
+        Args:
+            addresses: The list of addresses
+
+        Returns:
+            The list of (latitude, longitude), in the order of the addresses"""
+
+        coordinates = [self.lookup(address) for address in addresses]
+        missing = [address for address, found in zip(addresses, coordinates) if found is None]
+        if missing:
+            if self.fallback is None:
+                self.fallback = Geocoder.Geocoder(rate_limit=self.rate_limit)
+                self._own_fallback = True
+            found = iter(self.fallback.geocode(missing))
+            coordinates = [next(found) if value is None else value for value in coordinates]
+        return coordinates
+
+    def lookup(self, address):
+        """Find an address in the index
+        An address is found if one of its parts is a commune and every other part is the country, the department,
+        the region or the postal code of that commune, and if that leaves a single commune.
+
+        Args:
+            address: The address, like "Essert, Territoire de Belfort"
+
+        Returns:
+            The (latitude, longitude) of the commune, or None"""
+
+        parts = [part for part in (fold_name(part) for part in address.split(",")) if part and part != "france"]
+        for i, part in enumerate(parts):
+            others = parts[:i] + parts[i + 1:]
+            candidates = [commune for commune in self.index.get(part, ())
+                          if all(other in commune[2] for other in others)]
+            if len(candidates) == 1:
+                return candidates[0][0], candidates[0][1]
+        return None
+
+
+def fold_name(name):
+    """Fold a name to its index key: no accents, no case, hyphens and apostrophes as spaces, "st" as "saint"
+    :param name: the name
+    :return: the key
+    """
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(character for character in name if not unicodedata.combining(character))
+    name = re.sub(r"[-'’._]", " ", name)
+    name = re.sub(r"\bste?\b", lambda match: "sainte" if match.group() == "ste" else "saint", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+def build_index(filename=communes_filename):
+    """Build the index of the communes dataset
+    :param filename: the communes dataset
+    :return: dict mapping the key of a commune name to the (latitude, longitude, qualifiers) of the communes of that name,
+    the qualifiers being the keys of the department, the region and the postal codes
+    """
+    columns = {"code_commune_INSEE", "latitude", "longitude", "nom_commune", "nom_departement", "nom_region", "code_postal"}
+    communes_df = pd.read_csv(filename, usecols=lambda column: column in columns, dtype=str)
+    communes_df = communes_df.dropna(subset=["latitude", "longitude", "nom_commune"])
+
+    #The dataset has one row per postal code of a commune
+    communes = {}
+    for row in communes_df.itertuples(index=False):
+        key = fold_name(row.nom_commune)
+        department = fold_name(row.nom_departement) if isinstance(row.nom_departement, str) else ""
+        code = getattr(row, "code_commune_INSEE", None)
+        commune = communes.setdefault((key, code if isinstance(code, str) else department), [float(row.latitude), float(row.longitude), {department}])
+        if isinstance(row.nom_region, str):
+            commune[2].add(fold_name(row.nom_region))
+        if isinstance(getattr(row, "code_postal", None), str):
+            commune[2].add(row.code_postal.zfill(5))
+
+    index = {}
+    for (key, _), (latitude, longitude, qualifiers) in communes.items():
+        index.setdefault(key, []).append((latitude, longitude, frozenset(qualifiers)))
+    return {key: tuple(value) for key, value in index.items()}
+
+def _load_index(filename, index_filename):
+    """Get the index of the dataset, from memory, from the index file if it is up to date, else build it"""
+    if not os.path.exists(filename):
+        return {}
+    stat = os.stat(filename)
+    source = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+    if source in _indexes:
+        return _indexes[source]
+
+    if os.path.exists(index_filename):
+        with open(index_filename, "rb") as file:
+            cached = pickle.load(file)
+        if cached["source"] == source:
+            _indexes[source] = cached["index"]
+            return cached["index"]
+
+    index = build_index(filename)
+    directory = os.path.dirname(index_filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(index_filename, "wb") as file:
+        pickle.dump({"source": source, "index": index}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    _indexes[source] = index
+    return index
@@ -0,0 +1,136 @@
+import numpy as np
+import hashlib
+import weakref
+#Compact routing graph compiled once from the OSMnx graph, used by the shortest path algorithms instead of the networkx object.
+
+#Compiled version of the networkx graphs given to as_compiled, dropped with the networkx graph
+_compiled_graphs = weakref.WeakKeyDictionary()
+
+
+class CompiledGraph:
+
+    def __init__(self, osm_ids, x, y, forward_indptr, forward_indices, forward_times, backward_indptr, backward_indices, backward_times, max_speed):
+        """Create a compiled graph from its arrays.
+        The nodes are numbered from 0 to n-1 in the order of their OSM id, the edges leaving node i are
+        forward_indices[forward_indptr[i]:forward_indptr[i+1]] and the edges entering it are stored the same way
+        in the backward arrays. The weight of an edge is the minimum travel time over the parallel edges.
+
+        Args:
+            osm_ids: The sorted OSM ids of the nodes
+            x: The longitude of the nodes
+            y: The latitude of the nodes
+            forward_indptr, forward_indices, forward_times: CSR arrays of the outgoing edges
+            backward_indptr, backward_indices, backward_times: CSR arrays of the incoming edges
+            max_speed: The maximum speed over all the edges in m/s"""
+
+        self.osm_ids = osm_ids
+        self.x = x
+        self.y = y
+        self.forward_indptr = forward_indptr
+        self.forward_indices = forward_indices
+        self.forward_times = forward_times
+        self.backward_indptr = backward_indptr
+        self.backward_indices = backward_indices
+        self.backward_times = backward_times
+        self.max_speed = max_speed
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.osm_ids)
+
+    def number_of_edges(self):
+        """Return the number of edges once the parallel edges are merged"""
+        return len(self.forward_indices)
+
+    def node_index(self, osm_id):
+        """Return the integer id of an OSM node, raise KeyError if the node is not in the graph"""
+        index = int(np.searchsorted(self.osm_ids, osm_id))
+        if index == len(self.osm_ids) or self.osm_ids[index] != osm_id:
+            raise KeyError(osm_id)
+        return index
+
+    def osm_path(self, path):
+        """Convert a path of integer ids to a path of OSM ids"""
+        return self.osm_ids[path].tolist()
+
+    def bounds(self):
+        """Return the (minlat, maxlat, minlon, maxlon) of the nodes, the area the graph really covers"""
+        return float(self.y.min()), float(self.y.max()), float(self.x.min()), float(self.x.max())
+
+    def fingerprint(self):
+        """Return a hash of the nodes and the edges of the graph, used to name the data computed from it"""
+        if self._fingerprint is None:
+            digest = hashlib.sha1()
+            for array in (self.osm_ids, self.forward_indptr, self.forward_indices, self.forward_times):
+                digest.update(np.ascontiguousarray(array).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def nbytes(self):
+        """Return the memory used by the arrays of the graph"""
+        return sum(array.nbytes for array in (self.osm_ids, self.x, self.y,
+                                              self.forward_indptr, self.forward_indices, self.forward_times,
+                                              self.backward_indptr, self.backward_indices, self.backward_times))
+
+
+def compile_graph(graph):
+    """Compile an OSMnx graph to a CompiledGraph
+    :param graph: networkx MultiDiGraph with the travel_time (or length) of the edges and the x, y of the nodes
+    :return: the compiled graph
+    """
+    osm_ids = np.array(sorted(graph.nodes), dtype=np.int64)
+    index = {osm_id: i for i, osm_id in enumerate(osm_ids.tolist())}
+    x = np.array([graph.nodes[osm_id]["x"] for osm_id in osm_ids.tolist()], dtype=np.float64)
+    y = np.array([graph.nodes[osm_id]["y"] for osm_id in osm_ids.tolist()], dtype=np.float64)
+
+    tails, heads, weights, _, max_speed = _fastest_edges(graph, index)
+
+    forward_indptr, forward_indices, forward_times = _csr(tails, heads, weights, len(osm_ids))
+    backward_indptr, backward_indices, backward_times = _csr(heads, tails, weights, len(osm_ids))
+
+    return CompiledGraph(osm_ids, x, y, forward_indptr, forward_indices, forward_times, backward_indptr, backward_indices, backward_times, max_speed)
+
+
+def as_compiled(graph):
+    """Return the graph if it is already compiled, else its compiled version, only computed once for each networkx graph
+    The networkx graph must not be modified afterwards.
+    :param graph: networkx MultiDiGraph or CompiledGraph
+    :return: the compiled graph
+    """
+    if isinstance(graph, CompiledGraph):
+        return graph
+    if graph not in _compiled_graphs:
+        _compiled_graphs[graph] = compile_graph(graph)
+    return _compiled_graphs[graph]
+
+
+def _fastest_edges(graph, index):
+    """Keep the fastest of the parallel edges of a networkx graph
+    :param graph: networkx MultiDiGraph with the travel_time (or length) of the edges
+    :param index: the integer id of each node
+    :return: the tails, heads, travel times and lengths of the edges kept, and the maximum speed of the graph in m/s
+    """
+    edges = {}
+    max_speed = 8.33 # 30 km/h, speed of the edges without travel time
+    for u, v, data in graph.edges(data=True):
+        time = data["travel_time"] if "travel_time" in data else data["length"] / 8.33 # 30 km/h
+        edge = (index[u], index[v])
+        if edge not in edges or time < edges[edge][0]:
+            edges[edge] = (time, data.get("length", time * 8.33))
+        #Speed given by ox.add_edge_speeds, in km/h
+        if "speed_kph" in data:
+            max_speed = max(max_speed, float(data["speed_kph"]) / 3.6)
+
+    tails = np.fromiter((u for u, _ in edges), dtype=np.int32, count=len(edges))
+    heads = np.fromiter((v for _, v in edges), dtype=np.int32, count=len(edges))
+    times = np.fromiter((time for time, _ in edges.values()), dtype=np.float32, count=len(edges))
+    lengths = np.fromiter((length for _, length in edges.values()), dtype=np.float32, count=len(edges))
+    return tails, heads, times, lengths, max_speed
+
+
+def _csr(tails, heads, weights, n, *other_weights):
+    """Build the CSR arrays of the edges tails -> heads, the other weights of the edges are ordered like weights"""
+    order = np.lexsort((heads, tails))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=n), out=indptr[1:])
+    return (indptr, heads[order], weights[order], *(other[order] for other in other_weights))
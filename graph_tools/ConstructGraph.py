@@ -1,36 +1,202 @@
-from algorithms import dijkstra
+from algorithms import dijkstra, astar, contraction_hierarchies
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import os
 #Construct a graph representation of the network of places to visited ready to be used by a TSP solver.
 
-def construct_graph(graph, nodes, algorithm = dijkstra.dijkstra):
+#Algorithms computing a whole row of the matrix with a single search, called as algorithm(graph, source, targets)
+one_to_many_algorithms = [dijkstra.dijkstra_one_to_many]
+
+#Algorithms computing the whole matrix at once, called as algorithm(graph, sources, targets)
+many_to_many_algorithms = [contraction_hierarchies.contraction_hierarchies_many_to_many]
+
+#Under this number of nodes the matrix is built serially, starting the processes costs more than it saves
+parallel_min_nodes = 8
+
+#State of a worker process, set once by _init_worker so the road graph is not sent with every row
+_worker_graph = None
+_worker_algorithm = None
+
+def construct_graph(graph, nodes, algorithm = dijkstra.dijkstra, workers = 1, known = None):
     """Construct a graph representation of the network of places to visited ready to be used by a TSP solver.
     The graph is represented as a dictionary of dictionaries. The keys are the nodes of the graph,
-    and the values are dictionaries containing the time needed to travel between the node and its neighbors and 
-    the path to take to reach them.
-    
+    and the values are dictionaries containing the time needed to travel between the node and its neighbors and
+    the predecessor tree of the search of the row, shared by the neighbors, from which get_path rebuilds the path to take.
+
     Parameters:
-    graph (networkx graph): the graph of the network
+    graph (networkx graph or CompiledGraph): the graph of the network
     nodes (list): the list of nodes to visit
-    
+    algorithm (function): the shortest path algorithm, either point to point, one to many or many to many
+    workers (int): the number of processes computing the rows, None to use every core
+    known (dict): the (time, tree) tuples already known, known[start_node][end_node], they are not computed again
+
     Returns:
     dict: the graph representation
     """
+    computed = compute_paths(graph, nodes, algorithm, workers, known)
+    return make_graph(nodes, known, computed)
 
-    #Create a graph with only the nodes to visit
-    G = {node: {} for node in nodes}
+def compute_paths(graph, nodes, algorithm = dijkstra.dijkstra, workers = 1, known = None):
+    """Compute the shortest paths between the nodes to visit that are not already known.
 
-    for start_node in nodes:
-        for end_node in nodes:
+    Parameters:
+    graph (networkx graph or CompiledGraph): the graph of the network
+    nodes (list): the list of nodes to visit
+    algorithm (function): the shortest path algorithm, either point to point, one to many or many to many
+    workers (int): the number of processes computing the rows, None to use every core
+    known (dict): the (time, tree) tuples already known, known[start_node][end_node]
+
+    Returns:
+    dict: the (time, tree) tuples computed, computed[start_node][end_node], the tree being the predecessor map of the row
+    """
+    if known is None:
+        known = {}
+
+    #Targets still missing from each row
+    unique_nodes = list(dict.fromkeys(nodes))
+    missing = {}
+    for start_node in unique_nodes:
+        targets = [end_node for end_node in unique_nodes if end_node != start_node and end_node not in known.get(start_node, {})]
+        if targets:
+            missing[start_node] = targets
 
-            if start_node == end_node:
-                continue
+    if not missing:
+        return {}
 
-            #Find the shortest path between the two nodes
-            time, path = algorithm(graph, start_node, end_node)
+    if algorithm in many_to_many_algorithms:
+        targets = list(dict.fromkeys(end_node for row in missing.values() for end_node in row))
+        results = algorithm(graph, list(missing), targets)
+        return {start_node: {end_node: results[start_node][end_node] for end_node in targets} for start_node, targets in missing.items()}
 
-            if(time != float("inf")):
-                #Add the path to the graph
-                G[start_node][end_node] = {"time": time, "path": path}
-            
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(missing))
 
+    if workers <= 1 or len(missing) < parallel_min_nodes:
+        return {start_node: construct_row(graph, start_node, targets, algorithm) for start_node, targets in missing.items()}
+
+    landmarks = None
+    if algorithm is astar.astar_alt:
+        #The landmarks are computed once before the workers start, each worker would compute them and save the same file
+        graph, landmarks = astar.get_landmarks(graph)
+
+    #Each source row is an independent task, the graph is given once to each worker by the initializer
+    computed = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(graph, algorithm, landmarks)) as executor:
+        for start_node, results in executor.map(_worker_row, missing.items()):
+            computed[start_node] = results
+
+    return computed
+
+def construct_row(graph, start_node, targets, algorithm = dijkstra.dijkstra):
+    """Compute the shortest paths from start_node to the targets.
+
+    Parameters:
+    graph (networkx graph or CompiledGraph): the graph of the network
+    start_node (node): the node the paths start from
+    targets (list): the nodes the paths end at
+    algorithm (function): the shortest path algorithm, either point to point or one to many
+
+    Returns:
+    dict: the (time, tree) tuple to every target, keyed by node, (inf, None) if the target is not reachable
+    """
+    if algorithm in one_to_many_algorithms:
+        #One search settles every target of the row
+        return algorithm(graph, start_node, targets)
+
+    #Find the shortest path between the two nodes, the paths of the row are then merged in a single tree
+    results = {end_node: algorithm(graph, start_node, end_node) for end_node in targets}
+    tree = dijkstra.tree_from_paths([[start_node]] + [path for time, path in results.values() if time != float("inf")])
+    return {end_node: (time, tree if time != float("inf") else None) for end_node, (time, path) in results.items()}
+
+def make_graph(nodes, *results):
+    """Build the graph representation from the results of the shortest path algorithm.
+
+    Parameters:
+    nodes (list): the list of nodes to visit
+    results (dict): the (time, tree) tuples, results[start_node][end_node], the first ones given are used first
+
+    Returns:
+    dict: the graph representation
+    """
+    G = {node: {} for node in nodes}
+    for start_node in G:
+        row = {}
+        for result in results:
+            if result is not None and start_node in result:
+                for end_node, value in result[start_node].items():
+                    if end_node in G and end_node not in row:
+                        row[end_node] = value
+        G[start_node] = make_row(start_node, row)
     return G
-    
\ No newline at end of file
+
+def make_row(start_node, results):
+    """Build a row of the graph representation from the results of a shortest path algorithm.
+    The entries only keep a reference to the predecessor tree of their search, the paths are
+    rebuilt by get_path for the legs of the tour only.
+
+    Parameters:
+    start_node (node): the node the paths start from
+    results (dict): the (time, tree) tuple to each node
+
+    Returns:
+    dict: the time and the predecessor tree to every reachable node, keyed by node
+    """
+    row = {}
+    for end_node, (time, tree) in results.items():
+        if end_node == start_node:
+            continue
+        if(time != float("inf")):
+            row[end_node] = {"time": time, "tree": tree}
+
+    return row
+
+def get_path(G, start_node, end_node):
+    """Rebuild the path between two nodes of the graph representation from the predecessor tree of the row.
+
+    Parameters:
+    G (dict): the graph representation
+    start_node (node): the node the path starts from
+    end_node (node): the node the path ends at
+
+    Returns:
+    list: the nodes of the path
+    """
+    return dijkstra.path_from_predecessor(G[start_node][end_node]["tree"], end_node)
+
+def to_matrix(G, nodes = None, weight = "time"):
+    """Convert the graph representation to a dense matrix of the times, used by the TSP solvers working on arrays.
+    The graph representation is not modified, so it can be kept and reused.
+
+    Parameters:
+    G (dict): the graph representation
+    nodes (list): the order of the rows and columns, the order of G if None
+    weight (str): the key of the value of an entry to put in the matrix
+
+    Returns:
+    list: the nodes, the node i is the row and column i
+    numpy array: times[i][j] is the time from node i to node j, inf if there is no path, 0 on the diagonal
+    """
+    if nodes is None:
+        nodes = list(G)
+    index = {node: i for i, node in enumerate(nodes)}
+    times = np.full((len(nodes), len(nodes)), np.inf)
+    np.fill_diagonal(times, 0)
+    for start_node in nodes:
+        for end_node, value in G[start_node].items():
+            if end_node in index:
+                times[index[start_node], index[end_node]] = value[weight]
+    return nodes, times
+
+def _init_worker(graph, algorithm, landmarks = None):
+    """Store the data shared by every row in the worker process"""
+    global _worker_graph, _worker_algorithm
+    _worker_graph = graph
+    _worker_algorithm = algorithm
+    if landmarks is not None:
+        astar.set_landmarks(graph, landmarks)
+
+def _worker_row(task):
+    """Compute the shortest paths of a row in a worker process"""
+    start_node, targets = task
+    return start_node, construct_row(_worker_graph, start_node, targets, _worker_algorithm)
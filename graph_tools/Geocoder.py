@@ -0,0 +1,136 @@
+import os
+import re
+import sqlite3
+import threading
+import time as timestamp
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import osmnx as ox
+#Geocoder sending the addresses to Nominatim concurrently over one pooled HTTP session, with a persistent cache.
+
+
+class Geocoder:
+
+    def __init__(self, endpoint=None, workers=4, rate_limit=1.0, cache_filename=os.path.join("cache", "geocode.sqlite"), ttl=30 * 24 * 3600, timeout=None):
+        """Create a geocoder
+
+        Args:
+            endpoint: The URL of the Nominatim server, the one of the OSMnx settings by default
+            workers: The maximum number of requests in flight
+            rate_limit: The maximum number of requests per second, None for no limit. The public
+                Nominatim server allows 1 request per second, so with the default the requests are sent one
+                per second whatever the number of workers, which then only overlap the latency of the answers.
+                Raise it or set it to None for a private server to really send the requests concurrently
+            cache_filename: The SQLite file of the cache, None to disable it
+            ttl: The number of seconds a cached address is used before asking the server again
+            timeout: The timeout of a request in seconds, the one of the OSMnx settings by default"""
+
+        self.endpoint = (endpoint or ox.settings.nominatim_endpoint).rstrip("/") + "/search"
+        self.workers = workers
+        self.rate_limit = rate_limit
+        self.ttl = ttl
+        self.timeout = timeout or ox.settings.timeout
+        self.connection = None
+        if cache_filename is not None:
+            directory = os.path.dirname(cache_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(cache_filename)
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS geocodes (
+                address TEXT PRIMARY KEY,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                created REAL NOT NULL)""")
+            self.connection.commit()
+
+        #One session shared by the threads, its connections are kept alive and reused
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"User-Agent": ox.settings.default_user_agent,
+                                     "referer": ox.settings.default_referer,
+                                     "Accept-Language": ox.settings.default_accept_language})
+        self._lock = threading.Lock()
+        self._next_request = 0.0
+
+    def close(self):
+        self.session.close()
+        if self.connection is not None:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def geocode(self, addresses):
+        """Get the coordinates of the addresses, the ones not in the cache are requested concurrently
+
+        Args:
+            addresses: The list of addresses
+
+        Returns:
+            The list of (latitude, longitude), in the order of the addresses"""
+
+        keys = [normalize_address(address) for address in addresses]
+        coordinates = self._fetch(keys)
+        #The first spelling of each address not in the cache is requested
+        missing = {}
+        for address, key in zip(addresses, keys):
+            if key not in coordinates and key not in missing:
+                missing[key] = address
+
+        if missing:
+            start = timestamp.time()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                found = dict(zip(missing, executor.map(self._request, missing.values())))
+            end = timestamp.time()
+            print("Time to geocode", len(missing), "addresses: ", end - start)
+            self._store(found)
+            coordinates.update(found)
+
+        return [coordinates[key] for key in keys]
+
+    def _request(self, address):
+        """Send one address to the server, waiting for the rate limit"""
+        if self.rate_limit:
+            with self._lock:
+                now = timestamp.monotonic()
+                wait = self._next_request - now
+                self._next_request = max(now, self._next_request) + 1 / self.rate_limit
+            if wait > 0:
+                timestamp.sleep(wait)
+
+        response = self.session.get(self.endpoint, params={"q": address, "format": "json", "limit": 1}, timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            raise ValueError("Nominatim could not geocode query " + repr(address))
+        return float(results[0]["lat"]), float(results[0]["lon"])
+
+    def _fetch(self, keys):
+        """Get the cached coordinates of the normalized addresses younger than the ttl"""
+        if self.connection is None or not keys:
+            return {}
+        rows = self.connection.execute("SELECT address, latitude, longitude FROM geocodes WHERE created > ? AND address IN (%s)"
+                                       % ",".join("?" * len(keys)), (timestamp.time() - self.ttl, *keys)).fetchall()
+        return {address: (latitude, longitude) for address, latitude, longitude in rows}
+
+    def _store(self, coordinates):
+        if self.connection is None:
+            return
+        now = timestamp.time()
+        self.connection.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)",
+                                    [(key, latitude, longitude, now) for key, (latitude, longitude) in coordinates.items()])
+        self.connection.commit()
+
+
+def normalize_address(address):
+    """Normalize an address so the different spellings of an address share the same cache entry
+    :param address: the address
+    :return: the normalized address
+    """
+    address = re.sub(r"\s*,\s*", ", ", address.casefold())
+    return re.sub(r"\s+", " ", address).strip(" ,")
@@ -0,0 +1,124 @@
+import json
+import os
+import pickle
+import time as timestamp
+import osmnx as ox
+from graph_tools import Snapper
+#Store of the processed road graphs, ready to route, reused by every request whose area they cover.
+
+
+class GraphStore:
+
+    def __init__(self, folder=os.path.join("cache", "graphs"), max_bytes=2 * 1024**3, max_graphs=20, crop_ratio=4):
+        """Open the store, creating the folder if needed
+
+        Args:
+            folder: The folder of the graph files and of their index, next to the cache of OSMnx by default
+            max_bytes: The maximum size of the graph files, the least recently used ones are removed first
+            max_graphs: The maximum number of graphs kept
+            crop_ratio: A stored graph whose area is more than crop_ratio times the requested area is cropped"""
+
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_graphs = max_graphs
+        self.crop_ratio = crop_ratio
+        os.makedirs(folder, exist_ok=True)
+        self.index_filename = os.path.join(folder, "index.json")
+
+    def find(self, bounds, network_type="drive", simplify=True, places_bounds=None):
+        """Get a stored graph containing the bounds, without any network call
+
+        Args:
+            bounds: The (minlat, maxlat, minlon, maxlon) of the requested area
+            network_type: The type of network
+            simplify: If the graph is simplified
+            places_bounds: The (minlat, maxlat, minlon, maxlon) of the places without margin, a pinned graph
+                only has to contain them since it covers a whole region
+
+        Returns:
+            The graph with the speeds, the travel times and only its largest strongly connected component,
+            or None if no stored graph contains the bounds"""
+
+        index = self._read_index()
+        minlat, maxlat, minlon, maxlon = bounds
+        if places_bounds is None:
+            places_bounds = bounds
+        candidates = [entry for entry in index
+                      if entry["network_type"] == network_type and entry["simplify"] == simplify
+                      and _contains(entry["bounds"], places_bounds if entry.get("pinned", False) else bounds)]
+        if not candidates:
+            return None
+
+        #The smallest graph is the fastest to load and to route on
+        entry = min(candidates, key=lambda entry: _area(entry["bounds"]))
+        with open(os.path.join(self.folder, entry["filename"]), "rb") as file:
+            graph = pickle.load(file)
+
+        entry["last_used"] = timestamp.time()
+        self._write_index(index)
+
+        if _area(entry["bounds"]) > self.crop_ratio * _area(bounds):
+            #Keep a margin around the area so the roads going around the places are not cut
+            margin_lat = 0.5 * (maxlat - minlat)
+            margin_lon = 0.5 * (maxlon - minlon)
+            cropped = ox.truncate.truncate_graph_bbox(graph, min(maxlat + margin_lat, entry["bounds"][1]), max(minlat - margin_lat, entry["bounds"][0]),
+                                                      min(maxlon + margin_lon, entry["bounds"][3]), max(minlon - margin_lon, entry["bounds"][2]), truncate_by_edge=True)
+            if len(cropped) > 1:
+                graph = ox.utils_graph.get_largest_component(cropped, strongly=True)
+        return graph
+
+    def save(self, graph, bounds, network_type="drive", simplify=True, pinned=False):
+        """Add a processed graph to the store, then remove the least recently used graphs above the limits
+
+        Args:
+            graph: The graph with the speeds, the travel times and only its largest strongly connected component
+            bounds: The (minlat, maxlat, minlon, maxlon) of the area of the graph
+            network_type: The type of network
+            simplify: If the graph is simplified
+            pinned: If the graph is never removed, like the graph of a region imported by OsmImport"""
+
+        index = self._read_index()
+        #The node index of the places is saved with the graph, the graphs loaded and cropped later reuse it
+        Snapper.get_snapper(graph)
+        filename = "%s_%d_%f_%f_%f_%f.pickle" % (network_type, simplify, *bounds)
+        with open(os.path.join(self.folder, filename), "wb") as file:
+            pickle.dump(graph, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        index = [entry for entry in index if entry["filename"] != filename]
+        index.append({"filename": filename, "bounds": list(bounds), "network_type": network_type, "simplify": simplify,
+                      "bytes": os.path.getsize(os.path.join(self.folder, filename)), "last_used": timestamp.time(),
+                      "pinned": pinned})
+
+        #Only the downloaded graphs count for the limits
+        pinned_entries = [entry for entry in index if entry.get("pinned", False)]
+        index = [entry for entry in index if not entry.get("pinned", False)]
+        index.sort(key=lambda entry: entry["last_used"])
+        while len(index) > self.max_graphs or (len(index) > 1 and sum(entry["bytes"] for entry in index) > self.max_bytes):
+            entry = index.pop(0)
+            try:
+                os.remove(os.path.join(self.folder, entry["filename"]))
+            except FileNotFoundError:
+                pass
+        self._write_index(pinned_entries + index)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_filename):
+            return []
+        with open(self.index_filename) as file:
+            return json.load(file)
+
+    def _write_index(self, index):
+        #Replace the index in one step so a reader never sees a partial file
+        temporary_filename = self.index_filename + ".tmp"
+        with open(temporary_filename, "w") as file:
+            json.dump(index, file)
+        os.replace(temporary_filename, self.index_filename)
+
+
+def _contains(outer_bounds, bounds):
+    return (outer_bounds[0] <= bounds[0] and bounds[1] <= outer_bounds[1]
+            and outer_bounds[2] <= bounds[2] and bounds[3] <= outer_bounds[3])
+
+def _area(bounds):
+    minlat, maxlat, minlon, maxlon = bounds
+    return (maxlat - minlat) * (maxlon - minlon)
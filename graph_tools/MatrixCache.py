@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import time as timestamp
+import numpy as np
+#Persistent cache of the shortest paths between the places, shared by every session using the same road graph.
+
+
+class MatrixCache:
+
+    def __init__(self, filename=os.path.join("cache", "distance_matrix.sqlite"), max_entries=500000):
+        """Open the cache, creating the SQLite file if needed
+
+        Args:
+            filename: The SQLite file, next to the cache of OSMnx by default
+            max_entries: The maximum number of pairs kept, the least recently used ones are removed first"""
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(filename)
+        #The pairs only hold the time and the id of the predecessor tree of their row, each tree is stored once, NULL if unreachable
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS times (
+            fingerprint TEXT NOT NULL,
+            algorithm TEXT NOT NULL,
+            source INTEGER NOT NULL,
+            target INTEGER NOT NULL,
+            time REAL NOT NULL,
+            tree INTEGER,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (fingerprint, algorithm, source, target))""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS times_last_used ON times (last_used)")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS trees (
+            id INTEGER PRIMARY KEY,
+            nodes BLOB NOT NULL,
+            predecessors BLOB NOT NULL)""")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def fetch(self, fingerprint, nodes, algorithm):
+        """Get every cached pair between the nodes in a single query
+
+        Args:
+            fingerprint: The fingerprint of the road graph
+            nodes: The nodes to visit
+            algorithm: The name of the shortest path algorithm
+
+        Returns:
+            The (time, tree) tuples found, result[source][target], the pairs of a row computed together share their tree"""
+
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (node INTEGER PRIMARY KEY)")
+        self.connection.execute("DELETE FROM wanted")
+        self.connection.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", [(int(node),) for node in nodes])
+
+        condition = """WHERE fingerprint = ? AND algorithm = ?
+            AND source IN (SELECT node FROM wanted) AND target IN (SELECT node FROM wanted)"""
+        rows = self.connection.execute("SELECT source, target, time, tree FROM times " + condition, (fingerprint, algorithm)).fetchall()
+        self.connection.execute("UPDATE times SET last_used = ? " + condition, (timestamp.time(), fingerprint, algorithm))
+        self.connection.commit()
+
+        trees = {}
+        for tree_id in set(row[3] for row in rows if row[3] is not None):
+            nodes_blob, predecessors_blob = self.connection.execute("SELECT nodes, predecessors FROM trees WHERE id = ?", (tree_id,)).fetchone()
+            predecessors = [None if node == -1 else node for node in np.frombuffer(predecessors_blob, dtype=np.int64).tolist()]
+            trees[tree_id] = dict(zip(np.frombuffer(nodes_blob, dtype=np.int64).tolist(), predecessors))
+
+        result = {}
+        for source, target, time, tree_id in rows:
+            result.setdefault(source, {})[target] = (time, trees.get(tree_id))
+        return result
+
+    def store(self, fingerprint, results, algorithm):
+        """Add the computed pairs to the cache, then remove the least recently used pairs above max_entries
+
+        Args:
+            fingerprint: The fingerprint of the road graph
+            results: The (time, tree) tuples computed, results[source][target]
+            algorithm: The name of the shortest path algorithm"""
+
+        now = timestamp.time()
+        tree_ids = {}
+        rows = []
+        for source, row in results.items():
+            for target, (time, tree) in row.items():
+                if tree is not None and id(tree) not in tree_ids:
+                    #-1 is the predecessor of the root, OSM ids are positive
+                    nodes_blob = np.array(list(tree), dtype=np.int64).tobytes()
+                    predecessors_blob = np.array([-1 if node is None else node for node in tree.values()], dtype=np.int64).tobytes()
+                    cursor = self.connection.execute("INSERT INTO trees (nodes, predecessors) VALUES (?, ?)", (nodes_blob, predecessors_blob))
+                    tree_ids[id(tree)] = cursor.lastrowid
+                rows.append((fingerprint, algorithm, int(source), int(target), float(time), tree_ids.get(id(tree)), now))
+        self.connection.executemany("INSERT OR REPLACE INTO times VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM times").fetchone()
+        if count > self.max_entries:
+            self.connection.execute("""DELETE FROM times WHERE rowid IN
+                (SELECT rowid FROM times ORDER BY last_used LIMIT ?)""", (count - self.max_entries,))
+        #The trees no pair uses anymore, after an eviction or when their pairs were computed again
+        self.connection.execute("DELETE FROM trees WHERE id NOT IN (SELECT DISTINCT tree FROM times WHERE tree IS NOT NULL)")
+        self.connection.commit()
@@ -0,0 +1,109 @@
+import bz2
+import os
+import re
+import sys
+import tempfile
+import time as timestamp
+import xml.etree.ElementTree as ET
+import osmnx as ox
+from graph_tools import GraphStore, TiledGraph
+#Build the routing graph of a region once from a local OpenStreetMap extract, so the solver does not call Overpass.
+#A .pbf extract is converted to XML first, for example with: osmium cat region.osm.pbf -o region.osm.bz2
+
+
+def import_osm_extract(filename, network_type="drive", simplify=True, graph_store=None, tiled_folder=None):
+    """Build the graph of a local extract and add it to the GraphStore, where graph_from_coordinates_array finds it
+    The ways are filtered with the same filter OSMnx sends to Overpass for the network type, then the graph gets
+    the same speeds, travel times and largest strongly connected component as a downloaded graph.
+    :param filename: the .osm or .osm.bz2 extract
+    :param network_type: type of network
+    :param simplify: boolean to simplify the graph
+    :param graph_store: the GraphStore receiving the graph, the default one if None
+    :param tiled_folder: if given, the graph is also written there as a TiledGraph
+    :return: the graph and its bounds (minlat, maxlat, minlon, maxlon)
+    """
+    start = timestamp.time()
+    with tempfile.TemporaryDirectory() as directory:
+        filtered_filename = os.path.join(directory, "filtered.osm")
+        filter_extract(filename, filtered_filename, network_type)
+        graph = ox.graph_from_xml(filtered_filename, bidirectional=network_type in ox.settings.bidirectional_network_types,
+                                  simplify=simplify, retain_all=True)
+    graph = ox.add_edge_speeds(graph)
+    graph = ox.add_edge_travel_times(graph)
+    graph = ox.utils_graph.get_largest_component(graph, strongly=True)
+    end = timestamp.time()
+    print("Time to import the extract: ", end - start)
+
+    latitudes = [data["y"] for _, data in graph.nodes(data=True)]
+    longitudes = [data["x"] for _, data in graph.nodes(data=True)]
+    bounds = (min(latitudes), max(latitudes), min(longitudes), max(longitudes))
+
+    if graph_store is None:
+        graph_store = GraphStore.GraphStore()
+    #The graph of a region is kept whatever the number of graphs downloaded afterwards
+    graph_store.save(graph, bounds, network_type, simplify, pinned=True)
+    if tiled_folder is not None:
+        TiledGraph.write_tiled_graph(graph, tiled_folder)
+    return graph, bounds
+
+def filter_extract(filename, filtered_filename, network_type="drive"):
+    """Write the ways of the extract kept by the filter of the network type and the nodes they use
+    :param filename: the .osm or .osm.bz2 extract
+    :param filtered_filename: the .osm file written
+    :param network_type: type of network
+    """
+    conditions = parse_osm_filter(ox.downloader._get_osm_filter(network_type))
+
+    #First pass to find the nodes of the kept ways, the nodes come before the ways in an extract
+    used_nodes = set()
+    for way in _iterate_elements(filename, "way"):
+        if _keep_way(way, conditions):
+            used_nodes.update(nd.get("ref") for nd in way.iter("nd"))
+
+    with open(filtered_filename, "wb") as file:
+        file.write(b"<?xml version='1.0' encoding='UTF-8'?>\n<osm version=\"0.6\">\n")
+        for element in _iterate_elements(filename, "node", "way"):
+            if (element.tag == "node" and element.get("id") in used_nodes) or (element.tag == "way" and _keep_way(element, conditions)):
+                file.write(ET.tostring(element))
+        file.write(b"</osm>\n")
+
+def parse_osm_filter(osm_filter):
+    """Parse an Overpass filter like ["highway"]["area"!~"yes"] to a list of (key, regex) conditions
+    A condition with a regex keeps the ways where the key is missing or its value does not match the regex,
+    a condition without regex keeps the ways having the key.
+    :param osm_filter: the Overpass filter
+    :return: list of conditions
+    """
+    conditions = []
+    for key, regex in re.findall(r'\["([^"]+)"(?:!~"([^"]*)")?\]', osm_filter):
+        conditions.append((key, re.compile(regex) if regex else None))
+    return conditions
+
+def _keep_way(way, conditions):
+    tags = {tag.get("k"): tag.get("v") for tag in way.iter("tag")}
+    for key, regex in conditions:
+        if regex is None:
+            if key not in tags:
+                return False
+        elif key in tags and regex.search(tags[key]):
+            return False
+    return True
+
+def _iterate_elements(filename, *tags):
+    """Yield the elements of an extract one at a time, without loading the whole file"""
+    opener = bz2.open if filename.endswith(".bz2") else open
+    with opener(filename, "rb") as file:
+        context = ET.iterparse(file, events=("start", "end"))
+        _, root = next(context)
+        for event, element in context:
+            if event == "end" and element.tag in ("node", "way", "relation"):
+                if element.tag in tags:
+                    yield element
+                root.clear()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m graph_tools.OsmImport extract.osm[.bz2] [network_type] [tiled_folder]")
+        sys.exit(1)
+    imported_graph, imported_bounds = import_osm_extract(sys.argv[1], *sys.argv[2:3], tiled_folder=(sys.argv[3:4] or [None])[0])
+    print("Imported", len(imported_graph), "nodes covering", imported_bounds)
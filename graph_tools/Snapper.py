@@ -0,0 +1,190 @@
+import math
+import numpy as np
+from sklearn.neighbors import BallTree
+#Spatial index of a road graph, snapping all the places to the graph in one query.
+
+#Mean radius of the Earth in meters, the one of the haversine distance
+earth_radius = 6371009
+
+
+class Snapper:
+
+    def __init__(self, graph, max_segment=50, nodes=None, node_coordinates=None):
+        """Build the BallTree of the nodes of a graph, the BallTree of the edges is only built by the first snapping to an edge
+
+        Args:
+            graph: The networkx graph, with the x, y of the nodes and the geometry of the simplified edges
+            max_segment: The maximum distance in meters between two indexed points of an edge, the long straight
+                edges get intermediate points so the nearest points always belong to the nearest edges
+            nodes: The nodes to index, every node of the graph if None
+            node_coordinates: The (latitude, longitude) in radians of the nodes, read from the graph if None"""
+
+        self.number_of_nodes = len(graph)
+        self.number_of_edges = graph.number_of_edges()
+        self.max_segment = max_segment
+        self.nodes = np.array(list(graph.nodes) if nodes is None else nodes, dtype=np.int64)
+        if node_coordinates is None:
+            node_coordinates = np.radians([[graph.nodes[node]["y"], graph.nodes[node]["x"]] for node in self.nodes.tolist()])
+        self.node_coordinates = np.asarray(node_coordinates, dtype=np.float64).reshape(-1, 2)
+        self.node_tree = BallTree(self.node_coordinates, metric="haversine")
+        self.point_tree = None
+        self._graph = graph
+
+    def __getstate__(self):
+        #The graph is not saved with the Snapper kept in it, get_snapper attaches it again
+        state = self.__dict__.copy()
+        state["_graph"] = None
+        return state
+
+    def subset(self, graph):
+        """Get the Snapper of a subgraph, like a cropped graph, from the node index of this one without reading the nodes again
+
+        Args:
+            graph: The subgraph, its nodes are nodes of this Snapper
+
+        Returns:
+            The Snapper of the subgraph"""
+
+        kept = np.isin(self.nodes, np.fromiter(graph.nodes, dtype=np.int64, count=len(graph)))
+        return Snapper(graph, self.max_segment, self.nodes[kept], self.node_coordinates[kept])
+
+    def _build_edges(self):
+        """Build the BallTree of points placed along the edges every max_segment meters"""
+        graph = self._graph
+        #Segments of the edges, in (longitude, latitude), with their position along the edge in meters
+        self.edges = []
+        edge_lengths = []
+        edge_times = []
+        segments = []
+        points = []
+        for u, v, key, data in graph.edges(keys=True, data=True):
+            if "geometry" in data:
+                coordinates = list(data["geometry"].coords)
+            else:
+                coordinates = [(graph.nodes[u]["x"], graph.nodes[u]["y"]), (graph.nodes[v]["x"], graph.nodes[v]["y"])]
+            offset = 0.0
+            for (x0, y0), (x1, y1) in zip(coordinates, coordinates[1:]):
+                length = _distance(x0, y0, x1, y1)
+                for step in range(max(1, math.ceil(length / self.max_segment)) + 1):
+                    fraction = step / max(1, math.ceil(length / self.max_segment))
+                    points.append((y0 + fraction * (y1 - y0), x0 + fraction * (x1 - x0), len(segments)))
+                segments.append((x0, y0, x1, y1, len(self.edges), offset))
+                offset += length
+            self.edges.append((u, v, key))
+            edge_lengths.append(offset)
+            edge_times.append(data["travel_time"] if "travel_time" in data else data.get("length", offset) / 8.33) # 30 km/h
+
+        self.edge_lengths = np.array(edge_lengths)
+        self.edge_times = np.array(edge_times)
+        self.segments = np.array(segments, dtype=np.float64).reshape(-1, 6)
+        points = np.array(points, dtype=np.float64).reshape(-1, 3)
+        self.point_segments = points[:, 2].astype(np.int64)
+        self.point_tree = BallTree(np.radians(points[:, :2]), metric="haversine")
+
+    def nearest_nodes(self, coordinates_array, return_distance=False):
+        """Get the nearest node of each coordinates with a single query
+
+        Args:
+            coordinates_array: The list of (latitude, longitude)
+            return_distance: Also return the distance in meters from each coordinates to its node
+
+        Returns:
+            The list of nodes, and the list of distances if return_distance"""
+
+        distances, indices = self.node_tree.query(np.radians(np.asarray(coordinates_array, dtype=np.float64).reshape(-1, 2)), k=1)
+        if return_distance:
+            return self.nodes[indices[:, 0]].tolist(), (distances[:, 0] * earth_radius).tolist()
+        return self.nodes[indices[:, 0]].tolist()
+
+    def nearest_edges(self, coordinates_array, candidates=16):
+        """Get the nearest edge of each coordinates and the projection of the coordinates on it
+
+        Args:
+            coordinates_array: The list of (latitude, longitude)
+            candidates: The number of indexed points whose segments are compared for each coordinates
+
+        Returns:
+            The list of (u, v, key, offset, distance), offset being the distance in meters along the edge from u
+            to the projection and distance the distance in meters from the coordinates to the edge"""
+
+        result = []
+        for edge, along, distance in zip(*self._nearest_edges(coordinates_array, candidates)):
+            u, v, key = self.edges[edge]
+            result.append((u, v, key, along, distance))
+        return result
+
+    def nearest_nodes_by_edge(self, coordinates_array, return_time=False):
+        """Snap each coordinates to the end of its nearest edge that is the closest along the edge
+        Unlike the nearest node, it never takes a node of a parallel street that happens to be closer.
+
+        Args:
+            coordinates_array: The list of (latitude, longitude)
+            return_time: Also return the time in seconds to drive along the edge between the projection of each
+                coordinates and its node, the part of the edge time given by the offset of the projection
+
+        Returns:
+            The list of nodes, and the list of times if return_time"""
+
+        nodes = []
+        times = []
+        for edge, along, _ in zip(*self._nearest_edges(coordinates_array)):
+            u, v, _ = self.edges[edge]
+            length = self.edge_lengths[edge]
+            remaining = along if along <= length / 2 else length - along
+            nodes.append(u if along <= length / 2 else v)
+            times.append(float(self.edge_times[edge] * remaining / length) if length > 0 else 0.0)
+        if return_time:
+            return nodes, times
+        return nodes
+
+    def _nearest_edges(self, coordinates_array, candidates=16):
+        """Get the index of the nearest edge of each coordinates, the offset of the projection along it and the distance to it"""
+        if self.point_tree is None:
+            self._build_edges()
+        coordinates = np.asarray(coordinates_array, dtype=np.float64).reshape(-1, 2)
+        _, indices = self.point_tree.query(np.radians(coordinates), k=min(candidates, len(self.point_segments)))
+        x0, y0, x1, y1, edge, offset = (self.segments[self.point_segments[indices]][:, :, column] for column in range(6))
+
+        #Projection in a local plane around each coordinates, in meters
+        latitude = coordinates[:, 0:1]
+        longitude = coordinates[:, 1:2]
+        scale = np.cos(np.radians(latitude))
+        ax, ay = _plane(x0, y0, longitude, latitude, scale)
+        bx, by = _plane(x1, y1, longitude, latitude, scale)
+        dx, dy = bx - ax, by - ay
+        squared_length = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(squared_length > 0, squared_length, 1), 0, 1)
+        distance = np.hypot(ax + t * dx, ay + t * dy)
+
+        best = np.argmin(distance, axis=1)
+        rows = np.arange(len(coordinates))
+        along = offset[rows, best] + t[rows, best] * np.sqrt(squared_length[rows, best])
+        return edge[rows, best].astype(np.int64).tolist(), along.tolist(), distance[rows, best].tolist()
+
+
+def get_snapper(graph):
+    """Get the Snapper of a graph, built once and kept in graph.graph so it is saved with the graph in the GraphStore
+    :param graph: the networkx graph
+    :return: the Snapper
+    """
+    snapper = graph.graph.get("snapper")
+    if snapper is not None and (snapper.number_of_nodes != len(graph) or snapper.number_of_edges != graph.number_of_edges()):
+        #A graph copied from another one, like a cropped graph, gets the Snapper of the original graph
+        if len(graph) and np.isin(np.fromiter(graph.nodes, dtype=np.int64, count=len(graph)), snapper.nodes).all():
+            snapper = snapper.subset(graph)
+        else:
+            snapper = None
+    if snapper is None:
+        snapper = Snapper(graph)
+    snapper._graph = graph
+    graph.graph["snapper"] = snapper
+    return snapper
+
+def _distance(x0, y0, x1, y1):
+    """Distance in meters between two close points, in the local plane"""
+    scale = math.cos(math.radians((y0 + y1) / 2))
+    return earth_radius * math.radians(math.hypot((x1 - x0) * scale, y1 - y0))
+
+def _plane(x, y, origin_x, origin_y, scale):
+    """Coordinates in meters of points in the local plane of an origin"""
+    return earth_radius * np.radians((x - origin_x) * scale), earth_radius * np.radians(y - origin_y)
@@ -1,64 +1,325 @@
-from graph_tools import ConstructGraph, input_generator
-from algorithms import ant_colony, christofides, pairwise_exchange, astar, dijkstra
+from graph_tools import ConstructGraph, CompiledGraph, MatrixCache, GraphStore, TiledGraph, CommunesGeocoder, Snapper, input_generator
+from algorithms import ant_colony, christofides, pairwise_exchange, lin_kernighan, held_karp, portfolio, cluster_first, astar, dijkstra, contraction_hierarchies
+from algorithms.budget import Budget
 import osmnx as ox
+import math
+from shapely.geometry import LineString, Point
 import time as timestamp
 
-def main_solver(nodes_to_visit, name_algorithm1 = "Dijkstra", name_algorithm2="Christofides"):
+def main_solver(nodes_to_visit, name_algorithm1 = "Dijkstra", name_algorithm2="Christofides", workers=None, use_matrix_cache=True, session=None,
+                time_budget=None, max_iterations=None, seed=None, progress=None):
+    """Find the route visiting all the places
+    :param nodes_to_visit: list of the places to visit
+    :param name_algorithm1: the name of the shortest path algorithm
+    :param name_algorithm2: the name of the TSP algorithm
+    :param workers: the number of processes building the graph of the places, None to use every core
+    :param use_matrix_cache: reuse the paths between the places computed by the previous sessions
+    :param session: the Session of the previous calls, only the places added since the last call are computed
+    :param time_budget: the maximum number of seconds of the TSP algorithm, see tsp_solver
+    :param max_iterations: the maximum number of iterations of the TSP algorithm, see tsp_solver
+    :param seed: the seed of the random TSP algorithms
+    :param progress: function called as progress(iteration, time) each time the TSP algorithm finds a better path
+    :return: the graph, the path, the time and the coordinates of the places in the visiting order
+    """
 
     #select the algorithm to use
     algorithm1 = choose_algorithm(name_algorithm1)
 
+    if session is None:
+        session = Session()
+
     #Get the coordinates of the nodes
-    nodesgeocode = NodesToCoordinates(nodes_to_visit)
+    nodesgeocode = session.geocode(nodes_to_visit)
 
 
-    #Download the graph to run the algorithm on
+    #Download the graph to run the algorithm on, or reuse the one of the session if it covers every place
     start = timestamp.time()
-    nodes_to_visit, graph = graph_from_coordinates_array(nodesgeocode)
+    nodes_to_visit, graph, routing_graph = session.load_graph(nodesgeocode, name_algorithm1)
     end = timestamp.time()
-    print("Time to download the graph: ", end - start)
+    print("Time to get the graph: ", end - start)
     
     #Mesure the time to run the first algorithm
     start = timestamp.time()
     print("Start to create the graph with the algorithm: ", name_algorithm1, "")
+    if name_algorithm2 == "Cluster first" and len(nodesgeocode) > 2:
+        #Only the paths inside the clusters and around their junctions are computed, when the TSP solver asks for them
+        results = []
+        ConnectedSimplifiedGraph = {}
+
+        def matrix(nodes):
+            known, computed = compute_known_paths(routing_graph, nodes, name_algorithm1, algorithm1, workers, use_matrix_cache, session)
+            results.extend((known, computed))
+            part = ConstructGraph.make_graph(nodes, known, computed)
+            for start_node, row in part.items():
+                ConnectedSimplifiedGraph.setdefault(start_node, {}).update(row)
+            return ConstructGraph.to_matrix(part, nodes)[1]
+
+        start = timestamp.time()
+        solution_simplified_path = cluster_first.cluster_first(nodes_to_visit, nodesgeocode, matrix, workers=workers,
+                                                               budget=Budget(time_budget, max_iterations, progress), seed=seed)
+        end = timestamp.time()
+        print("Time to create the graph and solve the TSP problem by clusters: ", end - start)
+        session.update_paths(nodes_to_visit, name_algorithm1, *results)
+        path, time = get_path_time(nodes_to_visit, ConnectedSimplifiedGraph, solution_simplified_path)
+        nodesgeocode = [nodesgeocode[nodes_to_visit.index(node)] for node in solution_simplified_path]
+        #Each leg starts and ends on the edges of its places
+        time += session.access_time(nodesgeocode[:-1]) + session.access_time(nodesgeocode[1:])
+        if graph is None:
+            graph = session.tiled_graph.route_graph(path)
+        return graph, path, time, nodesgeocode
+
     #Create a fully connected graph with only the nodes to visit with the algorithm1
-    ConnectedSimplifiedGraph = ConstructGraph.construct_graph(graph, nodes_to_visit, algorithm1)
+    known, computed = compute_known_paths(routing_graph, nodes_to_visit, name_algorithm1, algorithm1, workers, use_matrix_cache, session)
+    session.update_paths(nodes_to_visit, name_algorithm1, known, computed)
+    ConnectedSimplifiedGraph = ConstructGraph.make_graph(nodes_to_visit, known, computed)
     end = timestamp.time()
     print("Time to create a  the graph: ", end - start)
 
     #If there is only two nodes, we don't need to run the TSP solver
     if len(nodesgeocode) == 2:
-        path = ConnectedSimplifiedGraph[nodes_to_visit[0]][nodes_to_visit[1]]["path"]
-        time = ConnectedSimplifiedGraph[nodes_to_visit[0]][nodes_to_visit[1]]["time"]
+        path = ConstructGraph.get_path(ConnectedSimplifiedGraph, nodes_to_visit[0], nodes_to_visit[1])
+        time = ConnectedSimplifiedGraph[nodes_to_visit[0]][nodes_to_visit[1]]["time"] + session.access_time(nodesgeocode[:2])
+        if graph is None:
+            graph = session.tiled_graph.route_graph(path)
         return graph, path, time, [nodesgeocode[0],nodesgeocode[1]]
 
     else:
         
-        solution_simplified_path = tsp_solver(nodes_to_visit, ConnectedSimplifiedGraph, name_algorithm2)
+        solution_simplified_path = tsp_solver(nodes_to_visit, ConnectedSimplifiedGraph, name_algorithm2, time_budget, max_iterations, seed, progress)
         path, time = get_path_time(nodes_to_visit, ConnectedSimplifiedGraph, solution_simplified_path)
         nodesgeocode = [nodesgeocode[nodes_to_visit.index(node)] for node in solution_simplified_path]
+        time += session.access_time(nodesgeocode[:-1]) + session.access_time(nodesgeocode[1:])
+        if graph is None:
+            graph = session.tiled_graph.route_graph(path)
         return graph, path, time, nodesgeocode
 
-def tsp_solver(nodes, dictionnary, algorithm_name="Christofides"):
-    """Solve the TSP problem with the algorithm chosen.
+def compute_known_paths(routing_graph, nodes, name_algorithm1, algorithm1, workers=None, use_matrix_cache=True, session=None):
+    """Get the paths between the nodes, only the pairs missing from the session and from the cache are computed
+    :param routing_graph: the CompiledGraph of the network
+    :param nodes: list of the nodes
+    :param name_algorithm1: the name of the shortest path algorithm, the key of the paths in the cache
+    :param algorithm1: the shortest path algorithm, given by choose_algorithm
+    :param workers: the number of processes computing the paths, None to use every core
+    :param use_matrix_cache: reuse the paths computed by the previous sessions and store the new ones
+    :param session: the Session of the previous calls
+    :return: the (time, tree) tuples already known and the ones computed, known[start_node][end_node]
+    """
+    known = session.known_paths(nodes, name_algorithm1) if session is not None else {}
+    if use_matrix_cache:
+        with MatrixCache.MatrixCache() as matrix_cache:
+            for start_node, row in matrix_cache.fetch(routing_graph.fingerprint(), nodes, name_algorithm1).items():
+                for end_node, value in row.items():
+                    known.setdefault(start_node, {}).setdefault(end_node, value)
+            computed = ConstructGraph.compute_paths(routing_graph, nodes, algorithm1, workers, known)
+            matrix_cache.store(routing_graph.fingerprint(), computed, name_algorithm1)
+    else:
+        computed = ConstructGraph.compute_paths(routing_graph, nodes, algorithm1, workers, known)
+    return known, computed
+
+class Session:
+
+    def __init__(self, allow_download=True, tiled_graph=None, corridor_width=None, geocoder=None, snap="node", rate_limit=1.0):
+        """Create an empty session.
+        A session keeps in memory the data of the last call of main_solver: the coordinates of the places,
+        the downloaded graph, the node of each place and the paths between them. When the user adds or removes
+        places and submits again, only the rows and columns of the new places are computed.
+        :param allow_download: download the graph when the GraphStore has none containing the places,
+        if False only the graphs imported with OsmImport or already stored are used
+        :param tiled_graph: the TiledGraph of the region, the routing graph is then extracted from its tiles
+        instead of loading a networkx graph, and main_solver returns a graph of the route only
+        :param corridor_width: download the roads around a tour of the places instead of their bounding box, see graph_from_corridor
+        :param geocoder: the geocoder of the place names, a CommunesGeocoder asking Nominatim for the other places if None
+        :param snap: "node" to snap the places to their nearest node, "edge" to the closest end of their nearest edge,
+        the time along the edge between the place and the node is then added to the time of the route, see access_time
+        :param rate_limit: the maximum number of requests per second sent to Nominatim when geocoder is None, None for no limit.
+        The public server allows 1, raise it for a private server so the names are really geocoded concurrently"""
+
+        self.allow_download = allow_download
+        self.tiled_graph = tiled_graph
+        self.corridor_width = corridor_width
+        self.geocoder = geocoder
+        self.snap = snap
+        self.rate_limit = rate_limit
+        self.geocodes = {} #Coordinates of each place name
+        self.graph = None #Downloaded networkx graph, None with a tiled graph
+        self.routing_graph = None #Compiled version of the graph
+        self.bounds = None #(minlat, maxlat, minlon, maxlon) of the nodes of the graph loaded
+        self.snapped_nodes = {} #Node of the graph of each coordinates
+        self.access_times = {} #Time between each coordinates and its node along its snapped edge
+        self.algorithm = None #Name of the algorithm that computed the paths
+        self.paths = {} #(time, predecessor tree) tuples between the nodes, the rows share their tree, paths[start_node][end_node]
+
+    def geocode(self, names):
+        """Return the coordinates of the places, only the new names are sent to the geocoder
+        :param names: list of place names or of (latitude, longitude) tuples, used as they are
+        :return: list of coordinates
+        """
+        missing = [name for name in dict.fromkeys(names) if not isinstance(name, tuple) and name not in self.geocodes]
+        if missing and self.geocoder is None:
+            self.geocoder = CommunesGeocoder.CommunesGeocoder(rate_limit=self.rate_limit)
+        for name, coordinates in zip(missing, NodesToCoordinates(missing, self.geocoder)):
+            self.geocodes[name] = coordinates
+        return [name if isinstance(name, tuple) else self.geocodes[name] for name in names]
+
+    def load_graph(self, coordinates_array, name_algorithm=None):
+        """Return the nodes of the coordinates and the graph, the graph of the session is reused when it contains every coordinates
+        :param coordinates_array: list of coordinates
+        :param name_algorithm: the name of the shortest path algorithm, its preprocessing is built or loaded with the graph, see prepare
+        :return: list of nodes, networkx graph and compiled graph
+        """
+        #The graph of the previous call, downloaded or extracted from the tiles, is kept with its paths while it covers the places
+        if self.routing_graph is not None and all(self._contains(coordinates) for coordinates in coordinates_array):
+            coordinates_array = list(dict.fromkeys(coordinates_array))
+            if len(coordinates_array) < 2:
+                raise ValueError("The list of coordinates contains only one element")
+            missing = [coordinates for coordinates in coordinates_array if coordinates not in self.snapped_nodes]
+            if missing:
+                if self.graph is None:
+                    self.snapped_nodes.update(zip(missing, TiledGraph.nearest_nodes(self.routing_graph, missing)))
+                else:
+                    self.snapped_nodes.update(zip(missing, snap_coordinates(self.graph, missing, self.snap)))
+            nodes = [self.snapped_nodes[coordinates] for coordinates in coordinates_array]
+            self.prepare(name_algorithm)
+            return nodes, self.graph, self.routing_graph
+
+        if self.tiled_graph is not None:
+            #Only the tiles of the area are read from the disk
+            coordinates_array = list(dict.fromkeys(coordinates_array))
+            if len(coordinates_array) < 2:
+                raise ValueError("The list of coordinates contains only one element")
+            start = timestamp.time()
+            self.routing_graph = self.tiled_graph.extract(coordinates_to_bounds(coordinates_array))
+            self.bounds = self.routing_graph.bounds()
+            nodes = TiledGraph.nearest_nodes(self.routing_graph, coordinates_array)
+            end = timestamp.time()
+            print("Time to extract the tiles: ", end - start)
+            self.graph = None
+            self.snapped_nodes = dict(zip(coordinates_array, nodes))
+            self.access_times = {}
+            self.paths = {}
+            self.prepare(name_algorithm)
+            return nodes, None, self.routing_graph
+
+        nodes, self.graph = graph_from_coordinates_array(coordinates_array, allow_download=self.allow_download, corridor_width=self.corridor_width, snap=self.snap)
+
+        #Compile the graph once to arrays, the shortest path algorithms run on it instead of the networkx graph
+        start = timestamp.time()
+        self.routing_graph = CompiledGraph.compile_graph(self.graph)
+        end = timestamp.time()
+        print("Time to compile the graph: ", end - start)
+
+        #The graph of the store or downloaded covers more than the places, a new place inside it reuses it
+        self.bounds = self.routing_graph.bounds()
+        self.snapped_nodes = dict(zip(dict.fromkeys(coordinates_array), nodes))
+        self.access_times = {}
+        self.paths = {}
+        self.prepare(name_algorithm)
+        return nodes, self.graph, self.routing_graph
+
+    def prepare(self, name_algorithm):
+        """Build or load the preprocessing of the shortest path algorithm on the graph loaded, so the routes do not wait for it
+        The contraction hierarchy is saved by the fingerprint of the graph, the next sessions on the same graph load it.
+        :param name_algorithm: the name of the shortest path algorithm, nothing is done for the algorithms without preprocessing
+        or before a graph is loaded
+        """
+        if name_algorithm == "Contraction hierarchies" and self.routing_graph is not None:
+            start = timestamp.time()
+            contraction_hierarchies.get_hierarchy(self.routing_graph)
+            end = timestamp.time()
+            print("Time to get the contraction hierarchy: ", end - start)
+
+    def access_time(self, coordinates_array):
+        """Return the time to drive between the places and their nodes, added to the legs of the route
+        With the "edge" snapping, a place is the projection of its coordinates on its nearest edge and the time is the part
+        of the edge time given by the offset of the projection from the node, it is 0 with the "node" snapping and a tiled graph.
+        :param coordinates_array: list of coordinates of places of the graph loaded
+        :return: the sum of the times in seconds
+        """
+        if self.snap != "edge" or self.graph is None:
+            return 0
+        missing = [coordinates for coordinates in dict.fromkeys(coordinates_array) if coordinates not in self.access_times]
+        if missing:
+            _, times = Snapper.get_snapper(self.graph).nearest_nodes_by_edge(missing, return_time=True)
+            self.access_times.update(zip(missing, times))
+        return sum(self.access_times[coordinates] for coordinates in coordinates_array)
+
+    def known_paths(self, nodes, algorithm):
+        """Return the paths of the session between the nodes
+        :param nodes: list of nodes
+        :param algorithm: the name of the shortest path algorithm
+        :return: the (time, tree) tuples already computed, known[start_node][end_node]
+        """
+        if algorithm != self.algorithm:
+            return {}
+        nodes = set(nodes)
+        return {start_node: {end_node: value for end_node, value in row.items() if end_node in nodes}
+                for start_node, row in self.paths.items() if start_node in nodes}
+
+    def update_paths(self, nodes, algorithm, *results):
+        """Keep the paths between the nodes for the next call, the rows and columns of the removed nodes are dropped
+        :param nodes: list of nodes
+        :param algorithm: the name of the shortest path algorithm
+        :param results: the (time, tree) tuples, results[start_node][end_node]
+        """
+        nodes = set(nodes)
+        self.algorithm = algorithm
+        self.paths = {}
+        for result in results:
+            for start_node, row in result.items():
+                if start_node in nodes:
+                    self.paths.setdefault(start_node, {}).update((end_node, value) for end_node, value in row.items() if end_node in nodes)
+
+    def _contains(self, coordinates):
+        """Check if the coordinates are inside the area of the nodes of the graph loaded, or in its corridor"""
+        minlat, maxlat, minlon, maxlon = self.bounds
+        latitude, longitude = coordinates
+        if self.graph is not None and "corridor" in self.graph.graph:
+            return self.graph.graph["corridor"].covers(Point(float(longitude), float(latitude)))
+        return minlat <= float(latitude) <= maxlat and minlon <= float(longitude) <= maxlon
+
+#Names of the algorithms of tsp_solver, "Cluster first" is run by main_solver itself
+tsp_algorithms = ["Ant Algorithm", "MAX-MIN Ant System", "Christofides", "Pairwise exchange", "Lin-Kernighan", "Held-Karp", "Portfolio"]
+
+def tsp_solver(nodes, dictionnary, algorithm_name="Christofides", time_budget=None, max_iterations=None, seed=None, progress=None):
+    """Solve the TSP problem with the algorithm chosen, the rounds of up to held_karp.automatic_max_nodes nodes are solved exactly.
     :param graph: the graph of the network
     :param nodes: the list of nodes to visit
     :param dictionnary: the graph representation
     :param algorithm_name: the name of the algorithm to use
+    :param time_budget: the maximum number of seconds of the algorithm, it then returns the best path found so far, no limit if None.
+    Lin-Kernighan and Portfolio, which would never stop, get their default time budget
+    :param max_iterations: the maximum number of iterations of the algorithm, no limit if None
+    :param seed: the seed of the random algorithms
+    :param progress: function called as progress(iteration, time) each time the algorithm finds a better path
     :return: the path to take
     """
 
+    #The name is checked first, the small rounds would hide a wrong name
+    if algorithm_name not in tsp_algorithms:
+        raise NameError("Unknown algorithm")
+
     #Solve the TSP problem with the algorithm2
     start = timestamp.time()
-    if(algorithm_name == "Ant Algorithm"):        
-        colony = ant_colony.ant_colony(dictionnary, nodes[0],n_ants=25, omega=75, rho=0.1, beta=3)
-        simplified_solution_path = colony.run()
+    budget = Budget(time_budget, max_iterations, progress)
+    if len(set(nodes)) <= held_karp.automatic_max_nodes or algorithm_name == "Held-Karp":
+        #The small rounds are solved exactly, faster than with the heuristics
+        simplified_solution_path, optimal = held_karp.held_karp(dictionnary, nodes, budget=budget)
+        if not optimal:
+            print("The tour is not proved optimal, the time budget was spent first")
+    elif(algorithm_name == "Ant Algorithm"):        
+        colony = ant_colony.ant_colony(dictionnary, nodes[0],n_ants=25, omega=75, rho=0.1, beta=3, seed=seed)
+        simplified_solution_path = colony.run(budget)
+    elif algorithm_name == "MAX-MIN Ant System":
+        colony = ant_colony.max_min_ant_system(dictionnary, nodes[0], seed=seed)
+        simplified_solution_path = colony.run(budget)
     elif algorithm_name == "Christofides":
-        simplified_solution_path = christofides.christofides(dictionnary)
+        simplified_solution_path = christofides.christofides(dictionnary, budget=budget)
     elif algorithm_name == "Pairwise exchange":
-        simplified_solution_path = pairwise_exchange.pairwise_exchange(dictionnary, nodes, len(nodes))
-    else:
-        raise NameError("Unknown algorithm")
+        simplified_solution_path = pairwise_exchange.pairwise_exchange(dictionnary, nodes, budget)
+    elif algorithm_name == "Lin-Kernighan":
+        simplified_solution_path = lin_kernighan.lin_kernighan(dictionnary, nodes, budget, seed=seed)
+    elif algorithm_name == "Portfolio":
+        simplified_solution_path = portfolio.portfolio(dictionnary, nodes, budget, seed)
     end = timestamp.time()
 
     print("Time to solve the TSP problem: ", end - start)
@@ -71,7 +332,10 @@ def choose_algorithm(algorithm="Dijkstra"):
     :return: the function of the algorithm"""
     algorithm_dictionary = {
         "Dijkstra": dijkstra.dijkstra,
-        "A*": astar.astar
+        "A*": astar.astar,
+        "A* landmarks (ALT)": astar.astar_alt,
+        "Dijkstra one-to-many": dijkstra.dijkstra_one_to_many,
+        "Contraction hierarchies": contraction_hierarchies.contraction_hierarchies_many_to_many
     }
     function = algorithm_dictionary.get(algorithm)
     if function is None:
@@ -82,6 +346,7 @@ def choose_algorithm(algorithm="Dijkstra"):
 def get_path_time(nodes, dictionnary, simplified_path):
     """
     This function takes a list of nodes and returns the path and the time to go through it
+    Only the paths of the legs of the tour are rebuilt from the predecessor trees of the graph
     :param nodes: list of nodes
     :param dictionnary: dictionnary of the graph
     :param simplified_path: list of nodes
@@ -89,29 +354,35 @@ def get_path_time(nodes, dictionnary, simplified_path):
     time = 0
     path = [nodes[0]]
     for i in range(len(simplified_path)-1):
-        path += dictionnary[simplified_path[i]][simplified_path[i+1]]["path"][1:]
+        path += ConstructGraph.get_path(dictionnary, simplified_path[i], simplified_path[i+1])[1:]
         time +=  dictionnary[simplified_path[i]][simplified_path[i+1]]["time"]
     return path, time
 
-def NodesToCoordinates(NodesName):
+def NodesToCoordinates(NodesName, geocoder=None):
     """
     This function takes a list of nodes and returns a list of coordinates
+    The communes are found offline, the other names are sent concurrently to Nominatim
     :param NodesName: list of nodes
+    :param geocoder: the geocoder to use, a CommunesGeocoder if None
     :return: list of coordinates
     """
+    if not NodesName:
+        return []
+    if geocoder is None:
+        with CommunesGeocoder.CommunesGeocoder() as geocoder:
+            return geocoder.geocode(NodesName)
+    return geocoder.geocode(NodesName)
 
-    geocode_list = []
-
-    for NodeName in NodesName:
-        geocode_list.append(ox.geocode(NodeName))
-    
-    return geocode_list
-
-def graph_from_coordinates_array(coordinates_array, simplify=True, network_type='drive'):
+def graph_from_coordinates_array(coordinates_array, simplify=True, network_type='drive', use_store=True, allow_download=True, corridor_width=None, snap="node"):
     """Create a where the list of coordiante is in the graph
     :param coordinates_array: list of coordinates
     :param simplify: boolean to simplify the graph
     :param network_type: type of network
+    :param use_store: reuse a processed graph of the GraphStore containing the area instead of downloading it
+    :param allow_download: download the graph if the GraphStore has none containing the area, else raise ValueError
+    :param corridor_width: if given, download only the roads less than corridor_width meters from a tour of the places
+    instead of the padded bounding box, see graph_from_corridor
+    :param snap: "node" or "edge", see snap_coordinates
     :return: list of nodes and graph
     """
     #If there is the same adress, we remove the duplicates
@@ -123,18 +394,107 @@ def graph_from_coordinates_array(coordinates_array, simplify=True, network_type=
         raise ValueError("The list of coordinates contains only one element")
     
 
-    minlat, maxlat, minlon, maxlon = coordinates_to_bounds(coordinates_array)    
+    bounds = coordinates_to_bounds(coordinates_array)
+    minlat, maxlat, minlon, maxlon = bounds
 
-    graph  = ox.graph_from_bbox(maxlat,minlat,maxlon,minlon, simplify=simplify, network_type=network_type, truncate_by_edge=True)
-    graph = ox.add_edge_speeds(graph)
-    graph = ox.add_edge_travel_times(graph)
-    graph = ox.utils_graph.get_largest_component(graph, strongly=True)
+    graph = None
+    if use_store:
+        graph_store = GraphStore.GraphStore()
+        places_bounds = (min(float(latitude) for latitude, _ in coordinates_array), max(float(latitude) for latitude, _ in coordinates_array),
+                         min(float(longitude) for _, longitude in coordinates_array), max(float(longitude) for _, longitude in coordinates_array))
+        graph = graph_store.find(bounds, network_type, simplify, places_bounds)
 
-    nodes = []
-    for latitude, longitude in coordinates_array:
-        nodes.append(ox.nearest_nodes(graph, float(longitude), float(latitude)))
+    if graph is None and not allow_download:
+        raise ValueError("No stored graph contains the places, import an extract of the region with graph_tools.OsmImport")
+
+    if graph is None and corridor_width is not None:
+        #The corridor is not a rectangle, so it is not added to the GraphStore
+        return graph_from_corridor(coordinates_array, corridor_width, simplify, network_type, snap=snap)
+
+    if graph is None:
+        graph  = ox.graph_from_bbox(maxlat,minlat,maxlon,minlon, simplify=simplify, network_type=network_type, truncate_by_edge=True)
+        graph = ox.add_edge_speeds(graph)
+        graph = ox.add_edge_travel_times(graph)
+        graph = ox.utils_graph.get_largest_component(graph, strongly=True)
+        #Snap before saving, so the spatial index is saved with the graph
+        nodes = snap_coordinates(graph, coordinates_array, snap)
+        if use_store:
+            graph_store.save(graph, bounds, network_type, simplify)
+        return nodes, graph
+
+    return snap_coordinates(graph, coordinates_array, snap), graph
+
+def snap_coordinates(graph, coordinates_array, snap="node"):
+    """Snap all the coordinates to the graph in one query of its spatial index, built once per graph
+    :param graph: the networkx graph
+    :param coordinates_array: list of coordinates
+    :param snap: "node" for the nearest node, "edge" for the end of the nearest edge closest to the projection of the coordinates
+    :return: list of nodes
+    """
+    snapper = Snapper.get_snapper(graph)
+    if snap == "node":
+        return snapper.nearest_nodes(coordinates_array)
+    if snap == "edge":
+        return snapper.nearest_nodes_by_edge(coordinates_array)
+    raise ValueError("Unknown snapping mode")
 
-    return nodes, graph
+def graph_from_corridor(coordinates_array, corridor_width=2000, simplify=True, network_type='drive', max_widening=3, snap="node"):
+    """Create the graph of the roads around a cheap tour of the places, much smaller than the bounding box for spread out places
+    The places are snapped to the largest strongly connected component, like in a bounding box graph, and the corridor
+    is only widened while a place has no node of that component less than corridor_width meters away.
+    :param coordinates_array: list of coordinates without duplicates
+    :param corridor_width: the distance in meters from the tour of the kept roads
+    :param simplify: boolean to simplify the graph
+    :param network_type: type of network
+    :param max_widening: the number of times the width is doubled before downloading the bounding box instead
+    :param snap: "node" or "edge", see snap_coordinates
+    :return: list of nodes and graph, the polygon of the corridor is in graph.graph["corridor"]
+    """
+    for _ in range(max_widening + 1):
+        polygon = coordinates_to_corridor(coordinates_array, corridor_width)
+        graph = ox.graph_from_polygon(polygon, network_type=network_type, simplify=simplify, retain_all=True, truncate_by_edge=True)
+
+        #Every place must be reachable from every other place, a place on a road cut from the rest snaps to the closest road kept
+        graph = ox.utils_graph.get_largest_component(graph, strongly=True)
+        _, distances = Snapper.get_snapper(graph).nearest_nodes(coordinates_array, return_distance=True)
+        if max(distances) <= corridor_width:
+            graph = ox.add_edge_speeds(graph)
+            graph = ox.add_edge_travel_times(graph)
+            graph.graph["corridor"] = polygon
+            return snap_coordinates(graph, coordinates_array, snap), graph
+
+        print("The places are not near the connected roads of a corridor of", corridor_width, "meters, widening it")
+        corridor_width *= 2
+
+    return graph_from_coordinates_array(coordinates_array, simplify, network_type, use_store=False, snap=snap)
+
+def coordinates_to_corridor(coordinates_array, corridor_width):
+    """Get the polygon of the points less than corridor_width meters from the nearest neighbour tour of the coordinates
+    :param coordinates_array: list of coordinates
+    :param corridor_width: the width in meters on each side of the tour
+    :return: shapely polygon in latitude, longitude
+    """
+    order = nearest_neighbour_order(coordinates_array)
+    #The tour goes back to the first place like the route found by the TSP solver
+    points = [(float(coordinates_array[i][1]), float(coordinates_array[i][0])) for i in order + order[:1]]
+    tour, crs = ox.projection.project_geometry(LineString(points))
+    corridor, _ = ox.projection.project_geometry(tour.buffer(corridor_width), crs=crs, to_latlong=True)
+    return corridor
+
+def nearest_neighbour_order(coordinates_array):
+    """Order the coordinates by always going to the nearest place not visited yet, starting from the first one
+    :param coordinates_array: list of coordinates
+    :return: list of indices
+    """
+    remaining = set(range(1, len(coordinates_array)))
+    order = [0]
+    while remaining:
+        latitude, longitude = (float(value) for value in coordinates_array[order[-1]])
+        scale = math.cos(math.radians(latitude))
+        nearest = min(remaining, key=lambda i: (float(coordinates_array[i][0]) - latitude) ** 2 + ((float(coordinates_array[i][1]) - longitude) * scale) ** 2)
+        order.append(nearest)
+        remaining.remove(nearest)
+    return order
 
 def coordinates_to_bounds(nodesgeocode):
     """Get the bounds of the coordinates and add a margin
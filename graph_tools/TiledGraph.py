@@ -0,0 +1,193 @@
+import json
+import math
+import os
+import numpy as np
+import networkx as nx
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from graph_tools import Snapper
+from graph_tools.CompiledGraph import CompiledGraph, _csr, _fastest_edges
+#Road graph of a whole region cut in fixed size geographic tiles and stored as .npy arrays opened with numpy.memmap.
+#Opening it reads nothing, a request only pages in the tiles covering its area, and every process opening the
+#same folder shares the same physical pages through the page cache of the system.
+
+#Arrays of the format, the nodes are sorted by tile then by OSM id, so the nodes of a tile are contiguous
+_array_names = ("osm_ids", "x", "y", "indptr", "indices", "times", "lengths", "tile_offsets", "sorted_osm_ids", "sorted_index")
+
+
+class TiledGraph:
+
+    def __init__(self, folder):
+        """Open a tiled graph written by write_tiled_graph, the arrays are memory mapped and read lazily
+
+        Args:
+            folder: The folder of the tiled graph"""
+
+        self.folder = folder
+        with open(os.path.join(folder, "meta.json")) as file:
+            meta = json.load(file)
+        self.tile_size = meta["tile_size"]
+        self.minlat = meta["minlat"]
+        self.minlon = meta["minlon"]
+        self.rows = meta["rows"]
+        self.cols = meta["cols"]
+        self.max_speed = meta["max_speed"]
+        for name in _array_names:
+            setattr(self, name, np.load(os.path.join(folder, name + ".npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.osm_ids)
+
+    def tiles(self, bounds):
+        """Return the (row, first column, last column) of the tiles covering the bounds"""
+        minlat, maxlat, minlon, maxlon = bounds
+        row_min, col_min = self._tile(minlat, minlon)
+        row_max, col_max = self._tile(maxlat, maxlon)
+        return [(row, col_min, col_max) for row in range(row_min, row_max + 1)]
+
+    def extract(self, bounds):
+        """Build the routing graph of the tiles covering the bounds
+        Only the largest strongly connected component is kept, like for a downloaded graph, since the roads
+        leaving the tiles are cut.
+
+        Args:
+            bounds: The (minlat, maxlat, minlon, maxlon) of the requested area, see coordinates_to_bounds
+
+        Returns:
+            The CompiledGraph of the area"""
+
+        #The tiles of a row of tiles are contiguous, so are their nodes and their edges
+        selected = []
+        tails = []
+        heads = []
+        weights = []
+        for row, col_min, col_max in self.tiles(bounds):
+            start = int(self.tile_offsets[row * self.cols + col_min])
+            end = int(self.tile_offsets[row * self.cols + col_max + 1])
+            if start == end:
+                continue
+            indptr = np.asarray(self.indptr[start:end + 1])
+            selected.append(np.arange(start, end))
+            tails.append(np.repeat(np.arange(start, end), np.diff(indptr)))
+            heads.append(np.asarray(self.indices[indptr[0]:indptr[-1]]))
+            weights.append(np.asarray(self.times[indptr[0]:indptr[-1]]))
+        if not selected:
+            raise ValueError("The tiled graph has no road in the area")
+
+        selected = np.concatenate(selected)
+        tails = np.concatenate(tails)
+        heads = np.concatenate(heads)
+        weights = np.concatenate(weights)
+
+        #Keep the edges whose both ends are in the tiles, numbered in the order of the selected nodes
+        local_heads = np.minimum(np.searchsorted(selected, heads), len(selected) - 1)
+        inside = selected[local_heads] == heads
+        local_tails = np.searchsorted(selected, tails[inside])
+        local_heads = local_heads[inside]
+        weights = weights[inside]
+
+        #Largest strongly connected component
+        n = len(selected)
+        adjacency = csr_matrix((np.ones(len(local_tails), dtype=np.int8), (local_tails, local_heads)), shape=(n, n))
+        _, labels = connected_components(adjacency, directed=True, connection="strong")
+        largest = labels == np.argmax(np.bincount(labels))
+
+        #CompiledGraph numbers the nodes in the order of their OSM id
+        kept = selected[largest]
+        osm_ids = np.asarray(self.osm_ids[kept])
+        order = np.argsort(osm_ids, kind="stable")
+        number = np.full(n, -1, dtype=np.int32)
+        number[np.flatnonzero(largest)[order]] = np.arange(len(kept), dtype=np.int32)
+
+        kept_edges = largest[local_tails] & largest[local_heads]
+        new_tails = number[local_tails[kept_edges]]
+        new_heads = number[local_heads[kept_edges]]
+        weights = weights[kept_edges]
+
+        forward_indptr, forward_indices, forward_times = _csr(new_tails, new_heads, weights, len(kept))
+        backward_indptr, backward_indices, backward_times = _csr(new_heads, new_tails, weights, len(kept))
+        kept = kept[order]
+        return CompiledGraph(osm_ids[order], np.asarray(self.x[kept]), np.asarray(self.y[kept]),
+                             forward_indptr, forward_indices, forward_times,
+                             backward_indptr, backward_indices, backward_times, self.max_speed)
+
+    def node_index(self, osm_id):
+        """Return the position of an OSM node in the arrays, raise KeyError if the node is not in the graph"""
+        position = int(np.searchsorted(self.sorted_osm_ids, osm_id))
+        if position == len(self.sorted_osm_ids) or self.sorted_osm_ids[position] != osm_id:
+            raise KeyError(osm_id)
+        return int(self.sorted_index[position])
+
+    def route_graph(self, path):
+        """Build a networkx graph with only the nodes and the edges of a path, enough for ox.plot_route_folium
+
+        Args:
+            path: The OSM ids of the nodes of the path
+
+        Returns:
+            The networkx MultiDiGraph of the path"""
+
+        graph = nx.MultiDiGraph(crs="epsg:4326")
+        for osm_id in dict.fromkeys(path):
+            index = self.node_index(osm_id)
+            graph.add_node(osm_id, x=float(self.x[index]), y=float(self.y[index]))
+        for u, v in zip(path, path[1:]):
+            index = self.node_index(u)
+            start, end = int(self.indptr[index]), int(self.indptr[index + 1])
+            position = start + int(np.flatnonzero(np.asarray(self.indices[start:end]) == self.node_index(v))[0])
+            graph.add_edge(u, v, length=float(self.lengths[position]), travel_time=float(self.times[position]))
+        return graph
+
+    def _tile(self, latitude, longitude):
+        row = min(max(int(math.floor((latitude - self.minlat) / self.tile_size)), 0), self.rows - 1)
+        col = min(max(int(math.floor((longitude - self.minlon) / self.tile_size)), 0), self.cols - 1)
+        return row, col
+
+
+def write_tiled_graph(graph, folder, tile_size=0.02):
+    """Write a processed OSMnx graph in the tiled format
+    :param graph: networkx MultiDiGraph with the travel_time and the length of the edges, like the graphs of the GraphStore
+    :param folder: the folder written
+    :param tile_size: the side of a tile in degrees
+    """
+    os.makedirs(folder, exist_ok=True)
+    nodes = list(graph.nodes)
+    x = np.array([graph.nodes[node]["x"] for node in nodes], dtype=np.float64)
+    y = np.array([graph.nodes[node]["y"] for node in nodes], dtype=np.float64)
+    minlat, minlon = float(y.min()), float(x.min())
+    rows = int((y.max() - minlat) // tile_size) + 1
+    cols = int((x.max() - minlon) // tile_size) + 1
+
+    #Sort the nodes by tile, then by OSM id
+    tile = ((y - minlat) // tile_size).astype(np.int64) * cols + ((x - minlon) // tile_size).astype(np.int64)
+    osm_ids = np.array(nodes, dtype=np.int64)
+    order = np.lexsort((osm_ids, tile))
+    osm_ids, x, y, tile = osm_ids[order], x[order], y[order], tile[order]
+    index = {osm_id: i for i, osm_id in enumerate(osm_ids.tolist())}
+    tile_offsets = np.zeros(rows * cols + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tile, minlength=rows * cols), out=tile_offsets[1:])
+
+    #The same edges as the CompiledGraph of the graph, so the two representations route alike
+    tails, heads, times, lengths, max_speed = _fastest_edges(graph, index)
+    indptr, indices, times, lengths = _csr(tails, heads, times, len(osm_ids), lengths)
+
+    sorted_index = np.argsort(osm_ids, kind="stable")
+    arrays = {"osm_ids": osm_ids, "x": x, "y": y, "indptr": indptr, "indices": indices,
+              "times": times, "lengths": lengths, "tile_offsets": tile_offsets,
+              "sorted_osm_ids": osm_ids[sorted_index], "sorted_index": sorted_index}
+    for name in _array_names:
+        np.save(os.path.join(folder, name + ".npy"), arrays[name])
+    with open(os.path.join(folder, "meta.json"), "w") as file:
+        json.dump({"tile_size": tile_size, "minlat": minlat, "minlon": minlon, "rows": rows, "cols": cols,
+                   "max_speed": max_speed}, file)
+
+def nearest_nodes(routing_graph, coordinates_array):
+    """Get the nearest node of each coordinates in a compiled graph, without the networkx graph
+    The nodes are indexed in the same BallTree as the Snapper of a networkx graph and all the places are snapped in one query.
+    :param routing_graph: the CompiledGraph
+    :param coordinates_array: list of (latitude, longitude)
+    :return: list of OSM ids
+    """
+    snapper = Snapper.Snapper(routing_graph, nodes=routing_graph.osm_ids,
+                              node_coordinates=np.radians(np.column_stack((routing_graph.y, routing_graph.x))))
+    return snapper.nearest_nodes(coordinates_array)
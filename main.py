@@ -18,6 +18,8 @@ import graph_tools.TSP_solver as tsp_solver
 class Form(QWidget):
     def __init__(self):
         super().__init__()
+        # Keep the graph and the paths between the places from one submit to the next
+        self.session = tsp_solver.Session()
         self.preload()
         self.initUI()
 
@@ -85,12 +87,22 @@ class Form(QWidget):
         # Create the drop-down menu
         self.algorithmComboBox1 = QComboBox()
         self.algorithmComboBox1.addItem("A*")
+        self.algorithmComboBox1.addItem("A* landmarks (ALT)")
         self.algorithmComboBox1.addItem("Dijkstra")
+        self.algorithmComboBox1.addItem("Dijkstra one-to-many")
+        self.algorithmComboBox1.addItem("Contraction hierarchies")
+        # Build the preprocessing of the algorithm chosen on the graph already loaded, before the next submit
+        self.algorithmComboBox1.currentTextChanged.connect(self.session.prepare)
 
         self.algorithmComboBox2 = QComboBox()
         self.algorithmComboBox2.addItem("Ant Algorithm")
+        self.algorithmComboBox2.addItem("MAX-MIN Ant System")
         self.algorithmComboBox2.addItem("Christofides")
         self.algorithmComboBox2.addItem("Pairwise exchange")
+        self.algorithmComboBox2.addItem("Lin-Kernighan")
+        self.algorithmComboBox2.addItem("Held-Karp")
+        self.algorithmComboBox2.addItem("Portfolio")
+        self.algorithmComboBox2.addItem("Cluster first")
 
         # Create the button and connect it to the handleButtonClick() method
         self.button = QPushButton("Submit")
@@ -172,7 +184,7 @@ class Form(QWidget):
         # Call the construct_graph method, passing the start and end locations as arguments
         try:
             graph, route, time, geocode_list = tsp_solver.main_solver(
-                input_list, name_algorithm1=self.algorithmComboBox1.currentText(), name_algorithm2=self.algorithmComboBox2.currentText())
+                input_list, name_algorithm1=self.algorithmComboBox1.currentText(), name_algorithm2=self.algorithmComboBox2.currentText(), session=self.session)
             print("The time to travel the route is: ", time, " seconds")
             # Create a QLabel widget to display the time
             # divide time by 3600 to get the number of hours
@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import threading
+import time as timestamp
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from graph_tools import Geocoder
+#Tests of the Geocoder against a fake Nominatim /search endpoint served by a thread.
+
+
+class FakeNominatim(ThreadingHTTPServer):
+
+    def __init__(self, delay=0.0):
+        """Serve /search on a free local port
+
+        Args:
+            delay: The number of seconds each answer takes"""
+
+        super().__init__(("127.0.0.1", 0), _SearchHandler)
+        self.delay = delay
+        self.queries = [] #(time of the request, query) of every request received
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def endpoint(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+class _SearchHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query).get("q", [""])[0]
+        with server.lock:
+            server.queries.append((timestamp.monotonic(), query))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            timestamp.sleep(server.delay)
+            if url.path != "/search":
+                self.send_error(404)
+                return
+            #The coordinates are made from the length of the query, "unknown" places are not found
+            results = [] if "unknown" in query else [{"lat": str(47 + len(query) / 100), "lon": str(6 + len(query) / 100)}]
+            body = json.dumps(results).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class GeocoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache_filename = os.path.join(self.folder.name, "geocode.sqlite")
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop()
+        self.folder.cleanup()
+
+    def make_geocoder(self, delay=0.0, **options):
+        self.server = FakeNominatim(delay)
+        options.setdefault("cache_filename", self.cache_filename)
+        return Geocoder.Geocoder(endpoint=self.server.endpoint(), timeout=5, **options)
+
+    def test_concurrent_requests(self):
+        addresses = ["Place %d, France" % i for i in range(8)]
+        with self.make_geocoder(delay=0.2, workers=4, rate_limit=None) as geocoder:
+            coordinates = geocoder.geocode(addresses)
+
+        self.assertEqual(len(self.server.queries), 8)
+        #The answers are slow, so the requests sent concurrently are in flight at the same time
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertLessEqual(self.server.max_in_flight, 4)
+        self.assertEqual(coordinates, [(47 + len(address) / 100, 6 + len(address) / 100) for address in addresses])
+
+    def test_rate_limit(self):
+        addresses = ["Place %d, France" % i for i in range(5)]
+        with self.make_geocoder(workers=4, rate_limit=10) as geocoder:
+            geocoder.geocode(addresses)
+
+        times = sorted(time for time, _ in self.server.queries)
+        self.assertEqual(len(times), 5)
+        #The requests are received with some jitter, so the whole span is checked rather than each interval
+        self.assertGreaterEqual(times[-1] - times[0], 0.35)
+
+    def test_cache_hits(self):
+        with self.make_geocoder(rate_limit=None) as geocoder:
+            first = geocoder.geocode(["Belfort, France", "Danjoutin, France"])
+            #Another spelling of the same addresses, and an address twice in the same call
+            second = geocoder.geocode(["  belfort ,France", "Danjoutin,  France", "Belfort, France"])
+
+        self.assertEqual(len(self.server.queries), 2)
+        self.assertEqual(second, [first[0], first[1], first[0]])
+
+        #The cache is persistent, a new geocoder does not ask the server again
+        with Geocoder.Geocoder(endpoint=self.server.endpoint(), cache_filename=self.cache_filename, rate_limit=None) as geocoder:
+            self.assertEqual(geocoder.geocode(["Belfort, France"]), first[:1])
+        self.assertEqual(len(self.server.queries), 2)
+
+    def test_ttl_expiry(self):
+        with self.make_geocoder(rate_limit=None, ttl=0.2) as geocoder:
+            geocoder.geocode(["Belfort, France"])
+            geocoder.geocode(["Belfort, France"])
+            self.assertEqual(len(self.server.queries), 1)
+            timestamp.sleep(0.3)
+            geocoder.geocode(["Belfort, France"])
+
+        self.assertEqual(len(self.server.queries), 2)
+
+    def test_without_cache(self):
+        with self.make_geocoder(rate_limit=None, cache_filename=None) as geocoder:
+            geocoder.geocode(["Belfort, France"])
+            geocoder.geocode(["Belfort, France"])
+
+        self.assertEqual(len(self.server.queries), 2)
+
+    def test_not_found(self):
+        with self.make_geocoder(rate_limit=None) as geocoder:
+            with self.assertRaises(ValueError):
+                geocoder.geocode(["unknown place"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from graph_tools import GraphStore, OsmImport, TSP_solver
+#End to end test of the offline routing: the synthetic sample extract is imported into a temporary GraphStore, then
+#main_solver routes on it without any network call.
+
+sample_filename = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "testtools", "belfort_sample.osm")
+
+
+def _no_network(*args, **kwargs):
+    raise AssertionError("network call")
+
+
+class OsmImportTest(unittest.TestCase):
+
+    def setUp(self):
+        #The stores and caches of main_solver are relative to the working directory, so they are created in the folder
+        self.folder = tempfile.TemporaryDirectory()
+        self.working_directory = os.getcwd()
+        os.chdir(self.folder.name)
+        patcher = mock.patch("requests.Session.request", _no_network)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        self.folder.cleanup()
+
+    def test_import(self):
+        graph_store = GraphStore.GraphStore(os.path.join("cache", "graphs"))
+        graph, bounds = OsmImport.import_osm_extract(sample_filename, graph_store=graph_store)
+
+        self.assertEqual(bounds, (47.63, 47.6475, 6.85, 6.8745))
+        #The footway, the private service road and the parking aisle are not roads of the drive network
+        for node in (2000, 2001, 2002):
+            self.assertNotIn(node, graph)
+        self.assertTrue(all("travel_time" in data for _, _, data in graph.edges(data=True)))
+        self.assertIsNotNone(graph_store.find(bounds))
+
+    def test_main_solver_offline(self):
+        OsmImport.import_osm_extract(sample_filename)
+        places = [(47.6305, 6.8505), (47.645, 6.870), (47.638, 6.862), (47.6475, 6.8735)]
+
+        for name_algorithm1 in ("Dijkstra", "Dijkstra one-to-many", "Contraction hierarchies"):
+            session = TSP_solver.Session(allow_download=False)
+            graph, path, time, order = TSP_solver.main_solver(places, name_algorithm1, "Christofides", workers=1, session=session)
+
+            self.assertEqual(order[0], places[0])
+            self.assertEqual(order[-1], places[0])
+            self.assertEqual(sorted(order[:-1]), sorted(places))
+            self.assertEqual(path[0], path[-1])
+            self.assertTrue(all(graph.has_edge(u, v) for u, v in zip(path, path[1:])))
+            self.assertGreater(time, 0)
+
+    def test_session_reuses_the_graph(self):
+        OsmImport.import_osm_extract(sample_filename)
+        session = TSP_solver.Session(allow_download=False)
+        places = [(47.6305, 6.8505), (47.632, 6.853), (47.634, 6.852), (47.633, 6.856)]
+        TSP_solver.main_solver(places, "Dijkstra one-to-many", "Christofides", workers=1, use_matrix_cache=False, session=session)
+        graph = session.graph
+
+        #A new place outside the padded area of the first places but inside the graph loaded, a crop of the region graph,
+        #keeps the graph and the paths already known
+        computed = []
+        compute_paths = TSP_solver.ConstructGraph.compute_paths
+        with mock.patch.object(TSP_solver.ConstructGraph, "compute_paths",
+                               lambda *args: computed.append(compute_paths(*args)) or computed[-1]):
+            TSP_solver.main_solver(places + [(47.6365, 6.859)], "Dijkstra one-to-many", "Christofides", workers=1,
+                                   use_matrix_cache=False, session=session)
+
+        self.assertIs(session.graph, graph)
+        self.assertEqual(sum(len(row) for row in computed[0].values()), 2 * len(places))
+
+    def test_places_outside_the_extract(self):
+        OsmImport.import_osm_extract(sample_filename)
+        session = TSP_solver.Session(allow_download=False)
+
+        with self.assertRaises(ValueError):
+            TSP_solver.main_solver([(48.0, 2.0), (48.1, 2.1)], session=session)
+
+
+if __name__ == "__main__":
+    unittest.main()